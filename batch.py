@@ -0,0 +1,252 @@
+"""
+Generates pre-surgery reports and post-surgery documents for many patients without the web app,
+e.g. overnight for the next day's list.
+
+Cases come from a JSON manifest (a list of cases) or from a directory holding one sub-directory per case
+with a case.json in it. File paths are relative to the manifest or the case directory.
+
+    {"id": "bed-12", "kind": "pre_surgery", "surgery_name": "Laparoscopic Appendectomy", "patient_age": "42",
+     "prescriptions": ["rx.pdf"], "lab_reports": ["cbc.pdf"], "scans": ["ct.pdf", "xray.png"]}
+
+    {"id": "bed-7", "kind": "post_surgery", "surgery_details": "details.pdf",
+     "surgeon_conversation": "conversation.pdf", "patient_condition": "condition.pdf"}
+
+Run from the repository root:
+    python batch.py cases/ --output batch_output --concurrency 4 --provider-limits groq=4
+"""
+import argparse
+import io
+import json
+import os
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from crews.pre_surgery_crew import pre_surgery_report_crew
+from crews.post_surgery_pipeline import post_surgery_pipeline
+
+from helper_functions.convert_to_pdf import convert_to_pdf
+from helper_functions.extraction_engine import extract_uploads, join_category_text
+from helper_functions.task_graph import limit_providers_globally, provider_limits
+
+# Manifest field of each pre-surgery upload category
+PRE_SURGERY_FILES = {"prescription": "prescriptions", "lab_report": "lab_reports", "scan": "scans"}
+
+# Manifest fields of the post-surgery documents, in the order the pipeline takes them
+POST_SURGERY_FILES = ("surgery_details", "surgeon_conversation", "patient_condition")
+
+# File each generated document is written to
+DOCUMENT_FILES = {
+    "pre_surgery_report": "pre_surgery_report.pdf",
+    "report": "post_surgery_report.pdf",
+    "faqs": "post_surgery_faqs.pdf",
+    "checklist": "post_surgery_checklist.pdf",
+}
+
+
+class CaseFile(io.FileIO):
+    """
+    A case document opened from disk, named and sized like a file uploaded through the app.
+    """
+
+    def __init__(self, path: str):
+        super().__init__(path, "rb")
+        self.name = os.path.basename(path)
+        self.size = os.path.getsize(path)
+
+
+def load_cases(source: str) -> list:
+    """
+    Reads the cases of a manifest file or a directory of case directories, resolving their file paths.
+    A case without an id is named after its position, e.g. "case-3", so it still gets its own output directory.
+    Raises ValueError if two cases share an id, as they would overwrite each other's output.
+    """
+    if os.path.isdir(source):
+        entries = []
+        for name in sorted(os.listdir(source)):
+            case_file = os.path.join(source, name, "case.json")
+            if os.path.isfile(case_file):
+                with open(case_file) as file:
+                    entries.append((os.path.join(source, name), {"id": name, **json.load(file)}))
+    else:
+        with open(source) as file:
+            entries = [(os.path.dirname(os.path.abspath(source)), case) for case in json.load(file)]
+
+    cases = []
+    for number, (base, case) in enumerate(entries, start=1):
+        if case.get("id") in (None, ""):
+            case["id"] = f"case-{number}"
+        for field in list(PRE_SURGERY_FILES.values()) + list(POST_SURGERY_FILES):
+            if isinstance(case.get(field), list):
+                case[field] = [os.path.join(base, path) for path in case[field]]
+            elif isinstance(case.get(field), str):
+                case[field] = os.path.join(base, case[field])
+        cases.append(case)
+
+    ids = [str(case["id"]) for case in cases]
+    duplicates = sorted({case_id for case_id in ids if ids.count(case_id) > 1})
+    if duplicates:
+        raise ValueError(f"Case ids must be unique; repeated: {', '.join(duplicates)}")
+    return cases
+
+
+def extract_case_files(uploads):
+    """
+    Extracts (category, path) pairs through the app's extraction pool. Returns the results and the failures.
+    """
+    files = [(category, CaseFile(path)) for category, path in uploads]
+    try:
+        results = extract_uploads(files)
+    finally:
+        for _, file in files:
+            file.close()
+    return results, [f"{result.name}: {result.error}" for result in results if result.error]
+
+
+def run_pre_surgery_case(case: dict, timings: dict):
+    uploads = [(category, path) for category, field in PRE_SURGERY_FILES.items() for path in case.get(field, [])]
+    start = time.perf_counter()
+    results, errors = extract_case_files(uploads)
+    timings["extraction_seconds"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    report = pre_surgery_report_crew(
+        surgery_name=case["surgery_name"],
+        patient_age=str(case.get("patient_age", "")),
+        prescription_text=join_category_text(results, "prescription"),
+        lab_report_text=join_category_text(results, "lab_report"),
+        scans_text=join_category_text(results, "scan"),
+    )
+    timings["crew_seconds"] = time.perf_counter() - start
+    return {"pre_surgery_report": str(report)}, errors
+
+
+def run_post_surgery_case(case: dict, timings: dict):
+    start = time.perf_counter()
+    results, errors = extract_case_files([(field, case[field]) for field in POST_SURGERY_FILES])
+    timings["extraction_seconds"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    documents, savings = post_surgery_pipeline(*[result.text for result in results])
+    timings["crew_seconds"] = time.perf_counter() - start
+    return {document: str(text) for document, text in documents.items()}, errors
+
+
+CASE_RUNNERS = {"pre_surgery": run_pre_surgery_case, "post_surgery": run_post_surgery_case}
+
+
+def run_case(case: dict, output_dir: str, force: bool = False) -> dict:
+    """
+    Generates one case's documents, writing each as a PDF and the whole outcome to result.json.
+    A case whose result.json says it is done is skipped unless force is set.
+    """
+    case_dir = os.path.join(output_dir, str(case["id"]))
+    result_file = os.path.join(case_dir, "result.json")
+    if not force and os.path.isfile(result_file):
+        with open(result_file) as file:
+            previous = json.load(file)
+        if previous.get("status") == "done":
+            return {**previous, "status": "skipped"}
+
+    os.makedirs(case_dir, exist_ok=True)
+    outcome = {"id": case["id"], "kind": case.get("kind"), "status": "done", "documents": {},
+               "extraction_errors": [], "error": None}
+    timings = {}
+    start = time.perf_counter()
+    try:
+        if case.get("kind") not in CASE_RUNNERS:
+            raise ValueError(f"Unknown case kind: {case.get('kind')}")
+        documents, outcome["extraction_errors"] = CASE_RUNNERS[case["kind"]](case, timings)
+        for document, text in documents.items():
+            with open(os.path.join(case_dir, DOCUMENT_FILES[document]), "wb") as file:
+                file.write(convert_to_pdf(text).getvalue())
+        outcome["documents"] = documents
+    except Exception as e:
+        print(f"Case {outcome['id']} failed: {e}")
+        outcome["status"] = "failed"
+        outcome["error"] = str(e)
+    timings["total_seconds"] = time.perf_counter() - start
+    outcome["timings"] = timings
+
+    with open(result_file, "w") as file:
+        json.dump(outcome, file, indent=2)
+    return outcome
+
+
+def _percentile(values, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def summarize(outcomes: list, wall_seconds: float) -> dict:
+    """
+    Counts the outcomes and summarizes throughput and each stage's latency over the cases that ran.
+    """
+    ran = [outcome for outcome in outcomes if outcome["status"] != "skipped"]
+    done = [outcome for outcome in ran if outcome["status"] == "done"]
+    summary = {
+        "cases": len(outcomes),
+        "done": len(done),
+        "failed": len(ran) - len(done),
+        "skipped": len(outcomes) - len(ran),
+        "wall_seconds": wall_seconds,
+        "cases_per_hour": len(done) / wall_seconds * 3600 if wall_seconds else 0.0,
+        "latency_seconds": {},
+    }
+    for stage in ("extraction_seconds", "crew_seconds", "total_seconds"):
+        values = [outcome["timings"][stage] for outcome in done if stage in outcome["timings"]]
+        if values:
+            summary["latency_seconds"][stage] = {
+                "mean": statistics.mean(values),
+                "p50": _percentile(values, 0.5),
+                "p95": _percentile(values, 0.95),
+                "max": max(values),
+            }
+    return summary
+
+
+def format_summary(summary: dict) -> str:
+    lines = [f"{summary['cases']} cases: {summary['done']} done, {summary['failed']} failed, "
+             f"{summary['skipped']} skipped in {summary['wall_seconds']:.0f}s "
+             f"({summary['cases_per_hour']:.1f} cases/hour)"]
+    for stage, latency in summary["latency_seconds"].items():
+        lines.append(f"  {stage.replace('_seconds', '')}: mean {latency['mean']:.1f}s, p50 {latency['p50']:.1f}s, "
+                     f"p95 {latency['p95']:.1f}s, max {latency['max']:.1f}s")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("cases", help="a JSON manifest or a directory of case directories")
+    parser.add_argument("--output", default="batch_output", help="directory the PDFs and JSON results are written to")
+    parser.add_argument("--concurrency", type=int, default=2, help="cases processed at once")
+    parser.add_argument("--provider-limits", default="",
+                        help='agent tasks at once per provider across all cases, e.g. "groq=4"; '
+                             'applies to crews run as a task graph (CREW_EXECUTION=graph)')
+    parser.add_argument("--force", action="store_true", help="regenerate cases already done")
+    args = parser.parse_args()
+
+    try:
+        cases = load_cases(args.cases)
+    except ValueError as e:
+        parser.error(str(e))
+    limit_providers_globally(provider_limits(args.provider_limits))
+    os.makedirs(args.output, exist_ok=True)
+
+    start = time.perf_counter()
+    outcomes = []
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        futures = [executor.submit(run_case, case, args.output, args.force) for case in cases]
+        for future in as_completed(futures):
+            outcome = future.result()
+            outcomes.append(outcome)
+            print(f"[{len(outcomes)}/{len(cases)}] {outcome['id']}: {outcome['status']}")
+
+    summary = summarize(outcomes, time.perf_counter() - start)
+    with open(os.path.join(args.output, "summary.json"), "w") as file:
+        json.dump(summary, file, indent=2)
+    print(format_summary(summary))
+
+
+if __name__ == "__main__":
+    main()
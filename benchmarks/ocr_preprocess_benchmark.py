@@ -0,0 +1,124 @@
+"""
+Benchmarks the OCR preprocessing pipeline against the previous full-resolution pipeline,
+for preprocessing time, OCR time and character accuracy.
+
+The fixture directory holds images with a same-named .txt file containing the expected text.
+Synthetic phone-photo-sized fixtures can be generated with --generate.
+
+Run from the repository root:
+    python -m benchmarks.ocr_preprocess_benchmark --generate 10
+"""
+import argparse
+import difflib
+import io
+import os
+import random
+import statistics
+import time
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from helper_functions.ocr_helper import preprocess_image, get_reader, perform_ocr
+
+DEFAULT_FIXTURE_DIR = os.path.join("benchmarks", "fixtures", "ocr")
+
+SAMPLE_LINES = [
+    "Amoxicillin 500 mg three times daily for 7 days",
+    "Metformin 850 mg twice daily with meals",
+    "Atorvastatin 20 mg once daily at night",
+    "Aspirin 75 mg once daily, stop 7 days before surgery",
+    "Lisinopril 10 mg once daily",
+    "Paracetamol 1 g every 6 hours as required",
+    "Omeprazole 20 mg before breakfast",
+    "Warfarin 5 mg, INR target 2.0 - 3.0",
+]
+
+
+def full_resolution_preprocess(image_bytes):
+    """
+    The previous pipeline: PIL RGB decode, grayscale, then filters at full resolution.
+    """
+    gray = cv2.cvtColor(np.array(Image.open(io.BytesIO(image_bytes)).convert('RGB')), cv2.COLOR_RGB2GRAY)
+    blurred = cv2.GaussianBlur(gray, (5, 5), 0)
+    thresh = cv2.adaptiveThreshold(blurred, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, 11, 2)
+    return cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, np.ones((3, 3), np.uint8), iterations=1)
+
+
+def generate_fixtures(fixture_dir, count, seed=0):
+    """
+    Writes synthetic 12 MP prescription photos with their expected text.
+    """
+    os.makedirs(fixture_dir, exist_ok=True)
+    rng = random.Random(seed)
+    for number in range(count):
+        image = np.full((4000, 3000, 3), rng.randint(200, 245), np.uint8)
+        lines = rng.sample(SAMPLE_LINES, 5)
+        top = rng.randint(300, 1800)
+        for offset, line in enumerate(lines):
+            cv2.putText(image, line, (rng.randint(100, 400), top + offset * 140),
+                        cv2.FONT_HERSHEY_SIMPLEX, 2.2, (25, 25, 25), 5, cv2.LINE_AA)
+        noise = np.random.default_rng(seed + number).normal(0, 6, image.shape)
+        image = np.clip(image + noise, 0, 255).astype(np.uint8)
+        cv2.imwrite(os.path.join(fixture_dir, f"prescription_{number:02d}.jpg"), image,
+                    [cv2.IMWRITE_JPEG_QUALITY, 90])
+        with open(os.path.join(fixture_dir, f"prescription_{number:02d}.txt"), "w") as file:
+            file.write("\n".join(lines))
+
+
+def load_fixtures(fixture_dir):
+    fixtures = []
+    for name in sorted(os.listdir(fixture_dir)):
+        stem, ext = os.path.splitext(name)
+        expected_path = os.path.join(fixture_dir, stem + ".txt")
+        if ext.lower() in {".jpg", ".jpeg", ".png"} and os.path.exists(expected_path):
+            with open(os.path.join(fixture_dir, name), "rb") as file:
+                image_bytes = file.read()
+            with open(expected_path) as file:
+                fixtures.append((name, image_bytes, file.read()))
+    return fixtures
+
+
+def character_accuracy(expected, actual):
+    normalize = lambda text: " ".join(text.lower().split())
+    return difflib.SequenceMatcher(None, normalize(expected), normalize(actual)).ratio()
+
+
+def run_pipeline(name, preprocess, fixtures, reader):
+    preprocess_times, ocr_times, accuracies = [], [], []
+    for _, image_bytes, expected in fixtures:
+        start = time.perf_counter()
+        image = preprocess(image_bytes)
+        preprocess_times.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        text = perform_ocr(reader, image)
+        ocr_times.append(time.perf_counter() - start)
+        accuracies.append(character_accuracy(expected, text))
+
+    print(f"{name:<16} preprocess={statistics.mean(preprocess_times) * 1000:8.1f}ms "
+          f"ocr={statistics.mean(ocr_times) * 1000:8.1f}ms "
+          f"accuracy={statistics.mean(accuracies):.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--fixtures", default=DEFAULT_FIXTURE_DIR)
+    parser.add_argument("--generate", type=int, default=0, help="generate this many synthetic fixtures first")
+    args = parser.parse_args()
+
+    if args.generate:
+        generate_fixtures(args.fixtures, args.generate)
+    fixtures = load_fixtures(args.fixtures)
+    if not fixtures:
+        parser.error(f"no fixtures in {args.fixtures}; use --generate N")
+
+    reader = get_reader(['en'])
+    print(f"{len(fixtures)} fixtures")
+    run_pipeline("full-resolution", full_resolution_preprocess, fixtures, reader)
+    run_pipeline("resolution-aware", preprocess_image, fixtures, reader)
+
+
+if __name__ == "__main__":
+    main()
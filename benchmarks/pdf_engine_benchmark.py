@@ -0,0 +1,79 @@
+"""
+Benchmarks the installed PDF parsing engines on pages per second and peak memory.
+Each engine runs in its own process so its peak resident memory is measured in isolation.
+
+Run from the repository root:
+    python -m benchmarks.pdf_engine_benchmark --generate-pages 200
+    python -m benchmarks.pdf_engine_benchmark --pdf path/to/lab_report.pdf
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import time
+
+from helper_functions.PDF_text_extractor import iter_pdf_pages, available_pdf_engines
+
+DEFAULT_FIXTURE_PATH = os.path.join("benchmarks", "fixtures", "pdf", "long_report.pdf")
+
+
+def generate_report(path, pages):
+    """
+    Writes a synthetic lab report of roughly the given number of pages.
+    """
+    from helper_functions.convert_to_pdf import convert_to_pdf
+
+    rows = []
+    for number in range(pages * 40):
+        rows.append(f"Haemoglobin {12 + number % 5}.{number % 10} g/dL, platelets {150 + number % 250} x10^9/L, "
+                    f"creatinine {60 + number % 60} umol/L, sample {number}")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as file:
+        file.write(convert_to_pdf("\n".join(rows)).getvalue())
+
+
+def _run_engine(engine, pdf_bytes, workers, queue):
+    baseline_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    pages = 0
+    characters = 0
+    for text in iter_pdf_pages(pdf_bytes, engine=engine, workers=workers):
+        pages += 1
+        characters += len(text)
+    seconds = time.perf_counter() - start
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put((pages, characters, seconds, baseline_kb, peak_kb))
+
+
+def benchmark_engine(engine, pdf_bytes, workers):
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_run_engine, args=(engine, pdf_bytes, workers, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pdf", default=DEFAULT_FIXTURE_PATH)
+    parser.add_argument("--generate-pages", type=int, default=0, help="generate a synthetic report first")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1])
+    args = parser.parse_args()
+
+    if args.generate_pages:
+        generate_report(args.pdf, args.generate_pages)
+    with open(args.pdf, "rb") as file:
+        pdf_bytes = file.read()
+
+    print(f"{args.pdf}: {len(pdf_bytes) / 1e6:.1f} MB")
+    for engine in available_pdf_engines():
+        for workers in args.workers:
+            pages, characters, seconds, baseline_kb, peak_kb = benchmark_engine(engine, pdf_bytes, workers)
+            print(f"{engine:<8} workers={workers:<2} pages={pages:<5} chars={characters:<9} "
+                  f"{pages / seconds:8.1f} pages/s  peak RSS {peak_kb / 1024:7.1f} MB "
+                  f"(+{(peak_kb - baseline_kb) / 1024:.1f} MB while parsing)")
+
+
+if __name__ == "__main__":
+    main()
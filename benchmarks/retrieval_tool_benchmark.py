@@ -0,0 +1,105 @@
+"""
+Benchmarks a query_pinecone tool call in "passages" mode against the nested "qa_chain" mode.
+
+Run from the repository root:
+    python -m benchmarks.retrieval_tool_benchmark
+"""
+import argparse
+import os
+import statistics
+import time
+
+from dotenv import load_dotenv
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_groq import ChatGroq
+
+from helper_functions.knowledge_retrieval import retrieve_passages, answer_with_qa_chain
+from helper_functions.token_counter import count_tokens
+
+load_dotenv()
+
+SAMPLE_QUERIES = [
+    "What are the main risks of a laparoscopic appendectomy?",
+    "Which instruments are needed for a total knee replacement?",
+    "How is bleeding from the cystic artery controlled during cholecystectomy?",
+    "What is the recommended antibiotic prophylaxis before hernia repair?",
+    "What are the steps of a coronary artery bypass graft?",
+]
+
+
+class TokenUsageCallback(BaseCallbackHandler):
+    """
+    Collects the prompt and completion tokens reported by the LLM.
+    """
+    def __init__(self):
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def on_llm_end(self, response, **kwargs):
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        self.prompt_tokens += usage.get("prompt_tokens", 0)
+        self.completion_tokens += usage.get("completion_tokens", 0)
+
+
+def benchmark_passages(queries, repeats):
+    """
+    Times raw-passage retrieval; the tool output is what the calling agent has to read.
+    """
+    latencies, output_tokens = [], []
+    for _ in range(repeats):
+        for query in queries:
+            start = time.perf_counter()
+            result = retrieve_passages(query)
+            latencies.append(time.perf_counter() - start)
+            output_tokens.append(count_tokens(result))
+    return latencies, output_tokens, 0
+
+
+def benchmark_qa_chain(queries, repeats):
+    """
+    Times the nested RetrievalQA chain, including the tokens spent by its extra LLM call.
+    """
+    usage = TokenUsageCallback()
+    llm_model = ChatGroq(
+        model='llama3-70b-8192',
+        temperature=0.5,
+        api_key=os.getenv('GROQ_API_KEY'),
+        callbacks=[usage]
+    )
+    latencies, output_tokens = [], []
+    for _ in range(repeats):
+        for query in queries:
+            start = time.perf_counter()
+            result = answer_with_qa_chain(query, llm_model)
+            latencies.append(time.perf_counter() - start)
+            output_tokens.append(count_tokens(result))
+    return latencies, output_tokens, usage.prompt_tokens + usage.completion_tokens
+
+
+def print_summary(mode, latencies, output_tokens, nested_llm_tokens):
+    """
+    Prints latency percentiles and token use for one mode.
+    """
+    ordered = sorted(latencies)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    print(f"{mode:<10} calls={len(latencies):<4} "
+          f"mean={statistics.mean(latencies) * 1000:8.1f}ms "
+          f"p50={statistics.median(latencies) * 1000:8.1f}ms "
+          f"p95={p95 * 1000:8.1f}ms "
+          f"tool_output_tokens={statistics.mean(output_tokens):7.1f}/call "
+          f"nested_llm_tokens={nested_llm_tokens / len(latencies):7.1f}/call")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--modes", nargs="+", default=["passages", "qa_chain"], choices=["passages", "qa_chain"])
+    args = parser.parse_args()
+
+    runners = {"passages": benchmark_passages, "qa_chain": benchmark_qa_chain}
+    for mode in args.modes:
+        print_summary(mode, *runners[mode](SAMPLE_QUERIES, args.repeats))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+Measures peak memory of handing a bundle of large scans from the upload widget to the decoder,
+with the previous copy-based path and with spooled, memory-mapped uploads.
+Each path runs in its own process so its peak resident memory is measured in isolation.
+
+Run from the repository root:
+    python -m benchmarks.upload_memory_benchmark --generate-mb 200
+"""
+import argparse
+import io
+import multiprocessing
+import os
+import pickle
+import resource
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+from helper_functions.extraction_engine import EXTRACTION_WORKERS
+from helper_functions.ocr_helper import decode_grayscale
+from helper_functions.upload_spool import spooled_uploads
+
+DEFAULT_FIXTURE_DIR = os.path.join("benchmarks", "fixtures", "uploads")
+
+
+class FakeUpload(io.BytesIO):
+    """
+    Stands in for Streamlit's UploadedFile, which is an in-memory buffer with a name and size.
+    """
+
+    def __init__(self, name, data):
+        super().__init__(data)
+        self.name = name
+        self.size = len(data)
+
+
+def generate_bundle(fixture_dir, total_mb, seed=0):
+    """
+    Writes noisy full-page scans, which compress poorly, until the bundle reaches total_mb.
+    """
+    os.makedirs(fixture_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    total = 0
+    number = 0
+    while total < total_mb * 1e6:
+        page = rng.integers(0, 256, (3508, 2480), np.uint8)
+        path = os.path.join(fixture_dir, f"scan_{number:02d}.png")
+        cv2.imwrite(path, page)
+        total += os.path.getsize(path)
+        number += 1
+
+
+def load_bundle(fixture_dir):
+    uploads = []
+    for name in sorted(os.listdir(fixture_dir)):
+        with open(os.path.join(fixture_dir, name), "rb") as file:
+            uploads.append(FakeUpload(name, file.read()))
+    return uploads
+
+
+def _through_call_queue(payloads, decode):
+    """
+    Replays what the process pool does with submitted jobs: up to EXTRACTION_WORKERS + 1 pickled
+    jobs wait in its call queue while the workers unpickle and decode the ones ahead of them.
+    """
+    queued = deque()
+    for payload in payloads:
+        queued.append(pickle.dumps(payload))
+        if len(queued) > EXTRACTION_WORKERS:
+            decode(pickle.loads(queued.popleft()))
+    while queued:
+        decode(pickle.loads(queued.popleft()))
+
+
+def copy_path(uploads):
+    """
+    The previous path: getvalue() for every upload, and the bytes pickled into each job.
+    """
+    items = [upload.getvalue() for upload in uploads]
+    _through_call_queue(items, decode_grayscale)
+
+
+def _decode_spooled(upload):
+    with upload.contents() as data:
+        return decode_grayscale(data)
+
+
+def spooled_path(uploads):
+    """
+    Uploads spooled once to temp files; jobs carry the path and workers decode from a memory map.
+    """
+    with spooled_uploads([("scan", upload) for upload in uploads]) as items:
+        _through_call_queue([upload for _, upload in items], _decode_spooled)
+
+
+PATHS = {"copy": copy_path, "spooled": spooled_path}
+
+
+def _run_path(path_name, fixture_dir, queue):
+    uploads = load_bundle(fixture_dir)
+    baseline_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    PATHS[path_name](uploads)
+    seconds = time.perf_counter() - start
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put((sum(upload.size for upload in uploads), seconds, baseline_kb, peak_kb))
+
+
+def benchmark_path(path_name, fixture_dir):
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_run_path, args=(path_name, fixture_dir, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--fixtures", default=DEFAULT_FIXTURE_DIR)
+    parser.add_argument("--generate-mb", type=int, default=0, help="generate a bundle of this size first")
+    args = parser.parse_args()
+
+    if args.generate_mb:
+        generate_bundle(args.fixtures, args.generate_mb)
+    if not os.path.isdir(args.fixtures) or not os.listdir(args.fixtures):
+        parser.error(f"no bundle in {args.fixtures}; use --generate-mb 200")
+
+    for path_name in PATHS:
+        size, seconds, baseline_kb, peak_kb = benchmark_path(path_name, args.fixtures)
+        print(f"{path_name:<8} bundle={size / 1e6:6.1f} MB  {seconds:6.2f}s  "
+              f"peak RSS {peak_kb / 1024:7.1f} MB (+{(peak_kb - baseline_kb) / 1024:.1f} MB over the uploads)")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,35 +4,27 @@ from dotenv import load_dotenv
 from crewai import Agent, Task, Crew, Process
 from crewai_tools import tool
 
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain.chains import RetrievalQA
-
-from helper_functions.pinecone_vector_store import pinecone_vector_store
-from helper_functions.pinecone_vector_store import embeddings
+from helper_functions.knowledge_retrieval import retrieve_passages, answer_with_qa_chain
+from helper_functions.knowledge_retrieval import active_surgery_scope, detect_procedure
+from helper_functions.llm_factory import create_llm
+from helper_functions.async_crews import run_crew_async, check_cancelled
 
 load_dotenv()
 
-llm_model = ChatGoogleGenerativeAI(
+llm_model = create_llm(
+            "googlegenerativeai",
             model='gemini-1.5-flash',
             verbose=True,
-            temperature=0.5,
-            api_key=os.getenv('GOOGLE_API_KEY')
+            temperature=0.5
         )
 
 @tool
 def query_pinecone(surgeon_query: str):
     "Query pinecone database and retreive relevant information based on the query"
-    vector_store = pinecone_vector_store()
-    embedding = embeddings()
-    knowledge = vector_store.from_existing_index(index_name="surgical-assistant",
-                                                embedding=embedding)
-
-    qa = RetrievalQA.from_chain_type(llm=llm_model,
-                                    chain_type="stuff",
-                                    retriever=knowledge.as_retriever()
-                                )
-    result = qa.invoke(surgeon_query).get("result")
-    return result
+    # "qa_chain" keeps the old behaviour of answering with a nested RetrievalQA LLM call
+    if os.getenv("RETRIEVAL_TOOL_MODE", "passages") == "qa_chain":
+        return answer_with_qa_chain(surgeon_query, llm_model)
+    return retrieve_passages(surgeon_query)
 
 
 def during_surgery_crew(surgeon_query: str, patient_history: str)-> str:
@@ -172,8 +164,18 @@ def during_surgery_crew(surgeon_query: str, patient_history: str)-> str:
         tasks=[manager_task, anatomy_task, infection_prevention_task, risk_analysis_task, expert_surgeon_task],
         verbose=True,
         manager_llm=llm_model,
-        process=Process.sequential
+        process=Process.sequential,
+        # Checkpoints where a cancelled async run stops
+        step_callback=check_cancelled,
+        task_callback=check_cancelled
     )
 
-    result = surgical_crew.kickoff({'surgeon_query': surgeon_query, 'patient_history': patient_history})
-    return result
\ No newline at end of file
+    # The surgery is not entered here, so route knowledge base lookups by the procedure named in the report
+    with active_surgery_scope(detect_procedure(patient_history)):
+        result = surgical_crew.kickoff({'surgeon_query': surgeon_query, 'patient_history': patient_history})
+    return result
+
+
+async def during_surgery_crew_async(surgeon_query: str, patient_history: str, cancel_token=None) -> str:
+    """Async variant of during_surgery_crew; cancelling the awaiting task or cancel_token stops the crew"""
+    return await run_crew_async(during_surgery_crew, surgeon_query, patient_history, cancel_token=cancel_token)
@@ -1,25 +1,29 @@
-import os
 from dotenv import load_dotenv
 
 from crewai import Agent, Task, Crew, Process
 
-from langchain_groq import ChatGroq
 from langchain_community.tools.tavily_search import TavilySearchResults
 
+from helper_functions.llm_factory import create_llm
+from helper_functions.async_crews import run_crew_async, check_cancelled
+from helper_functions.crew_checkpoints import run_checkpointed
+
 load_dotenv()
 
-llm_model = ChatGroq(
+# Cacheable: identical prompts are answered from the LLM cache unless regenerating
+llm_model = create_llm(
+    "groq",
     model='llama3-70b-8192',
     verbose=True,
     temperature=0.5,
-    api_key=os.getenv('GROQ_API_KEY')
+    cacheable=True
 )
 tavily_search  = TavilySearchResults(max_results=1)
 
 
-def post_surgery_checklist_crew(surgery_details: str, surgery_conversation: str, patient_conditions: str) -> str:
+def build_post_surgery_checklist_crew() -> Crew:
     """
-    Crew of agents responsible for generating a comprehensive post-surgery checklist.
+    Builds the post-surgery checklist crew: a manager, eight checklist specialists and the final checklist compiler.
     """
 
     # Agent Definitions
@@ -309,9 +313,23 @@ def post_surgery_checklist_crew(surgery_details: str, surgery_conversation: str,
         ],
         verbose=True,
         manager_llm=llm_model,
-        process=Process.sequential
+        process=Process.sequential,
+        # Checkpoints where a cancelled async run stops
+        step_callback=check_cancelled,
+        task_callback=check_cancelled
     )
 
+    return checklist_crew
+
+
+def post_surgery_checklist_crew(surgery_details: str, surgery_conversation: str, patient_conditions: str, force: bool = False) -> str:
+    """
+    Crew of agents responsible for generating a comprehensive post-surgery checklist.
+    force regenerates every task instead of reusing checkpointed outputs.
+    """
+
+    checklist_crew = build_post_surgery_checklist_crew()
+
     # Initializing the Crew with necessary inputs
 
     initial_inputs = {
@@ -322,5 +340,13 @@ def post_surgery_checklist_crew(surgery_details: str, surgery_conversation: str,
 
     # Executing the Crew
 
-    result = checklist_crew.kickoff(initial_inputs)
+    # Each task's output is checkpointed, so a retry after a failure resumes where the run stopped
+    result = run_checkpointed("post_surgery_checklist", checklist_crew, initial_inputs, force=force)
     return result
+
+
+async def post_surgery_checklist_crew_async(surgery_details: str, surgery_conversation: str, patient_conditions: str, cancel_token=None, force: bool = False) -> str:
+    """
+    Async variant of post_surgery_checklist_crew; cancelling the awaiting task or cancel_token stops the crew.
+    """
+    return await run_crew_async(post_surgery_checklist_crew, surgery_details, surgery_conversation, patient_conditions, force=force, cancel_token=cancel_token)
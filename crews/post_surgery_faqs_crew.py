@@ -1,26 +1,30 @@
-import os
 from dotenv import load_dotenv
 
 from crewai import Agent, Task, Crew, Process
 
-from langchain_groq import ChatGroq
 from langchain_community.tools.tavily_search import TavilySearchResults
 
+from helper_functions.llm_factory import create_llm
+from helper_functions.async_crews import run_crew_async, check_cancelled
+from helper_functions.crew_checkpoints import run_checkpointed
+
 
 load_dotenv()
 
-llm_model = ChatGroq(
+# Cacheable, like the other document crews
+llm_model = create_llm(
+    "groq",
     model='llama3-70b-8192',
     verbose=True,
     temperature=0.5,
-    api_key=os.getenv('GROQ_API_KEY')
+    cacheable=True
 )
 
 tavily_search  = TavilySearchResults(max_results=1)
 
-def surgery_post_faq_crew(surgery_details: str, surgery_conversation: str) -> str:
+def build_post_surgery_faq_crew() -> Crew:
     """
-    Crew of agents responsible for generating comprehensive post-surgery FAQs.
+    Builds the post-surgery FAQ crew: a manager, six FAQ specialists and the final FAQ compiler.
     """
 
     # Agent Definitions
@@ -250,8 +254,23 @@ def surgery_post_faq_crew(surgery_details: str, surgery_conversation: str) -> st
         ],
         verbose=True,
         manager_llm=llm_model,
-        process=Process.sequential  
+        process=Process.sequential,
+        # Checkpoints where a cancelled async run stops
+        step_callback=check_cancelled,
+        task_callback=check_cancelled
     )
+
+    return faq_crew
+
+
+def surgery_post_faq_crew(surgery_details: str, surgery_conversation: str, force: bool = False) -> str:
+    """
+    Crew of agents responsible for generating comprehensive post-surgery FAQs.
+    force regenerates every task instead of reusing checkpointed outputs.
+    """
+
+    faq_crew = build_post_surgery_faq_crew()
+
     # Initializing the Crew with necessary inputs
 
     initial_inputs = {
@@ -261,5 +280,13 @@ def surgery_post_faq_crew(surgery_details: str, surgery_conversation: str) -> st
 
     # Executing the Crew
 
-    result = faq_crew.kickoff(initial_inputs)
+    # Each task's output is checkpointed, so a retry after a failure resumes where the run stopped
+    result = run_checkpointed("post_surgery_faqs", faq_crew, initial_inputs, force=force)
     return result
+
+
+async def surgery_post_faq_crew_async(surgery_details: str, surgery_conversation: str, cancel_token=None, force: bool = False) -> str:
+    """
+    Async variant of surgery_post_faq_crew; cancelling the awaiting task or cancel_token stops the crew.
+    """
+    return await run_crew_async(surgery_post_faq_crew, surgery_details, surgery_conversation, force=force, cancel_token=cancel_token)
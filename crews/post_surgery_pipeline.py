@@ -0,0 +1,238 @@
+from functools import partial
+
+from crewai import Agent, Task, Crew, Process
+
+from crews.post_surgery_report_crew import build_operative_report_crew, llm_model
+from crews.post_surgery_faqs_crew import build_post_surgery_faq_crew, tavily_search
+from crews.post_surgery_checklist_crew import build_post_surgery_checklist_crew
+from helper_functions.task_graph import TaskGraph, provider_limits
+from helper_functions.llm_factory import llm_provider
+from helper_functions.job_queue import report_progress
+from helper_functions.async_crews import run_crew_async, check_cancelled
+from helper_functions.crew_checkpoints import CrewCheckpoints
+from helper_functions.rate_limiter import count_llm_calls
+
+# Agents of the separate crews that only coordinate the others; the task graph does that here
+COORDINATOR_ROLES = {
+    "Operative Report Manager",
+    "Post-Surgery FAQ Manager",
+    "Post-Surgery Checklist Manager",
+}
+
+# Agents of the separate crews that repeat the same analysis, by the shared analysis that replaces them
+SHARED_ANALYSIS_ROLES = {
+    "Medications Recorder": "medications",
+    "Medications Specialist": "medications",
+    "Medication Manager": "medications",
+    "Patient Condition Analyst": "patient_condition",
+    "Risks and Complications Analyst": "complications",
+    "Complications Monitor": "complications",
+}
+
+
+def build_shared_analyses() -> dict:
+    """
+    Builds the analyses the report, FAQ and checklist crews all need, each run once for the three documents.
+    """
+
+    medications_agent = Agent(
+        llm=llm_model,
+        role="Post-Surgery Medications Analyst",
+        goal="Document the medications given during the surgery and those to be taken after it.",
+        backstory=(
+            "This agent records every medication administered during the procedure and every medication prescribed for recovery, "
+            "with dosages, administration times and schedules, and the side effects to watch for."
+        ),
+        verbose=True,
+        allow_delegation=False,
+        tools=[tavily_search]
+    )
+
+    patient_condition_agent = Agent(
+        llm=llm_model,
+        role="Post-Surgery Patient Condition Analyst",
+        goal="Assess and document the patient's condition after surgery.",
+        backstory=(
+            "This agent assesses the patient's status post-surgery, documenting vital signs, recovery progress, and any immediate post-operative observations."
+        ),
+        verbose=True,
+        allow_delegation=False,
+    )
+
+    complications_agent = Agent(
+        llm=llm_model,
+        role="Post-Surgery Complications Analyst",
+        goal="Identify the risks and potential complications after this surgery and the signs that need immediate attention.",
+        backstory=(
+            "This agent focuses on the risks and complications that may arise after surgery, how likely they are, how they are managed, "
+            "and which signs and symptoms mean the patient should seek immediate medical attention."
+        ),
+        verbose=True,
+        allow_delegation=False,
+    )
+
+    medications_task = Task(
+        description=(
+            "1. Review the surgery details: {surgery_details}, surgeon conversation: {surgeon_conversation} and patient condition: {patient_condition}.\n"
+            "2. List all medications administered during the surgical procedure, including dosages and administration times.\n"
+            "3. List all medications prescribed post-surgery, including dosages, administration schedules and potential side effects with how to manage them.\n"
+            "4. Ensure accuracy and clarity for each medication."
+        ),
+        expected_output=(
+            "A complete list of the medications given during the surgery and prescribed after it, with dosages, timings, schedules and side effects."
+        ),
+        agent=medications_agent,
+        tools=[tavily_search]
+    )
+
+    patient_condition_task = Task(
+        description=(
+            "1. Assess the patient's condition after surgery using the surgery details: {surgery_details}, the surgeon conversation during surgery: "
+            "{surgeon_conversation} and the patient condition report: {patient_condition}.\n"
+            "2. Document vital signs, recovery progress, and any immediate post-operative observations.\n"
+            "3. Ensure that all aspects of the patient's post-surgery condition are accurately captured."
+        ),
+        expected_output=(
+            "A detailed account of the patient's condition after surgery, including vital signs, recovery progress, and any immediate observations."
+        ),
+        agent=patient_condition_agent
+    )
+
+    complications_task = Task(
+        description=(
+            "1. Identify the risks and potential complications after surgery based on the surgery details: {surgery_details}, "
+            "conversation: {surgeon_conversation} and patient condition: {patient_condition}.\n"
+            "2. Explain their likelihood and management strategies.\n"
+            "3. List the signs and symptoms that require immediate medical attention and how to respond to them."
+        ),
+        expected_output=(
+            "The post-surgery risks and complications with their likelihood and management, and the warning signs that need immediate attention."
+        ),
+        agent=complications_agent
+    )
+
+    return {
+        "medications": medications_task,
+        "patient_condition": patient_condition_task,
+        "complications": complications_task,
+    }
+
+
+def run_pipeline_task(task, inputs: dict, checkpoints: CrewCheckpoints, name: str, upstream: dict):
+    """
+    Runs one task of the pipeline on its own, or reuses its checkpoint from an earlier attempt with the same
+    inputs; its context tasks' outputs reach it through task.context.
+    """
+    check_cancelled()
+    single_task_crew = Crew(agents=[task.agent], tasks=[task], verbose=True, process=Process.sequential,
+                            step_callback=check_cancelled)
+    return checkpoints.run_task(task, name, lambda: single_task_crew.kickoff(inputs))
+
+
+def post_surgery_task_graph(inputs: dict, checkpoints: CrewCheckpoints):
+    """
+    Declares the combined pipeline: the shared analyses, the remaining specialists of each document's crew,
+    and each crew's compiler depending on its specialists and the shared analyses it uses.
+    Returns the graph, the compiler node of each document, and task counts: how many tasks the separate crews
+    would run, how many of their repeated analyses the shared ones replace, and how many coordinators are dropped.
+    """
+    crews = {
+        "report": build_operative_report_crew(),
+        "faqs": build_post_surgery_faq_crew(),
+        "checklist": build_post_surgery_checklist_crew(),
+    }
+    shared = build_shared_analyses()
+
+    graph = TaskGraph(provider_limits=provider_limits(), on_progress=report_progress)
+    for name, task in shared.items():
+        graph.add_task(name, partial(run_pipeline_task, task, inputs, checkpoints, name),
+                       provider=llm_provider(task.agent.llm))
+
+    compilers = {}
+    task_counts = {"separate": 0, "shared": len(shared), "replaced_by_shared": 0, "coordinators": 0}
+    for document, crew in crews.items():
+        task_counts["separate"] += len(crew.tasks)
+        *specialist_tasks, compiler_task = crew.tasks
+        context_tasks = []
+        depends_on = []
+        for task in specialist_tasks:
+            role = task.agent.role
+            if role in COORDINATOR_ROLES:
+                task_counts["coordinators"] += 1
+                continue
+            if role in SHARED_ANALYSIS_ROLES:
+                task_counts["replaced_by_shared"] += 1
+                shared_name = SHARED_ANALYSIS_ROLES[role]
+                if shared_name not in depends_on:
+                    context_tasks.append(shared[shared_name])
+                    depends_on.append(shared_name)
+                continue
+            name = f"{document}: {role}"
+            graph.add_task(name, partial(run_pipeline_task, task, inputs, checkpoints, name),
+                           provider=llm_provider(task.agent.llm))
+            context_tasks.append(task)
+            depends_on.append(name)
+
+        compiler_task.context = context_tasks
+        compilers[document] = f"{document}: {compiler_task.agent.role}"
+        graph.add_task(compilers[document], partial(run_pipeline_task, compiler_task, inputs, checkpoints, compilers[document]),
+                       depends_on, llm_provider(compiler_task.agent.llm))
+
+    return graph, compilers, task_counts
+
+
+def post_surgery_pipeline(surgery_details: str, surgeon_conversation: str, patient_condition: str, force: bool = False):
+    """
+    Produces the operative report, FAQs and checklist in one run: the shared analyses run once and the three
+    compilers fan out concurrently. Returns the documents by name and a summary of the agent tasks saved.
+    force regenerates every task instead of reusing checkpointed outputs.
+    """
+    # The separate crews name the same inputs differently
+    inputs = {
+        'surgery_details': surgery_details,
+        'surgeon_conversation': surgeon_conversation,
+        'surgery_conversation': surgeon_conversation,
+        'patient_condition': patient_condition,
+        'patient_conditions': patient_condition,
+    }
+
+    # A retry after a failure resumes from the tasks without a checkpoint
+    checkpoints = CrewCheckpoints("post_surgery_pipeline", inputs, force=force)
+    graph, compilers, task_counts = post_surgery_task_graph(inputs, checkpoints)
+    with count_llm_calls() as llm_calls:
+        results = graph.run()
+    if checkpoints.resumed:
+        print(f"Resumed {checkpoints.resumed} tasks from checkpoints")
+    checkpoints.clear()
+
+    savings = llm_call_savings(len(graph.nodes) - checkpoints.resumed, llm_calls["calls"], task_counts)
+    print(savings)
+    print(graph.timing_report())
+    return {document: results[name] for document, name in compilers.items()}, savings
+
+
+def llm_call_savings(tasks_run: int, calls: int, task_counts: dict) -> str:
+    """
+    Describes the provider calls this run made and the calls the separate crews would have made on top:
+    the tasks the pipeline skips, at the calls per task measured in this run. Shared-analysis reuse and
+    dropped coordinators are reported apart, since only the first is deduplicated work.
+    """
+    skipped = task_counts["replaced_by_shared"] - task_counts["shared"] + task_counts["coordinators"]
+    summary = (f"Made {calls} LLM calls for {tasks_run} agent tasks; the three separate crews run "
+               f"{task_counts['separate']} tasks. {task_counts['shared']} shared analyses replaced "
+               f"{task_counts['replaced_by_shared']} repeated ones and {task_counts['coordinators']} coordinator "
+               f"tasks were dropped since the task graph schedules the crews")
+    if not tasks_run or not calls:
+        return summary + ", so no calls were measured to estimate the savings from."
+    calls_per_task = calls / tasks_run
+    return summary + (f": about {skipped * calls_per_task:.0f} LLM calls saved "
+                      f"at the {calls_per_task:.1f} calls per task measured.")
+
+
+async def post_surgery_pipeline_async(surgery_details: str, surgeon_conversation: str, patient_condition: str,
+                                      cancel_token=None, force: bool = False):
+    """
+    Async variant of post_surgery_pipeline; cancelling the awaiting task or cancel_token stops the crews.
+    """
+    return await run_crew_async(post_surgery_pipeline, surgery_details, surgeon_conversation, patient_condition,
+                                force=force, cancel_token=cancel_token)
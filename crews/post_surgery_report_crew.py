@@ -1,24 +1,28 @@
-import os
 from dotenv import load_dotenv
 
 from crewai import Agent, Task, Crew, Process
 
-from langchain_groq import ChatGroq
+
+from helper_functions.llm_factory import create_llm
+from helper_functions.async_crews import run_crew_async, check_cancelled
+from helper_functions.crew_checkpoints import run_checkpointed
 
 load_dotenv()
 
-llm_model = ChatGroq(
+# Opted into the LLM cache: a rerun on the same documents reuses the answers
+llm_model = create_llm(
+    "groq",
     model='llama3-70b-8192',
     verbose=True,
     temperature=0.5,
-    api_key=os.getenv('GROQ_API_KEY')
+    cacheable=True
 )
 
 
-def operative_report_crew(surgery_details: str, surgeon_conversation: str, patient_condition: str) -> str:
+def build_operative_report_crew() -> Crew:
     """
-    Creates a crew of agents responsible for generating comprehensive operative reports.
-    The report includes preoperative and postoperative diagnoses, patient condition after surgery, and all medications used during the procedure.
+    Builds the operative report crew: a manager, the diagnosis, patient condition and medications analysts,
+    and the final report compiler.
     """
 
     # defining agents
@@ -171,9 +175,24 @@ def operative_report_crew(surgery_details: str, surgeon_conversation: str, patie
         ],
         verbose=True,
         manager_llm=llm_model,
-        process=Process.sequential  
+        process=Process.sequential,
+        # Checkpoints where a cancelled async run stops
+        step_callback=check_cancelled,
+        task_callback=check_cancelled
     )
 
+    return operative_crew
+
+
+def operative_report_crew(surgery_details: str, surgeon_conversation: str, patient_condition: str, force: bool = False) -> str:
+    """
+    Creates a crew of agents responsible for generating comprehensive operative reports.
+    The report includes preoperative and postoperative diagnoses, patient condition after surgery, and all medications used during the procedure.
+    force regenerates every task instead of reusing checkpointed outputs.
+    """
+
+    operative_crew = build_operative_report_crew()
+
     # Initializing the Crew with necessary inputs
     initial_inputs = {
         'surgery_details': surgery_details,   
@@ -183,5 +202,13 @@ def operative_report_crew(surgery_details: str, surgeon_conversation: str, patie
 
     # Executing the Crew
 
-    result = operative_crew.kickoff(initial_inputs)
+    # Each task's output is checkpointed, so a retry after a failure resumes where the run stopped
+    result = run_checkpointed("operative_report", operative_crew, initial_inputs, force=force)
     return result
+
+
+async def operative_report_crew_async(surgery_details: str, surgeon_conversation: str, patient_condition: str, cancel_token=None, force: bool = False) -> str:
+    """
+    Async variant of operative_report_crew; cancelling the awaiting task or cancel_token stops the crew.
+    """
+    return await run_crew_async(operative_report_crew, surgery_details, surgeon_conversation, patient_condition, force=force, cancel_token=cancel_token)
@@ -1,65 +1,90 @@
 import os
+from functools import partial
 from dotenv import load_dotenv
 
 from crewai import Agent, Task, Crew, Process
+from crewai.tasks.task_output import TaskOutput
 from crewai_tools import tool
 
-#from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_groq import ChatGroq
-from langchain.chains import RetrievalQA
 from langchain_community.tools.tavily_search import TavilySearchResults
 
-from helper_functions.pinecone_vector_store import pinecone_vector_store
-from helper_functions.pinecone_vector_store import embeddings
+from helper_functions.knowledge_retrieval import retrieve_passages, answer_with_qa_chain
+from helper_functions.knowledge_retrieval import active_surgery_scope
+from helper_functions.retrieval_prefetch import prefetched_retrieval
+from helper_functions.input_condenser import condense_inputs, format_budget_report
+from helper_functions.task_graph import TaskGraph, provider_limits
+from helper_functions.knowledge_packs import KNOWLEDGE_PACKS, get_knowledge_pack, store_knowledge_pack, llm_model_name
+from helper_functions.llm_factory import create_llm, llm_provider
+from helper_functions.job_queue import report_progress
+from helper_functions.async_crews import run_crew_async, check_cancelled
+from helper_functions.crew_checkpoints import CrewCheckpoints, run_checkpointed, task_fingerprint
 
 load_dotenv()
 
 #Initialize the Language Learning Model (LLM)
-llm_model = ChatGroq(
+# Same documents should give the same report, so identical prompts are answered from the LLM cache;
+# Regenerate bypasses it for a fresh draft
+llm_model = create_llm(
+    "groq",
     model='llama3-70b-8192',
     verbose=True,
     temperature=0.5,
-    api_key=os.getenv('GROQ_API_KEY')
+    cacheable=True
 )
 
-# llm_model = ChatGoogleGenerativeAI(
+# llm_model = create_llm(
+#             "googlegenerativeai",
 #             model='gemini-1.5-flash',
 #             verbose=True,
-#             temperature=0.5,
-#             api_key=os.getenv('GOOGLE_API_KEY')
+#             temperature=0.5
 #         )
 
 @tool
 def query_pinecone(surgeon_query: str):
     "Query pinecone database and retreive relevant information based on the query"
 
-    vector_store = pinecone_vector_store()
-    embedding = embeddings()
+    # "qa_chain" keeps the old behaviour of answering with a nested RetrievalQA LLM call
+    if os.getenv("RETRIEVAL_TOOL_MODE", "passages") == "qa_chain":
+        return answer_with_qa_chain(surgeon_query, llm_model)
+    return retrieve_passages(surgeon_query)
 
-    knowledge = vector_store.from_existing_index(index_name="surgical-assistant",
-                                                embedding=embedding)
 
-    qa = RetrievalQA.from_chain_type(llm=llm_model,
-                                    chain_type="stuff",
-                                    retriever=knowledge.as_retriever()
-                                )
-    result = qa.invoke(surgeon_query).get("result")
-    return result
+tavily_search  = TavilySearchResults(max_results=1)    
 
+# The extracted documents the crew's prompts reference, and what each one contains
+DOCUMENT_INPUTS = {
+    'prescription_text': "prescriptions",
+    'lab_report_text': "lab reports",
+    'scans_text': "scan reports",
+}
+
+# Agents whose sections depend on the procedure rather than the patient; they are generated once per
+# procedure into a knowledge pack, from GENERIC_PATIENT_INPUTS, and reused for every patient.
+# The risk analyst and the procedure planner weigh the patient's age, medications and findings, so they
+# run per patient; the patient-specific agents and the chief surgeon adapt the generic sections
+KNOWLEDGE_PACK_ROLES = (
+    "Surgical Instruments Advisor",
+    "Surgical Technique Consultant",
+)
 
-tavily_search  = TavilySearchResults(max_results=1)    
+# Inputs the knowledge pack sections are generated with, so no patient's details end up in them
+GENERIC_PATIENT_INPUTS = {
+    'patient_age': "not specified (give guidance for a typical adult patient)",
+    'prescription_text': "not provided (cover procedure-level considerations only)",
+    'lab_report_text': "not provided (cover procedure-level considerations only)",
+    'scans_text': "not provided (cover procedure-level considerations only)",
+}
 
+# "graph" runs each task as soon as its dependencies are done; "sequential" runs the whole crew in order
+CREW_EXECUTION = os.getenv("CREW_EXECUTION", "graph")
 
-def pre_surgery_report_crew(
-    surgery_name: str,
-    patient_age: str,
-    prescription_text: str,
-    lab_report_text: str,
-    scans_text: str
-) -> str:
+# Keep each task's output after a run, so regenerating with one document swapped only reruns the tasks it reaches
+INCREMENTAL_REGENERATION = os.getenv("INCREMENTAL_REGENERATION", "1") == "1"
 
-    """A functiont takes 5 inputs and generate a detailed pre surgery report containing various instructions and guidance to help
-    the surgeon during surgery"""
+
+def build_pre_surgery_crew() -> Crew:
+    """Builds the pre surgery crew: one specialist agent and task per report section, and the chief surgeon's
+    compilation task last"""
 
     # Defining agents of the crew with updated, precise goals and backstories
     medications_and_prescriptions_summary_agent = Agent(
@@ -306,11 +331,23 @@ def pre_surgery_report_crew(
             "Compile a comprehensive pre-surgery report for {surgery_name} by integrating insights from all specialized agents, including instruments, techniques, risks, complications, and procedural steps."
         ),
         agent=chief_surgeon_agent,
-        tools=[query_pinecone]
+        tools=[query_pinecone],
+        # The compilation is the only task that needs the other agents' outputs
+        context=[
+            medications_and_prescriptions_summary_task,
+            test_results_analysis_task,
+            anesthesia_plan_advisor_task,
+            patient_specific_precaution_task,
+            surgical_risk_analysis_task,
+            surgical_instruments_advisor_task,
+            surgical_technique_consultant_task,
+            complication_forecaster_task,
+            step_by_step_process_task
+        ]
     )
 
     # Defining the crew with the chief surgeon agent as the manager
-    surgical_crew = Crew(
+    return Crew(
         agents=[
             chief_surgeon_agent,  # Manager agent
             medications_and_prescriptions_summary_agent,
@@ -337,16 +374,198 @@ def pre_surgery_report_crew(
         ],
         verbose=True,
         manager_llm=llm_model,
-        process=Process.sequential  # Adjust if Process.interactive is supported
+        process=Process.sequential,  # Adjust if Process.interactive is supported
+        # Checkpoints where a cancelled async run stops
+        step_callback=check_cancelled,
+        task_callback=check_cancelled
     )
 
-    # Initiate the crew with all necessary inputs
-    result = surgical_crew.kickoff({
-        'surgery_name': surgery_name,
-        'patient_age': patient_age,
-        'prescription_text': prescription_text,
-        'lab_report_text': lab_report_text,
-        'scans_text': scans_text
-    })
 
-    return result
\ No newline at end of file
+def pre_surgery_report_crew(
+    surgery_name: str,
+    patient_age: str,
+    prescription_text: str,
+    lab_report_text: str,
+    scans_text: str,
+    force: bool = False
+) -> str:
+
+    """A functiont takes 5 inputs and generate a detailed pre surgery report containing various instructions and guidance to help
+    the surgeon during surgery. force regenerates every task instead of reusing checkpointed outputs"""
+
+    if CREW_EXECUTION == "graph":
+        return stream_pre_surgery_report(surgery_name, patient_age, [
+            ('prescription_text', prescription_text),
+            ('lab_report_text', lab_report_text),
+            ('scans_text', scans_text),
+        ], force=force)
+
+    # The documents are interpolated into most prompts, so oversized ones are condensed to a digest first
+    condensed_inputs, budget_report = condense_inputs({
+        'prescription_text': ("prescriptions", prescription_text),
+        'lab_report_text': ("lab reports", lab_report_text),
+        'scans_text': ("scan reports", scans_text),
+    }, llm_model)
+    print(format_budget_report(budget_report))
+
+    surgical_crew = build_pre_surgery_crew()
+
+    # Initiate the crew with all necessary inputs, routing knowledge base lookups to this surgery
+    # and serving them from a retrieval cache prefetched for it
+    with active_surgery_scope(surgery_name), prefetched_retrieval(surgery_name):
+        result = run_checkpointed("pre_surgery_report", surgical_crew, {
+            'surgery_name': surgery_name,
+            'patient_age': patient_age,
+            'prescription_text': condensed_inputs['prescription_text'],
+            'lab_report_text': condensed_inputs['lab_report_text'],
+            'scans_text': condensed_inputs['scans_text']
+        }, force=force)
+
+    return result
+
+
+def task_document_inputs(task) -> set:
+    """The documents a task depends on: those referenced in its own or its agent's prompts"""
+
+    templates = [task.description, task.expected_output, task.agent.role, task.agent.goal, task.agent.backstory]
+    return {name for name in DOCUMENT_INPUTS if any("{" + name + "}" in template for template in templates)}
+
+
+def run_single_task(task, inputs: dict, upstream: dict, checkpoints: CrewCheckpoints = None):
+    """Runs one task of the crew on its own, with the documents it depends on added to the inputs.
+    With checkpoints, an output checkpointed for the same task fingerprint is reused"""
+
+    check_cancelled()
+    task_inputs = dict(inputs)
+    task_inputs.update({name: value for name, value in upstream.items() if name in DOCUMENT_INPUTS})
+    single_task_crew = Crew(agents=[task.agent], tasks=[task], verbose=True, process=Process.sequential,
+                            step_callback=check_cancelled)
+    if checkpoints is None:
+        return single_task_crew.kickoff(task_inputs)
+    return checkpoints.run_task(task, task.agent.role, lambda: single_task_crew.kickoff(task_inputs),
+                                task_fingerprint(task, task_inputs, upstream))
+
+
+def use_knowledge_pack_section(task, text: str, upstream: dict):
+    """Stands in for a task whose section comes from the knowledge pack, so the compilation still gets it as context"""
+
+    task.output = TaskOutput(description=task.description, agent=task.agent.role, raw=text)
+    return text
+
+
+def extracted_input(name: str) -> str:
+    """The graph input an extracted document is provided as, before its condense task"""
+
+    return f"{name} (extracted)"
+
+
+def condense_document(name: str, checkpoints: CrewCheckpoints, upstream: dict):
+    """Condenses an extracted document to fit the prompts it is interpolated into.
+    With checkpoints, a retry reuses the digest, so the tasks reading it can resume too"""
+
+    text = upstream[extracted_input(name)]
+
+    def condense():
+        condensed_inputs, budget_report = condense_inputs({name: (DOCUMENT_INPUTS[name], text)}, llm_model)
+        print(format_budget_report(budget_report))
+        return condensed_inputs[name]
+
+    return condense() if checkpoints is None else checkpoints.output(name, condense, {name: text})
+
+
+def pre_surgery_task_graph(crew: Crew, inputs: dict, knowledge_pack: dict = None,
+                           checkpoints: CrewCheckpoints = None) -> TaskGraph:
+    """Declares the crew as a dependency graph: each extracted document is condensed by its own task, and every
+    agent task depends on the condensed documents its prompts reference and on its context tasks, so only the
+    chief surgeon's compilation waits for the other agents.
+    With a knowledge pack, its sections are reused and the missing ones generated without patient details"""
+
+    graph = TaskGraph(provider_limits=provider_limits(), on_progress=report_progress)
+    for name in DOCUMENT_INPUTS:
+        graph.add_input(extracted_input(name))
+        graph.add_task(name, partial(condense_document, name, checkpoints), [extracted_input(name)],
+                       llm_provider(llm_model))
+    for task in crew.tasks:
+        role = task.agent.role
+        if knowledge_pack is not None and role in KNOWLEDGE_PACK_ROLES:
+            if role in knowledge_pack:
+                graph.add_task(role, partial(use_knowledge_pack_section, task, knowledge_pack[role]))
+            else:
+                graph.add_task(role, partial(run_single_task, task, {**inputs, **GENERIC_PATIENT_INPUTS},
+                                             checkpoints=checkpoints),
+                               provider=llm_provider(task.agent.llm))
+            continue
+        depends_on = sorted(task_document_inputs(task)) + [context_task.agent.role for context_task in task.context or []]
+        graph.add_task(role, partial(run_single_task, task, inputs, checkpoints=checkpoints), depends_on,
+                       llm_provider(task.agent.llm))
+    return graph
+
+
+def extracted_documents(documents):
+    """Provides each document to the graph as it arrives, to be condensed by its own task while the next one
+    is still being extracted; documents that never arrive are provided empty"""
+
+    provided = set()
+    for name, text in documents:
+        provided.add(name)
+        yield extracted_input(name), text
+    for name in DOCUMENT_INPUTS:
+        if name not in provided:
+            yield extracted_input(name), ""
+
+
+def stream_pre_surgery_report(surgery_name: str, patient_age: str, documents, force: bool = False):
+
+    """Generates the pre surgery report as a dependency graph, possibly while the documents are still being
+    extracted. documents yields (input name, text) pairs as they become available; each specialist task starts
+    as soon as the documents it references are in, and the chief surgeon compiles the report once every
+    specialist is done. force regenerates every task, and the knowledge pack, instead of reusing them"""
+
+    surgical_crew = build_pre_surgery_crew()
+    model = llm_model_name(llm_model)
+    knowledge_pack = None
+    if KNOWLEDGE_PACKS:
+        # A forced run starts from an empty pack, so its sections are generated again and stored
+        knowledge_pack = {} if force else get_knowledge_pack(surgery_name, model)
+    if knowledge_pack:
+        print(f"Reusing {len(knowledge_pack)} knowledge pack sections for {surgery_name}")
+    # The documents are not known up front, so each task's checkpoint is keyed by its fingerprint: the inputs
+    # it reads and its upstream outputs. That also lets a regeneration skip the tasks a changed document never reaches
+    checkpoints = CrewCheckpoints("pre_surgery_report", force=force)
+    graph = pre_surgery_task_graph(surgical_crew, {'surgery_name': surgery_name, 'patient_age': patient_age},
+                                   knowledge_pack, checkpoints)
+
+    with active_surgery_scope(surgery_name), prefetched_retrieval(surgery_name):
+        results = graph.run(extracted_documents(documents))
+    generated_tasks = sum(1 for task in surgical_crew.tasks
+                          if knowledge_pack is None or task.agent.role not in knowledge_pack)
+    if INCREMENTAL_REGENERATION:
+        print(f"Skipped {checkpoints.reused_tasks} of {generated_tasks} tasks whose inputs and upstream outputs "
+              f"were unchanged; ran {generated_tasks - checkpoints.reused_tasks}")
+    else:
+        if checkpoints.resumed:
+            print(f"Resumed {checkpoints.resumed} steps from checkpoints")
+        checkpoints.clear()
+
+    if knowledge_pack is not None and len(knowledge_pack) < len(KNOWLEDGE_PACK_ROLES):
+        store_knowledge_pack(surgery_name, model, {role: str(results[role]) for role in KNOWLEDGE_PACK_ROLES})
+
+    final_task = surgical_crew.tasks[-1].agent.role
+    print(graph.timing_report(final_task))
+    return results[final_task]
+
+
+async def pre_surgery_report_crew_async(
+    surgery_name: str,
+    patient_age: str,
+    prescription_text: str,
+    lab_report_text: str,
+    scans_text: str,
+    cancel_token=None,
+    force: bool = False
+) -> str:
+
+    """Async variant of pre_surgery_report_crew; cancelling the awaiting task or cancel_token stops the crew"""
+
+    return await run_crew_async(pre_surgery_report_crew, surgery_name, patient_age, prescription_text,
+                                lab_report_text, scans_text, force=force, cancel_token=cancel_token)
@@ -1,13 +1,287 @@
-from PyPDF2 import PdfReader
+import mmap
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from io import BytesIO
 
-def extract_text_from_pdf(file):
+from PyPDF2 import PdfReader
+
+from helper_functions.extraction_cache import cached_extraction
+from helper_functions.ocr_helper import ocr_batch, OCR_BATCH_SIZE, OCR_TARGET_DPI
+
+# Parsing engine used when none is given: "pypdf2", or "pymupdf" if PyMuPDF is installed
+PDF_ENGINE = os.getenv("PDF_ENGINE", "pypdf2")
+
+# OCR pages that have no text layer, e.g. a scanned lab report saved as PDF
+PDF_OCR_FALLBACK = os.getenv("PDF_OCR_FALLBACK", "1") == "1"
+
+# Pages with fewer non-whitespace characters than this are treated as scans without a text layer
+MIN_TEXT_LAYER_CHARS = 16
+
+# Processes a single PDF's pages are split across; 1 extracts in the calling process
+PDF_PAGE_WORKERS = int(os.getenv("PDF_PAGE_WORKERS", "1"))
+
+
+def _as_stream(source):
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return BytesIO(source)
+    # Memory-mapped spool files and other file objects are read in place
+    source.seek(0)
+    return source
+
+
+def _as_bytes(source):
+    """
+    Returns the PDF as a bytes-like object, without copying buffers and memory maps.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return source
+    if isinstance(source, mmap.mmap):
+        return memoryview(source)
+    if hasattr(source, "getbuffer"):
+        return source.getbuffer()
+    source.seek(0)
+    return source.read()
+
+
+class PyPDF2Engine:
+    """
+    Pure-Python parsing with PyPDF2, always available.
+    """
+    name = "pypdf2"
+
+    def available(self):
+        return True
+
+    def open(self, source):
+        return PdfReader(_as_stream(source))
+
+    def page_count(self, document):
+        return len(document.pages)
+
+    def page_text(self, document, page_number):
+        return document.pages[page_number].extract_text() or ""
+
+    def page_image(self, document, page_number, dpi):
+        # PyPDF2 can't render; a scanned page is one embedded image, so take the largest
+        images = document.pages[page_number].images
+        return max((image.data for image in images), key=len) if images else None
+
+    def page_long_side_inches(self, document, page_number):
+        box = document.pages[page_number].mediabox
+        return max(float(box.width), float(box.height)) / 72
+
+
+class PyMuPDFEngine:
+    """
+    Parsing with PyMuPDF's C library, several times faster than PyPDF2 on long reports.
+    """
+    name = "pymupdf"
+
+    def available(self):
+        try:
+            import pymupdf
+        except ImportError:
+            return False
+        return True
+
+    def open(self, source):
+        import pymupdf
+        return pymupdf.open(stream=_as_bytes(source), filetype="pdf")
+
+    def page_count(self, document):
+        return document.page_count
+
+    def page_text(self, document, page_number):
+        return document.load_page(page_number).get_text() or ""
+
+    def page_image(self, document, page_number, dpi):
+        import pymupdf
+        pixmap = document.load_page(page_number).get_pixmap(dpi=dpi, colorspace=pymupdf.csGRAY)
+        return pixmap.tobytes("png")
+
+    def page_long_side_inches(self, document, page_number):
+        rect = document.load_page(page_number).rect
+        return max(rect.width, rect.height) / 72
+
+
+PDF_ENGINES = {engine.name: engine for engine in (PyPDF2Engine(), PyMuPDFEngine())}
+
+
+def register_pdf_engine(engine):
+    """
+    Makes a parsing engine available by its name. An engine provides available(), open(source),
+    page_count(document), page_text(document, page_number) and page_image(document, page_number, dpi),
+    and optionally page_long_side_inches(document, page_number) so embedded scans are OCRed at OCR_TARGET_DPI.
+    """
+    PDF_ENGINES[engine.name] = engine
+
+
+def available_pdf_engines():
+    """
+    Returns the names of the engines whose libraries are installed.
+    """
+    return [name for name, engine in PDF_ENGINES.items() if engine.available()]
+
+
+def _extract_page_range(engine_name, pdf_bytes, start, stop):
+    engine = PDF_ENGINES[engine_name]
+    document = engine.open(pdf_bytes)
+    return [engine.page_text(document, page_number) for page_number in range(start, stop)]
+
+
+def _iter_page_texts(engine, document, source, page_count: int, workers: int):
+    """
+    Yields the text of the document's first page_count pages, in order, split across worker processes
+    when workers > 1 and the document is long enough.
+    """
+    if workers <= 1 or page_count < 2 * workers:
+        for page_number in range(page_count):
+            yield engine.page_text(document, page_number)
+        return
+
+    # A pool per document, so no idle workers outlive the extraction (e.g. inside an extraction worker)
+    # Worker processes need their own copy of the bytes
+    pdf_bytes = bytes(_as_bytes(source))
+    range_size = -(-page_count // workers)
+    with ProcessPoolExecutor(max_workers=workers) as page_pool:
+        futures = [page_pool.submit(_extract_page_range, engine.name, pdf_bytes,
+                                    start, min(start + range_size, page_count))
+                   for start in range(0, page_count, range_size)]
+        for future in futures:
+            yield from future.result()
+
+
+def _open_pdf(source, engine: str = None, max_pages: int = None):
+    engine = PDF_ENGINES[engine or PDF_ENGINE]
+    document = engine.open(source)
+    page_count = engine.page_count(document)
+    if max_pages is not None:
+        page_count = min(page_count, max_pages)
+    return engine, document, page_count
+
+
+def iter_pdf_pages(source, engine: str = None, max_pages: int = None, workers: int = None):
+    """
+    Lazily yields the text of each page, in order. source is the PDF as bytes or a file object.
+    max_pages stops after that many pages; workers > 1 splits the pages across processes.
+    """
+    engine, document, page_count = _open_pdf(source, engine, max_pages)
+    yield from _iter_page_texts(engine, document, source, page_count, workers or PDF_PAGE_WORKERS)
+
+
+def has_text_layer(text: str) -> bool:
+    """
+    Checks whether a page's extracted text is real text rather than an empty scan.
+    """
+    return len("".join(text.split())) >= MIN_TEXT_LAYER_CHARS
+
+
+def _ocr_pages(images, page_sizes):
+    start = time.perf_counter()
+    results = ocr_batch(images, page_sizes=page_sizes)
+    return results, time.perf_counter() - start
+
+
+def read_pdf(source, engine: str = None, max_pages: int = None, ocr_fallback: bool = None,
+             workers: int = None) -> dict:
+    """
+    Extracts text from a PDF (bytes, a memory map or a file object) page by page, split across
+    PDF_PAGE_WORKERS processes for long documents. Pages without a text layer are rasterized and OCRed
+    in the background while the remaining pages are extracted.
+    Returns the text with page counts, timings for text-layer and OCR pages, and the errors of pages
+    that could not be OCRed.
+    """
+    ocr_fallback = PDF_OCR_FALLBACK if ocr_fallback is None else ocr_fallback
+    engine, document, page_count = _open_pdf(source, engine, max_pages)
+    page_texts = _iter_page_texts(engine, document, source, page_count, workers or PDF_PAGE_WORKERS)
+
+    texts = []
+    text_seconds = 0.0
+    rasterize_seconds = 0.0
+    jobs = []  # (page numbers, future)
+    pending_pages, pending_images, pending_sizes = [], [], []
+    page_size = getattr(engine, "page_long_side_inches", None)
+    with ThreadPoolExecutor(max_workers=1) as ocr_pool:
+        for page_number in range(page_count):
+            start = time.perf_counter()
+            text = next(page_texts)
+            text_seconds += time.perf_counter() - start
+            texts.append(text)
+            if not ocr_fallback or has_text_layer(text):
+                continue
+
+            start = time.perf_counter()
+            image = engine.page_image(document, page_number, OCR_TARGET_DPI)
+            rasterize_seconds += time.perf_counter() - start
+            if image is None:
+                continue
+            pending_pages.append(page_number)
+            pending_images.append(image)
+            pending_sizes.append(page_size(document, page_number) if page_size else None)
+            if len(pending_images) == OCR_BATCH_SIZE:
+                jobs.append((pending_pages, ocr_pool.submit(_ocr_pages, pending_images, pending_sizes)))
+                pending_pages, pending_images, pending_sizes = [], [], []
+
+        if pending_images:
+            jobs.append((pending_pages, ocr_pool.submit(_ocr_pages, pending_images, pending_sizes)))
+
+        ocr_seconds = rasterize_seconds
+        ocr_errors = []
+        for page_numbers, future in jobs:
+            page_results, seconds = future.result()
+            ocr_seconds += seconds
+            for page_number, page_result in zip(page_numbers, page_results):
+                if page_result.error is not None:
+                    ocr_errors.append(f"page {page_number + 1}: {page_result.error}")
+                else:
+                    texts[page_number] = page_result.text
+
+    ocr_page_count = sum(len(page_numbers) for page_numbers, _ in jobs)
+    return {
+        "text": "".join(texts),
+        "text_pages": page_count - ocr_page_count,
+        "ocr_pages": ocr_page_count,
+        "text_seconds": text_seconds,
+        "ocr_seconds": ocr_seconds,
+        "ocr_errors": ocr_errors,
+    }
+
+
+def read_pdf_text(source, engine: str = None, max_pages: int = None):
+    """
+    Extracts text from a PDF page by page.
+    """
+    return read_pdf(source, engine, max_pages)["text"]
+
+
+def pdf_options(engine: str = None, max_pages: int = None, ocr_fallback: bool = None):
+    """
+    The PDF extraction settings that change the extracted text, as part of the extraction cache key.
+    """
+    ocr_fallback = PDF_OCR_FALLBACK if ocr_fallback is None else ocr_fallback
+    return {"engine": engine or PDF_ENGINE, "max_pages": max_pages,
+            "ocr_fallback": ocr_fallback, "ocr_dpi": OCR_TARGET_DPI if ocr_fallback else None}
+
+
+def extract_pdf(file, engine: str = None, max_pages: int = None, ocr_fallback: bool = None) -> dict:
+    """
+    Extracts text from a PDF file, OCRing scanned pages, and returns it with the page timings.
+    Files already extracted are served from the extraction cache; a PDF with pages that failed OCR
+    is not cached, so those pages are read again next time.
+    """
+    pdf_bytes = _as_bytes(file)
+    options = pdf_options(engine, max_pages, ocr_fallback)
+    pdf = cached_extraction("pdf", pdf_bytes, options,
+                            lambda: read_pdf(file, options["engine"], max_pages, options["ocr_fallback"]),
+                            store_if=lambda result: not result.get("ocr_errors"))
+    if pdf.get("ocr_errors"):
+        print(f"OCR failed on {len(pdf['ocr_errors'])} pages: {'; '.join(pdf['ocr_errors'])}")
+    return pdf
+
+
+def extract_text_from_pdf(file, engine: str = None, max_pages: int = None):
     """
-    Extracts text from a PDF file using PyPDF2.
+    Extracts text from a PDF file. Files already extracted are served from the extraction cache.
     """
-    pdf_reader = PdfReader(BytesIO(file.read()))
-    text = ""
-    for page_num in range(len(pdf_reader.pages)):
-        page = pdf_reader.pages[page_num]
-        text += page.extract_text() or ""
-    return text
\ No newline at end of file
+    return extract_pdf(file, engine, max_pages)["text"]
@@ -0,0 +1,84 @@
+import asyncio
+import contextvars
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+# Crew runs executing at once for all async callers; further runs wait in the queue. CrewAI's LLM calls
+# are blocking, so each running crew still holds one of these threads for its whole run
+ASYNC_CREW_WORKERS = int(os.getenv("ASYNC_CREW_WORKERS", "4"))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class CrewCancelled(BaseException):
+    """
+    Raised inside a crew run whose cancel token was cancelled. Like KeyboardInterrupt it is not an
+    Exception, so the agent executor's retry on errors and other `except Exception` handlers let it through.
+    """
+
+
+class CancelToken:
+    """
+    Cancels a crew run from outside. The run stops at its next agent step or task.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+
+# The token of the crew run this code executes in
+active_cancel_token = contextvars.ContextVar("active_cancel_token", default=None)
+
+
+def check_cancelled(*_):
+    """
+    Raises CrewCancelled if the current crew run was cancelled. Takes and ignores any arguments,
+    so it can be passed as a crew's step_callback or task_callback.
+    """
+    token = active_cancel_token.get()
+    if token is not None and token.cancelled:
+        raise CrewCancelled("Crew run cancelled")
+
+
+def async_crew_executor() -> ThreadPoolExecutor:
+    """
+    Returns the bounded pool the blocking crew calls run on, shared by every async caller.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=ASYNC_CREW_WORKERS, thread_name_prefix="async-crew")
+    return _executor
+
+
+async def run_crew_async(function, *args, cancel_token: CancelToken = None, **kwargs):
+    """
+    Awaits a blocking crew function without blocking the event loop. This is a thread offload, not native
+    async: the run takes one of ASYNC_CREW_WORKERS threads, and awaits beyond that queue for a free one.
+    Cancelling the awaiting task, or the given cancel_token, stops the run: a queued run never starts and
+    a running one stops with CrewCancelled at its next agent step, task or LLM call.
+    """
+    token = cancel_token or CancelToken()
+    context = contextvars.copy_context()
+    context.run(active_cancel_token.set, token)
+
+    def run():
+        check_cancelled()
+        return function(*args, **kwargs)
+
+    future = asyncio.get_running_loop().run_in_executor(async_crew_executor(), partial(context.run, run))
+    try:
+        return await future
+    except asyncio.CancelledError:
+        token.cancel()
+        raise
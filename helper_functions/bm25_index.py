@@ -0,0 +1,197 @@
+import heapq
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter, defaultdict
+
+from langchain_core.documents import Document
+
+from helper_functions.sqlite_cache import cache_path
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-'][a-z0-9]+)*")
+
+
+def tokenize(text: str):
+    """
+    Splits text into lowercase terms, keeping hyphenated drug and instrument names whole.
+    """
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def bm25_index_path() -> str:
+    """
+    Returns where the BM25 index built during ingestion is stored.
+    """
+    return os.getenv("BM25_INDEX_PATH") or cache_path("bm25_index.json")
+
+
+class BM25Index:
+    """
+    In-memory inverted index over the knowledge base chunks, scored with Okapi BM25.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75, partition_fields=()):
+        self.k1 = k1
+        self.b = b
+        self.partition_fields = tuple(partition_fields)
+        self.partitions = {}  # (metadata field, value) -> numbers of the chunks having it
+        self.postings = defaultdict(dict)  # term -> {document number: term frequency}
+        self.documents = []
+        self.document_terms = []
+        self.document_lengths = []
+        self.total_length = 0
+
+    def add_documents(self, documents):
+        """
+        Adds LangChain documents to the index.
+        """
+        for document in documents:
+            self._add(document.page_content, dict(document.metadata), Counter(tokenize(document.page_content)))
+
+    def _add(self, content: str, metadata: dict, terms: dict):
+        number = len(self.documents)
+        for term, frequency in terms.items():
+            self.postings[term][number] = frequency
+        length = sum(terms.values())
+        self.documents.append((content, metadata))
+        self.document_terms.append(dict(terms))
+        self.document_lengths.append(length)
+        self.total_length += length
+
+        for field in self.partition_fields:
+            value = metadata.get(field)
+            if value:
+                self.partitions.setdefault((field, value), set()).add(number)
+
+    def __len__(self):
+        return len(self.documents)
+
+    def contains(self, term: str) -> bool:
+        """
+        Returns True if the term appears in at least one chunk.
+        """
+        return term in self.postings
+
+    def known_values(self, field: str) -> set:
+        """
+        Returns the values of a partitioned metadata field, e.g. every ingested procedure.
+        """
+        return {value for partition_field, value in self.partitions if partition_field == field}
+
+    def idf(self, term: str) -> float:
+        return self._idf(len(self.postings.get(term, ())), len(self.documents))
+
+    @staticmethod
+    def _idf(document_frequency: int, document_count: int) -> float:
+        return math.log(1 + (document_count - document_frequency + 0.5) / (document_frequency + 0.5))
+
+    def _filtered(self, metadata_filter: dict) -> set:
+        # The chunks matching every field of the filter; only partitioned fields can be filtered on
+        numbers = None
+        for field, value in metadata_filter.items():
+            if field not in self.partition_fields:
+                raise ValueError(f"Cannot filter on {field}: the index is partitioned by "
+                                 f"{', '.join(self.partition_fields) or 'no field'}")
+            partition = self.partitions.get((field, value), set())
+            numbers = partition if numbers is None else numbers & partition
+        return numbers
+
+    def search(self, query: str, k: int = 5, metadata_filter: dict = None):
+        """
+        Returns up to k (document, score) pairs ranked by BM25 score. A metadata_filter such as
+        {"procedure": "appendectomy"} searches only the chunks having every given value, scored
+        against the statistics of those chunks alone.
+        """
+        numbers = self._filtered(metadata_filter) if metadata_filter else None
+        if numbers is None:
+            document_count, total_length = len(self.documents), self.total_length
+        else:
+            document_count, total_length = len(numbers), sum(self.document_lengths[number] for number in numbers)
+        if not document_count:
+            return []
+        average_length = total_length / document_count
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if postings and numbers is not None:
+                postings = {number: frequency for number, frequency in postings.items() if number in numbers}
+            if not postings:
+                continue
+            idf = self._idf(len(postings), document_count)
+            for number, frequency in postings.items():
+                length_norm = 1 - self.b + self.b * self.document_lengths[number] / average_length
+                scores[number] += idf * frequency * (self.k1 + 1) / (frequency + self.k1 * length_norm)
+
+        ranked = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        results = []
+        for number, score in ranked:
+            content, metadata = self.documents[number]
+            results.append((Document(page_content=content, metadata=metadata), score))
+        return results
+
+    def save(self, path: str):
+        """
+        Writes the index to disk as JSON, with each chunk's term frequencies so loading doesn't tokenize again.
+        """
+        data = {
+            "k1": self.k1,
+            "b": self.b,
+            "partition_fields": list(self.partition_fields),
+            "documents": [{"content": content, "metadata": metadata, "terms": terms}
+                          for (content, metadata), terms in zip(self.documents, self.document_terms)],
+        }
+        # Written next to the old index and swapped in, so a reader never sees half a file
+        temporary_path = f"{path}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as file:
+            json.dump(data, file, default=str)
+        os.replace(temporary_path, path)
+
+    @staticmethod
+    def load(path: str):
+        """
+        Reads an index written by save().
+        """
+        with open(path, encoding="utf-8") as file:
+            data = json.load(file)
+        index = BM25Index(data["k1"], data["b"], data["partition_fields"])
+        for document in data["documents"]:
+            index._add(document["content"], document["metadata"], document["terms"])
+        return index
+
+
+def build_bm25_index(text_chunks, path: str = None) -> BM25Index:
+    """
+    Builds the BM25 index over the ingested chunks and saves it next to the other local indexes.
+    """
+    global _loaded_index
+    index = BM25Index(partition_fields=("procedure", "specialty"))
+    index.add_documents(text_chunks)
+    path = path or bm25_index_path()
+    index.save(path)
+    with _loaded_lock:
+        _loaded_index = (path, os.path.getmtime(path), index)
+    return index
+
+
+# The index last loaded, with the path and modification time it was loaded from
+_loaded_index = None
+_loaded_lock = threading.Lock()
+
+
+def load_bm25_index():
+    """
+    Returns the BM25 index built during ingestion, or None if ingestion has not built one yet.
+    The index is read again once the file changes, e.g. after another process ingested documents.
+    """
+    global _loaded_index
+    path = bm25_index_path()
+    try:
+        modified = os.path.getmtime(path)
+    except OSError:
+        return None
+    with _loaded_lock:
+        if _loaded_index is None or _loaded_index[:2] != (path, modified):
+            _loaded_index = (path, modified, BM25Index.load(path))
+        return _loaded_index[2]
@@ -0,0 +1,138 @@
+import contextlib
+import os
+import re
+import threading
+
+from crewai import Crew
+from crewai.tasks.task_output import TaskOutput
+
+from helper_functions.job_queue import input_hash
+from helper_functions.knowledge_packs import llm_model_name
+from helper_functions.llm_cache import bypassing_llm_cache
+from helper_functions.sqlite_cache import SQLiteCache, cache_path
+
+# Set to 0 to run every crew from its first task on a retry
+CREW_CHECKPOINTS = os.getenv("CREW_CHECKPOINTS", "1") == "1"
+
+# A failed run can be resumed, and an unchanged task's output reused on regeneration, for this long
+CHECKPOINT_TTL_SECONDS = float(os.getenv("CHECKPOINT_TTL_SECONDS", str(24 * 3600)))
+
+_shared_cache = None
+
+
+def checkpoint_cache() -> SQLiteCache:
+    """
+    Returns the on-disk store of task outputs.
+    """
+    global _shared_cache
+    if _shared_cache is None:
+        _shared_cache = SQLiteCache(cache_path("crew_checkpoints.sqlite"), ttl_seconds=CHECKPOINT_TTL_SECONDS)
+    return _shared_cache
+
+
+class CrewCheckpoints:
+    """
+    The task outputs of one crew run, stored as each task finishes so that a retry with the same
+    inputs resumes from the first task without one. A forced run, e.g. an explicit regeneration,
+    runs every step again and overwrites their checkpoints.
+    """
+
+    def __init__(self, crew_name: str, inputs: dict = None, force: bool = False):
+        self.crew_name = crew_name
+        self.inputs = inputs
+        self.force = force
+        self.resumed = 0
+        self.reused_tasks = 0
+        self._keys = []
+        self._lock = threading.Lock()
+
+    def key(self, name: str, step_inputs: dict = None) -> str:
+        """
+        Checkpoints are keyed by crew, input hash and task. Without run-level inputs, e.g. when the
+        documents stream in, the hash covers the step's own inputs and its upstream outputs.
+        """
+        inputs = self.inputs if step_inputs is None else step_inputs
+        return f"{self.crew_name}:{input_hash(self.crew_name, inputs)}:{name}"
+
+    def output(self, name: str, run, step_inputs: dict = None, force: bool = None) -> str:
+        """
+        Returns the checkpointed output of a step, or calls run() and checkpoints its output.
+        force (by default the run's) skips the lookup but still checkpoints the new output.
+        """
+        return self._output(name, run, step_inputs, force)[0]
+
+    def _output(self, name: str, run, step_inputs: dict = None, force: bool = None):
+        key = self.key(name, step_inputs)
+        with self._lock:
+            self._keys.append(key)
+        force = self.force if force is None else force
+        cached = checkpoint_cache().get(key) if CREW_CHECKPOINTS and not force else None
+        if cached is not None:
+            with self._lock:
+                self.resumed += 1
+            print(f"Resumed {name} of {self.crew_name} from its checkpoint")
+            return cached.decode("utf-8"), True
+
+        # A forced step must not get its old text back from the LLM cache either
+        with bypassing_llm_cache() if force else contextlib.nullcontext():
+            text = str(run())
+        if CREW_CHECKPOINTS:
+            checkpoint_cache().set(key, text.encode("utf-8"))
+        return text, False
+
+    def run_task(self, task, task_name: str, run, task_inputs: dict = None, force: bool = None) -> str:
+        """
+        Runs a crew task through output(), leaving its output on task.output so later tasks get it as context.
+        """
+        text, reused = self._output(task_name, run, task_inputs, force)
+        if reused:
+            with self._lock:
+                self.reused_tasks += 1
+        task.output = TaskOutput(description=task.description, agent=task.agent.role, raw=text)
+        return text
+
+    def clear(self):
+        """
+        Drops this run's checkpoints once it has finished, so the next run generates afresh.
+        """
+        cache = checkpoint_cache()
+        for key in self._keys:
+            cache.delete(key)
+        self._keys = []
+
+
+def task_fingerprint(task, inputs: dict, upstream: dict) -> dict:
+    """
+    Everything a task's output depends on: the inputs its prompts reference, its upstream outputs, its prompts
+    and its model. Checkpointed by this, a task is only run again when one of them changed.
+    """
+    templates = [task.description, task.expected_output, task.agent.role, task.agent.goal, task.agent.backstory]
+    placeholders = set(re.findall(r"{(\w+)}", " ".join(templates)))
+    return {
+        "inputs": {name: value for name, value in inputs.items() if name in placeholders},
+        "upstream": {name: str(value) for name, value in upstream.items()},
+        "prompts": templates,
+        "model": llm_model_name(task.agent.llm),
+    }
+
+
+def run_checkpointed(crew_name: str, crew: Crew, inputs: dict, force: bool = False) -> str:
+    """
+    Runs a sequential crew one task at a time, checkpointing each output. Returns the last task's output.
+    force runs every task again instead of resuming from checkpoints.
+    """
+    checkpoints = CrewCheckpoints(crew_name, inputs, force=force)
+    previous = None
+    for index, task in enumerate(crew.tasks):
+        # The sequential process hands each task the previous task's output unless it names its own context
+        if task.context is None and previous is not None:
+            task.context = [previous]
+        single_task_crew = Crew(agents=[task.agent], tasks=[task], verbose=crew.verbose, process=crew.process,
+                                step_callback=crew.step_callback, task_callback=crew.task_callback)
+        output = checkpoints.run_task(task, f"{index}:{task.agent.role}", lambda: single_task_crew.kickoff(inputs))
+        previous = task
+
+    if checkpoints.resumed:
+        print(f"Resumed {checkpoints.resumed} of {len(crew.tasks)} tasks of {crew_name} from checkpoints")
+    checkpoints.clear()
+    return output
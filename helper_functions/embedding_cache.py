@@ -0,0 +1,76 @@
+import hashlib
+import os
+import unicodedata
+from array import array
+
+from langchain_core.embeddings import Embeddings
+from langchain_huggingface import HuggingFaceEmbeddings
+
+from helper_functions.sqlite_cache import SQLiteCache, cache_path
+
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
+
+_shared_cache = None
+
+
+def embedding_cache() -> SQLiteCache:
+    """
+    Returns the process-wide embedding cache stored on disk.
+    """
+    global _shared_cache
+    if _shared_cache is None:
+        _shared_cache = SQLiteCache(cache_path("embeddings.sqlite"), max_entries=EMBEDDING_CACHE_MAX_ENTRIES)
+    return _shared_cache
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalizes unicode and whitespace so trivially different copies of a text share one cache entry.
+    """
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def embedding_key(model_name: str, text: str) -> str:
+    """
+    Builds the content-hash cache key for a text embedded with the given model.
+    """
+    digest = hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+    return f"{model_name}:{digest}"
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    HuggingFaceEmbeddings wrapper that serves repeated texts from the embedding cache.
+    The transformer model is only loaded once a text misses the cache.
+    """
+
+    def __init__(self, model_name: str, cache: SQLiteCache = None):
+        self.model_name = model_name
+        self.cache = cache or embedding_cache()
+        self._embedding = None
+
+    @property
+    def embedding(self) -> HuggingFaceEmbeddings:
+        if self._embedding is None:
+            self._embedding = HuggingFaceEmbeddings(model_name=self.model_name)
+        return self._embedding
+
+    def embed_documents(self, texts):
+        keys = [embedding_key(self.model_name, text) for text in texts]
+        cached = self.cache.get_many(keys)
+
+        # Embed every missing text once, in a single batch
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = normalize_text(text)
+        if missing:
+            vectors = self.embedding.embed_documents(list(missing.values()))
+            new_entries = {key: array("f", vector).tobytes() for key, vector in zip(missing, vectors)}
+            self.cache.set_many(new_entries)
+            cached.update(new_entries)
+
+        return [array("f", cached[key]).tolist() for key in keys]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
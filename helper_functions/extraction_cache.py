@@ -0,0 +1,69 @@
+import hashlib
+import json
+import os
+
+from helper_functions.sqlite_cache import SQLiteCache, cache_path
+
+# Bump an extractor's version whenever its output for the same bytes can change
+EXTRACTOR_VERSIONS = {
+    "pdf": "pdf-4",
+    "ocr": "easyocr-3",
+}
+
+EXTRACTION_CACHE_MAX_BYTES = int(os.getenv("EXTRACTION_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+_shared_cache = None
+
+
+def extraction_cache() -> SQLiteCache:
+    """
+    Returns the on-disk cache of extracted text, shared by every process.
+    """
+    global _shared_cache
+    if _shared_cache is None:
+        _shared_cache = SQLiteCache(cache_path("extractions.sqlite"), max_bytes=EXTRACTION_CACHE_MAX_BYTES)
+    return _shared_cache
+
+
+def content_digest(data) -> str:
+    """
+    SHA-256 of a file's bytes.
+    """
+    return hashlib.sha256(data).hexdigest()
+
+
+def extraction_key(extractor: str, digest: str, options: dict = None) -> str:
+    """
+    Builds the cache key from the file digest, the extractor version and its options.
+    """
+    options_digest = hashlib.sha256(json.dumps(options or {}, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+    return f"{extractor}:{EXTRACTOR_VERSIONS[extractor]}:{options_digest}:{digest}"
+
+
+def get_cached_extractions(keys) -> dict:
+    """
+    Looks up many extraction keys at once; returns the stored results by key.
+    """
+    return {key: json.loads(value) for key, value in extraction_cache().get_many(keys).items()}
+
+
+def store_extractions(results: dict):
+    """
+    Stores extraction results (JSON-serializable dicts) by key.
+    """
+    extraction_cache().set_many({key: json.dumps(result).encode("utf-8") for key, result in results.items()})
+
+
+def cached_extraction(extractor: str, data, options: dict, extract, store_if=None) -> dict:
+    """
+    Returns the stored result for these bytes and options, or runs extract() and stores its result.
+    With store_if, only results it accepts are stored, so partial failures are extracted again next time.
+    """
+    key = extraction_key(extractor, content_digest(data), options)
+    cached = get_cached_extractions([key]).get(key)
+    if cached is not None:
+        return cached
+    result = extract()
+    if store_if is None or store_if(result):
+        store_extractions({key: result})
+    return result
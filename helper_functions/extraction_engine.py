@@ -0,0 +1,276 @@
+import math
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, replace
+
+from helper_functions.PDF_text_extractor import extract_pdf, pdf_options
+from helper_functions.ocr_helper import ocr_image_bytes, ocr_batch, ocr_options, prewarm_readers, OCR_BATCH_SIZE
+from helper_functions.extraction_cache import extraction_key, get_cached_extractions
+from helper_functions.upload_spool import spooled_uploads, uploads_contents
+
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.tiff', '.bmp', '.gif'}
+
+EXTRACTION_WORKERS = int(os.getenv("EXTRACTION_WORKERS", "0")) or os.cpu_count() or 1
+
+# Load the EasyOCR reader in every worker as it starts, instead of on its first image
+OCR_PREWARM = os.getenv("OCR_PREWARM", "0") == "1"
+
+
+@dataclass
+class ExtractionResult:
+    """
+    Text extracted from one uploaded file, with how long it took and any error.
+    """
+    category: str
+    name: str
+    text: str = ""
+    method: str = ""
+    seconds: float = 0.0
+    confidence: float = None
+    cached: bool = False
+    error: str = None
+    # For PDFs: text_pages, ocr_pages, text_seconds and ocr_seconds
+    timings: dict = None
+
+
+def is_image(name: str) -> bool:
+    return os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS
+
+
+def extract_file_bytes(name: str, data: bytes, use_gpu: bool = False):
+    """
+    Extracts text from a PDF or an image given its bytes or a memory map. Returns the text, the method used
+    and, for PDFs, the page timings.
+    """
+    _, ext = os.path.splitext(name)
+    ext = ext.lower()
+    if ext == '.pdf':
+        pdf = extract_pdf(data)
+        return pdf["text"], "pdf", _pdf_timings(pdf)
+    if ext in IMAGE_EXTENSIONS:
+        return ocr_image_bytes(data, preprocess=True, use_gpu=use_gpu), "ocr", None
+    raise ValueError(f"Unsupported file type: {name}")
+
+
+def _pdf_timings(pdf: dict):
+    return {key: pdf[key] for key in ("text_pages", "ocr_pages", "text_seconds", "ocr_seconds", "ocr_errors")
+            if key in pdf}
+
+
+def _extract_in_worker(category: str, upload, use_gpu: bool) -> ExtractionResult:
+    start = time.perf_counter()
+    result = ExtractionResult(category=category, name=upload.name)
+    try:
+        with upload.contents() as data:
+            result.text, result.method, result.timings = extract_file_bytes(upload.name, data, use_gpu)
+    except Exception as e:
+        result.error = str(e)
+    result.seconds = time.perf_counter() - start
+    return result
+
+
+def _ocr_batch_in_worker(items, use_gpu: bool):
+    """
+    OCRs a group of images in one EasyOCR batch. Each result's seconds is its share of the batch time.
+    """
+    start = time.perf_counter()
+    with uploads_contents([upload for _, upload in items]) as images:
+        ocr_results = ocr_batch(images, use_gpu=use_gpu)
+    seconds = (time.perf_counter() - start) / len(items)
+    return [ExtractionResult(category=category, name=upload.name, text=ocr_result.text, method="ocr",
+                             seconds=seconds, confidence=ocr_result.confidence, error=ocr_result.error)
+            for (category, upload), ocr_result in zip(items, ocr_results)]
+
+
+def _cache_key(name: str, digest: str):
+    """
+    The extraction cache key the worker would use for this file, or None for unsupported types.
+    """
+    if is_image(name):
+        return extraction_key("ocr", digest, ocr_options(['en'], True, "batched"))
+    if os.path.splitext(name)[1].lower() == '.pdf':
+        return extraction_key("pdf", digest, pdf_options())
+    return None
+
+
+def _image_groups(images):
+    """
+    Splits the images into OCR batches, small enough that every worker still gets a share.
+    """
+    if not images:
+        return []
+    group_size = max(1, min(OCR_BATCH_SIZE, math.ceil(len(images) / EXTRACTION_WORKERS)))
+    return [images[start:start + group_size] for start in range(0, len(images), group_size)]
+
+
+_process_pool = None
+
+
+def extraction_pool() -> ProcessPoolExecutor:
+    """
+    Returns the process pool shared by all extractions, sized to the machine's cores.
+    """
+    global _process_pool
+    if _process_pool is None:
+        # spawn keeps workers clear of locks held by the app's threads at fork time
+        _process_pool = ProcessPoolExecutor(max_workers=EXTRACTION_WORKERS,
+                                            mp_context=multiprocessing.get_context("spawn"),
+                                            initializer=_prewarm_worker if OCR_PREWARM else None)
+    return _process_pool
+
+
+def _prewarm_worker():
+    try:
+        prewarm_readers()
+    except Exception as e:
+        print(f"Failed to prewarm EasyOCR reader: {e}")
+
+
+def _worker_ready():
+    return True
+
+
+def prewarm_extraction_pool():
+    """
+    Starts the extraction workers and loads their OCR readers at app start if OCR_PREWARM is set.
+    """
+    if OCR_PREWARM:
+        # The pool starts a worker per submitted job while none is idle, so one job per worker starts them all
+        pool = extraction_pool()
+        for _ in range(EXTRACTION_WORKERS):
+            pool.submit(_worker_ready)
+
+
+def extract_uploads(uploads, use_gpu: bool = False):
+    """
+    Extracts text from a batch of (category, uploaded file) pairs in parallel. Images are
+    OCRed in batches, PDFs one per job. Results are returned in upload order.
+    """
+    results = [None] * len(uploads)
+    for position, result in iter_extractions(uploads, use_gpu):
+        results[position] = result
+    return results
+
+
+def iter_extractions(uploads, use_gpu: bool = False):
+    """
+    Extracts a batch of (category, uploaded file) pairs in parallel, yielding (upload position, result)
+    as each file finishes. Files served from the extraction cache come first.
+    """
+    # Each upload is read once; large ones reach the workers as spool files they memory-map
+    with spooled_uploads(uploads) as items:
+        yield from _iter_spooled(items, use_gpu)
+
+
+def iter_category_texts(uploads, use_gpu: bool = False):
+    """
+    Yields (category, joined text, results) for each category as soon as all of its files are extracted.
+    """
+    remaining = Counter(category for category, _ in uploads)
+    results = [None] * len(uploads)
+    for position, result in iter_extractions(uploads, use_gpu):
+        results[position] = result
+        remaining[result.category] -= 1
+        if remaining[result.category] == 0:
+            category_results = [item for item in results if item is not None and item.category == result.category]
+            yield result.category, join_category_text(category_results, result.category), category_results
+
+
+def start_category_texts(uploads, use_gpu: bool = False):
+    """
+    Starts extracting the uploads right away in a background thread and returns an iterator over what
+    iter_category_texts yields, so the caller can set up other work while the files are extracted.
+    """
+    done = object()
+    items = queue.Queue()
+
+    def extract():
+        try:
+            for item in iter_category_texts(uploads, use_gpu):
+                items.put(item)
+        except Exception as e:
+            items.put(e)
+        items.put(done)
+
+    threading.Thread(target=extract, name="extraction", daemon=True).start()
+
+    def category_texts():
+        while (item := items.get()) is not done:
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    return category_texts()
+
+
+def _iter_spooled(items, use_gpu: bool):
+    global _process_pool
+
+    # The same file uploaded into several categories is extracted once
+    first_position = {}
+    duplicates = {}
+    for position, (_, upload) in enumerate(items):
+        if upload.digest in first_position:
+            duplicates.setdefault(first_position[upload.digest], []).append(position)
+        else:
+            first_position[upload.digest] = position
+
+    def with_duplicates(position, result):
+        yield position, result
+        for duplicate in duplicates.get(position, []):
+            category, upload = items[duplicate]
+            yield duplicate, replace(result, category=category, name=upload.name, seconds=0.0, cached=True)
+
+    # Files extracted on an earlier run are served from the extraction cache without a worker
+    keys = {position: _cache_key(items[position][1].name, digest) for digest, position in first_position.items()}
+    cached = get_cached_extractions([key for key in keys.values() if key])
+    pending = []
+    for position, key in keys.items():
+        category, upload = items[position]
+        name = upload.name
+        if key in cached:
+            yield from with_duplicates(position, ExtractionResult(
+                category=category, name=name, text=cached[key]["text"],
+                method="ocr" if is_image(name) else "pdf",
+                confidence=cached[key].get("confidence"), cached=True,
+                timings=None if is_image(name) else _pdf_timings(cached[key])))
+        else:
+            pending.append(position)
+
+    jobs = {}
+    images = [position for position in pending if is_image(items[position][1].name)]
+    for group in _image_groups(images):
+        future = extraction_pool().submit(_ocr_batch_in_worker, [items[position] for position in group], use_gpu)
+        jobs[future] = group
+    for position in pending:
+        category, upload = items[position]
+        if not is_image(upload.name):
+            jobs[extraction_pool().submit(_extract_in_worker, category, upload, use_gpu)] = [position]
+
+    for future in as_completed(jobs):
+        positions = jobs[future]
+        try:
+            job_results = future.result()
+            job_results = job_results if isinstance(job_results, list) else [job_results]
+        except Exception as e:
+            # The worker itself died, e.g. out of memory; start a fresh pool next time
+            if isinstance(e, BrokenProcessPool):
+                _process_pool = None
+            job_results = [ExtractionResult(category=items[position][0], name=items[position][1].name, error=str(e))
+                           for position in positions]
+        for position, result in zip(positions, job_results):
+            yield from with_duplicates(position, result)
+
+
+def join_category_text(results, category: str) -> str:
+    """
+    Joins the extracted text of every file in a category, in upload order.
+    """
+    return "".join(result.text + "\n\n\n\n" for result in results
+                   if result.category == category and result.error is None)
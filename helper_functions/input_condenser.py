@@ -0,0 +1,122 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from helper_functions.token_counter import count_tokens, truncate_to_tokens, truncate_at_boundary
+
+# Tokens each clinical input may take in the crew's prompts; larger inputs are condensed to a digest
+INPUT_TOKEN_BUDGET = int(os.getenv("INPUT_TOKEN_BUDGET", "1500"))
+
+# Size of the chunks an oversized input is split into, and how many are summarized at once
+CONDENSE_CHUNK_TOKENS = int(os.getenv("CONDENSE_CHUNK_TOKENS", "3000"))
+CONDENSE_WORKERS = int(os.getenv("CONDENSE_WORKERS", "4"))
+
+# Rounds of re-summarizing the joined chunk summaries before the digest is truncated
+MAX_REDUCE_ROUNDS = 2
+
+CHUNK_SUMMARY_PROMPT = """You are condensing part of a patient's {kind} for a pre-surgery review.
+Rewrite the excerpt below as terse bullet points in at most {max_words} words.
+Keep every medication with its dose and frequency, every test or finding with its exact value,
+unit and reference range, every date, and every abnormal or flagged result, copied verbatim.
+Drop headers, addresses, signatures, boilerplate and repeated content. Do not interpret or add anything.
+
+Excerpt:
+{chunk}"""
+
+
+def split_into_chunks(text: str, chunk_tokens: int = CONDENSE_CHUNK_TOKENS):
+    """
+    Splits text into chunks of at most chunk_tokens, on line boundaries where possible.
+    """
+    chunks = []
+    current, current_tokens = [], 0
+    for line in text.splitlines():
+        line_tokens = count_tokens(line) + 1
+        while line_tokens > chunk_tokens:
+            # A single huge line (e.g. an OCRed table) is cut into pieces
+            piece = truncate_to_tokens(line, chunk_tokens)
+            if current:
+                chunks.append("\n".join(current))
+                current, current_tokens = [], 0
+            chunks.append(piece)
+            line = line[len(piece):]
+            line_tokens = count_tokens(line) + 1
+        if current and current_tokens + line_tokens > chunk_tokens:
+            chunks.append("\n".join(current))
+            current, current_tokens = [], 0
+        current.append(line)
+        current_tokens += line_tokens
+    if current:
+        chunks.append("\n".join(current))
+    return [chunk for chunk in chunks if chunk.strip()]
+
+
+def summarize_chunk(llm, kind: str, chunk: str, max_tokens: int) -> str:
+    """
+    Summarizes one chunk, keeping drugs, doses and test values verbatim.
+    """
+    prompt = CHUNK_SUMMARY_PROMPT.format(kind=kind, max_words=max(20, int(max_tokens * 0.75)), chunk=chunk)
+    response = llm.invoke(prompt)
+    return truncate_at_boundary(getattr(response, "content", str(response)).strip(), max_tokens)
+
+
+def condense_text(text: str, kind: str, llm, token_budget: int = INPUT_TOKEN_BUDGET):
+    """
+    Map-reduce condensation: the chunks of an oversized input are summarized in parallel and the
+    summaries joined into a digest of at most token_budget tokens, cut at a line or sentence boundary if it
+    is still too long. Returns the digest and the chunk count.
+    """
+    digest = text
+    chunk_count = 0
+    with ThreadPoolExecutor(max_workers=CONDENSE_WORKERS) as executor:
+        for _ in range(MAX_REDUCE_ROUNDS):
+            if count_tokens(digest) <= token_budget:
+                break
+            chunks = split_into_chunks(digest)
+            chunk_count += len(chunks)
+            per_chunk_tokens = max(50, token_budget // len(chunks))
+            summaries = list(executor.map(lambda chunk: summarize_chunk(llm, kind, chunk, per_chunk_tokens),
+                                          chunks))
+            digest = "\n".join(summaries)
+    return truncate_at_boundary(digest, token_budget), chunk_count
+
+
+def condense_inputs(inputs: dict, llm, token_budget: int = INPUT_TOKEN_BUDGET):
+    """
+    Condenses each oversized input, given as {name: (kind, text)}, to fit token_budget.
+    Returns the texts to pass to the crew by name, and a token budget report per input.
+    """
+    condensed = {}
+    report = {}
+    for name, (kind, text) in inputs.items():
+        start = time.perf_counter()
+        original_tokens = count_tokens(text)
+        chunk_count = 0
+        if original_tokens > token_budget:
+            try:
+                condensed[name], chunk_count = condense_text(text, kind, llm, token_budget)
+            except Exception as e:
+                print(f"Failed to condense {name}, truncating it instead: {e}")
+                condensed[name] = truncate_at_boundary(text, token_budget)
+        else:
+            condensed[name] = text
+        report[name] = {
+            "original_tokens": original_tokens,
+            "digest_tokens": count_tokens(condensed[name]),
+            "budget": token_budget,
+            "chunks": chunk_count,
+            "seconds": time.perf_counter() - start,
+        }
+    return condensed, report
+
+
+def format_budget_report(report: dict) -> str:
+    """
+    Formats the token budget report, one line per input.
+    """
+    lines = []
+    for name, entry in report.items():
+        action = f"condensed from {entry['chunks']} chunks" if entry["chunks"] else "passed through"
+        lines.append(f"{name}: {entry['original_tokens']} -> {entry['digest_tokens']} tokens "
+                     f"(budget {entry['budget']}, {action}, {entry['seconds']:.1f}s)")
+    return "\n".join(lines)
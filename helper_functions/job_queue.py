@@ -0,0 +1,196 @@
+import contextvars
+import hashlib
+import json
+import os
+import sqlite3
+import statistics
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from helper_functions.sqlite_cache import cache_path
+
+# Crew runs executed at once in the background
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+
+# Finished jobs are kept this long, so a rerun or another tab with the same inputs gets the result
+JOB_RETENTION_SECONDS = float(os.getenv("JOB_RETENTION_SECONDS", str(24 * 3600)))
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+# Set inside a running job so the code it calls can report progress
+_active_job = contextvars.ContextVar("active_job", default=None)
+
+_job_functions = {}
+_store = None
+_store_lock = threading.Lock()
+_executor = None
+
+# Identifies this server process; jobs left queued or running by an earlier one never finish
+_owner = uuid.uuid4().hex
+
+
+class JobStore:
+    """
+    Job records in a local SQLite database: state, progress, timings and the JSON result.
+    """
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, kind TEXT, input_hash TEXT, status TEXT, progress TEXT, result TEXT, error TEXT, "
+            "owner TEXT, submitted_at REAL, started_at REAL, finished_at REAL)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS jobs_input_hash ON jobs (input_hash)")
+        self._connection.commit()
+
+    def execute(self, sql: str, parameters=()):
+        with self._lock:
+            rows = self._connection.execute(sql, parameters).fetchall()
+            self._connection.commit()
+        return [dict(row) for row in rows]
+
+
+def job_store() -> JobStore:
+    """
+    Returns the job store, failing any job an earlier server process left unfinished.
+    """
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = JobStore(cache_path("jobs.sqlite"))
+            _store.execute("UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE status IN (?, ?) AND owner != ?",
+                           (FAILED, "Interrupted by a server restart", time.time(), QUEUED, RUNNING, _owner))
+    return _store
+
+
+def _job_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _store_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="crew-job")
+    return _executor
+
+
+def register_job(kind: str, function):
+    """
+    Makes a function available to submit_job under a name. It is called with the job's keyword inputs
+    and force, which asks it to regenerate instead of reusing checkpoints and caches, and its result
+    must be JSON-serializable after crew outputs are turned into text.
+    """
+    _job_functions[kind] = function
+
+
+def _hashable(value):
+    # Uploaded files are identified by name and content, so uploading the same files again is the same job
+    if hasattr(value, "getbuffer"):
+        with value.getbuffer() as view:
+            return {"name": getattr(value, "name", None), "sha256": hashlib.sha256(view).hexdigest()}
+    return str(value)
+
+
+def input_hash(kind: str, inputs: dict) -> str:
+    """
+    Hash of a job's kind and inputs; jobs with the same hash are the same job.
+    """
+    payload = json.dumps({"kind": kind, "inputs": inputs}, sort_keys=True, default=_hashable)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _to_json(value):
+    # Crew outputs print as their final text
+    if isinstance(value, dict):
+        return {str(key): _to_json(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_to_json(item) for item in value]
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
+
+
+def submit_job(kind: str, force: bool = False, **inputs) -> str:
+    """
+    Queues a crew run and returns its job ID. A queued, running or finished job with the same
+    inputs is reused unless force is set, in which case the run also regenerates every step.
+    """
+    store = job_store()
+    digest = input_hash(kind, inputs)
+    now = time.time()
+    store.execute("DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?", (DONE, FAILED, now - JOB_RETENTION_SECONDS))
+    if not force:
+        existing = store.execute("SELECT id FROM jobs WHERE input_hash = ? AND status IN (?, ?, ?) "
+                                 "ORDER BY submitted_at DESC LIMIT 1", (digest, QUEUED, RUNNING, DONE))
+        if existing:
+            return existing[0]["id"]
+
+    job_id = uuid.uuid4().hex
+    store.execute("INSERT INTO jobs (id, kind, input_hash, status, progress, owner, submitted_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                  (job_id, kind, digest, QUEUED, "Waiting for a worker", _owner, now))
+    _job_executor().submit(_run_job, job_id, kind, inputs, force)
+    return job_id
+
+
+def _run_job(job_id: str, kind: str, inputs: dict, force: bool = False):
+    store = job_store()
+    store.execute("UPDATE jobs SET status = ?, progress = ?, started_at = ? WHERE id = ?",
+                  (RUNNING, "Started", time.time(), job_id))
+    token = _active_job.set(job_id)
+    try:
+        result = _job_functions[kind](**inputs, force=force)
+        store.execute("UPDATE jobs SET status = ?, progress = ?, result = ?, finished_at = ? WHERE id = ?",
+                      (DONE, "Done", json.dumps(_to_json(result)), time.time(), job_id))
+    except Exception as e:
+        print(f"Job {kind} {job_id} failed: {e}")
+        store.execute("UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?",
+                      (FAILED, str(e), time.time(), job_id))
+    finally:
+        _active_job.reset(token)
+
+
+def report_progress(message: str):
+    """
+    Records a progress message on the job this code runs in, if any.
+    """
+    job_id = _active_job.get()
+    if job_id is not None:
+        job_store().execute("UPDATE jobs SET progress = ? WHERE id = ?", (message, job_id))
+
+
+def get_job(job_id: str) -> dict:
+    """
+    Returns a job's record with its result decoded, or None if it is unknown or expired.
+    """
+    rows = job_store().execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+    if not rows:
+        return None
+    job = rows[0]
+    job["result"] = json.loads(job["result"]) if job["result"] is not None else None
+    return job
+
+
+def queue_metrics(window_seconds: float = 3600) -> dict:
+    """
+    Queue depth, running jobs, and the wait from submission to start over the last window_seconds.
+    """
+    store = job_store()
+    now = time.time()
+    counts = {row["status"]: row["count"] for row in
+              store.execute("SELECT status, COUNT(*) AS count FROM jobs GROUP BY status")}
+    waits = [row["started_at"] - row["submitted_at"] for row in
+             store.execute("SELECT submitted_at, started_at FROM jobs WHERE started_at IS NOT NULL AND submitted_at > ?",
+                           (now - window_seconds,))]
+    oldest = store.execute("SELECT MIN(submitted_at) AS oldest FROM jobs WHERE status = ?", (QUEUED,))[0]["oldest"]
+    return {
+        "queued": counts.get(QUEUED, 0),
+        "running": counts.get(RUNNING, 0),
+        "done": counts.get(DONE, 0),
+        "failed": counts.get(FAILED, 0),
+        "mean_wait_seconds": statistics.mean(waits) if waits else 0.0,
+        "max_wait_seconds": max(waits) if waits else 0.0,
+        "oldest_queued_seconds": now - oldest if oldest is not None else 0.0,
+    }
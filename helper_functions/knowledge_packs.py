@@ -0,0 +1,105 @@
+"""
+Procedure-level report sections (instruments, technique) cached per procedure and model,
+so they are generated once per procedure rather than once per patient.
+
+Manual invalidation, from the repository root:
+    python -m helper_functions.knowledge_packs --invalidate "Laparoscopic Appendectomy"
+    python -m helper_functions.knowledge_packs --invalidate-all
+"""
+import argparse
+import json
+import os
+
+from helper_functions.procedure_catalog import normalize_procedure_name
+from helper_functions.sqlite_cache import SQLiteCache, cache_path
+
+# Bump whenever the prompts or roles of the pack sections change, so older packs stop being served
+KNOWLEDGE_PACK_VERSION = "2"
+
+# Packs are regenerated after this long, so guidance picks up knowledge base updates
+KNOWLEDGE_PACK_TTL_SECONDS = float(os.getenv("KNOWLEDGE_PACK_TTL_SECONDS", str(30 * 24 * 3600)))
+
+# Set to 0 to generate every section for every patient
+KNOWLEDGE_PACKS = os.getenv("KNOWLEDGE_PACKS", "1") == "1"
+
+_shared_cache = None
+
+
+def knowledge_pack_cache() -> SQLiteCache:
+    """
+    Returns the on-disk store of knowledge packs.
+    """
+    global _shared_cache
+    if _shared_cache is None:
+        _shared_cache = SQLiteCache(cache_path("knowledge_packs.sqlite"), ttl_seconds=KNOWLEDGE_PACK_TTL_SECONDS)
+    return _shared_cache
+
+
+def llm_model_name(llm) -> str:
+    """
+    The model behind a LangChain chat model, e.g. "llama3-70b-8192".
+    """
+    return getattr(llm, "model_name", None) or getattr(llm, "model", None) or type(llm).__name__
+
+
+def _procedure_prefix(procedure: str) -> str:
+    return f"{KNOWLEDGE_PACK_VERSION}:{normalize_procedure_name(procedure)}:"
+
+
+def knowledge_pack_key(procedure: str, model: str) -> str:
+    """
+    Packs are keyed by the normalized procedure name and the model that wrote them.
+    """
+    return _procedure_prefix(procedure) + model
+
+
+def get_knowledge_pack(procedure: str, model: str) -> dict:
+    """
+    Returns the cached sections for the procedure by agent role, empty if there is no fresh pack.
+    """
+    value = knowledge_pack_cache().get(knowledge_pack_key(procedure, model))
+    return json.loads(value) if value is not None else {}
+
+
+def store_knowledge_pack(procedure: str, model: str, sections: dict):
+    """
+    Stores the procedure's sections by agent role, replacing any earlier pack for the same model.
+    """
+    knowledge_pack_cache().set(knowledge_pack_key(procedure, model), json.dumps(sections).encode("utf-8"))
+
+
+def invalidate_knowledge_pack(procedure: str = None, model: str = None) -> int:
+    """
+    Deletes the pack for a procedure and model, every model's pack for a procedure, or every pack.
+    Returns how many packs were removed.
+    """
+    cache = knowledge_pack_cache()
+    if procedure is None:
+        removed = cache.stats()["entries"]
+        cache.clear()
+        return removed
+    if model is None:
+        return cache.delete_prefix(_procedure_prefix(procedure))
+    key = knowledge_pack_key(procedure, model)
+    existed = cache.get(key) is not None
+    cache.delete(key)
+    return int(existed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--invalidate", metavar="PROCEDURE", help="drop the packs of this procedure")
+    parser.add_argument("--model", help="only drop the pack written by this model")
+    parser.add_argument("--invalidate-all", action="store_true", help="drop every pack")
+    args = parser.parse_args()
+
+    if args.invalidate_all:
+        print(f"Removed {invalidate_knowledge_pack()} knowledge packs")
+    elif args.invalidate:
+        print(f"Removed {invalidate_knowledge_pack(args.invalidate, args.model)} knowledge packs")
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
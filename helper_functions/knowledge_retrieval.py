@@ -0,0 +1,264 @@
+import hashlib
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from langchain.chains import RetrievalQA
+
+from helper_functions.pinecone_vector_store import pinecone_vector_store
+from helper_functions.pinecone_vector_store import embeddings
+from helper_functions.token_counter import count_tokens, truncate_to_tokens
+from helper_functions.bm25_index import load_bm25_index, tokenize
+from helper_functions.procedure_catalog import normalize_procedure_name, specialty_for, match_procedure
+from helper_functions.retrieval_cache import active_retrieval_cache
+
+# Constant from the reciprocal rank fusion paper; damps the weight of the top ranks
+RRF_K = 60
+
+_search_pool = ThreadPoolExecutor(max_workers=4)
+
+# Surgery the current crew run is about; retrieval is routed to its partition of the knowledge base
+active_surgery = ContextVar("active_surgery", default=None)
+
+
+@contextmanager
+def active_surgery_scope(surgery_name):
+    """
+    Routes retrieval inside the with-block to the given surgery.
+    """
+    token = active_surgery.set(surgery_name)
+    try:
+        yield
+    finally:
+        active_surgery.reset(token)
+
+
+def retrieval_filter(surgery_name):
+    """
+    Picks the metadata filter for a surgery: its procedure if ingested, else its specialty, else None.
+    Without a BM25 index the ingested partitions are unknown, so the search is left unfiltered rather
+    than risking an empty filtered query followed by a global one.
+    """
+    if not surgery_name:
+        return None
+    lexical_index = load_bm25_index()
+    if lexical_index is None:
+        return None
+    procedure = match_procedure(surgery_name, lexical_index.known_values("procedure"))
+    if procedure:
+        return {"procedure": procedure}
+    specialty = specialty_for(surgery_name)
+    if specialty in lexical_index.known_values("specialty"):
+        return {"specialty": specialty}
+    return None
+
+
+def detect_procedure(text: str):
+    """
+    Finds the ingested procedure mentioned in a free text such as a pre-surgery report.
+    """
+    lexical_index = load_bm25_index()
+    if lexical_index is None or not text:
+        return None
+    normalized = f" {normalize_procedure_name(text)} "
+    mentioned = [procedure for procedure in lexical_index.known_values("procedure") if f" {procedure} " in normalized]
+    return max(mentioned, key=len) if mentioned else None
+
+
+def passage_key(document, by_content: bool = False) -> str:
+    """
+    Identifies a passage by the chunk id assigned at ingestion, or by its content if it has none
+    or by_content is set, ignoring case and whitespace.
+    """
+    chunk_id = document.metadata.get("chunk_id")
+    if chunk_id and not by_content:
+        return chunk_id
+    normalized = " ".join(document.page_content.lower().split())
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def deduplicate_passages(documents):
+    """
+    Removes passages whose normalized text has already been seen, keeping the first (best ranked) one.
+    """
+    seen = set()
+    unique_documents = []
+    for document in documents:
+        # The same text can be stored under several chunk ids, so passages are compared by content
+        digest = passage_key(document, by_content=True)
+        if document.page_content.strip() and digest not in seen:
+            seen.add(digest)
+            unique_documents.append(document)
+    return unique_documents
+
+
+def passage_source(document) -> str:
+    """
+    Builds a short source label for a passage from its metadata.
+    """
+    source = document.metadata.get("source", "unknown source")
+    page = document.metadata.get("page")
+    if page is not None:
+        return f"{source}, page {int(page) + 1}"
+    return str(source)
+
+
+def format_passages(documents, token_budget: int = 1500) -> str:
+    """
+    Formats passages with their sources, stopping once the token budget is used up.
+    """
+    if not documents:
+        return "No relevant passages found in the knowledge base."
+
+    sections = []
+    remaining = token_budget
+    for number, document in enumerate(documents, start=1):
+        header = f"[{number}] (source: {passage_source(document)})\n"
+        available = remaining - count_tokens(header)
+        if available <= 0:
+            break
+        content = truncate_to_tokens(document.page_content.strip(), available)
+        sections.append(header + content)
+        remaining -= count_tokens(header) + count_tokens(content)
+    return "\n\n".join(sections)
+
+
+def is_exact_term_query(query: str, lexical_index) -> bool:
+    """
+    Checks whether the query is a single term or a quoted phrase whose terms are all in the lexical index.
+    """
+    stripped = query.strip()
+    terms = tokenize(stripped)
+    if not terms:
+        return False
+    quoted = len(stripped) > 2 and stripped[0] == stripped[-1] == '"'
+    return (quoted or len(terms) == 1) and all(lexical_index.contains(term) for term in terms)
+
+
+def reciprocal_rank_fusion(result_lists, top_k: int):
+    """
+    Fuses several ranked lists of documents by summing 1 / (RRF_K + rank) for each document.
+    """
+    scores = {}
+    documents = {}
+    for results in result_lists:
+        for rank, document in enumerate(results, start=1):
+            key = passage_key(document)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (RRF_K + rank)
+            documents.setdefault(key, document)
+    ranked = sorted(scores, key=scores.get, reverse=True)[:top_k]
+    return [documents[key] for key in ranked]
+
+
+def _elapsed_ms(start: float) -> float:
+    return (time.perf_counter() - start) * 1000
+
+
+def _timed_vector_search(query: str, k: int, metadata_filter: dict = None, query_vector=None):
+    start = time.perf_counter()
+    vector_store = pinecone_vector_store()
+    if query_vector is None:
+        query_vector = embeddings().embed_query(query)
+    results = vector_store.similarity_search_by_vector_with_score(query_vector, k=k, filter=metadata_filter)
+    documents = [document for document, _ in results]
+    return documents, _elapsed_ms(start)
+
+
+def hybrid_search(query: str, top_k: int = 5, metadata_filter: dict = None, query_vector=None):
+    """
+    Queries the vector index and the local BM25 index in parallel and fuses the rankings,
+    optionally restricted to the chunks matching metadata_filter. query_vector skips
+    embedding the query when it has already been embedded.
+    Returns the documents and the latency of each stage in milliseconds.
+    """
+    start = time.perf_counter()
+    timings = {}
+
+    lexical_index = load_bm25_index()
+    if lexical_index is not None and is_exact_term_query(query, lexical_index):
+        # Exact drug, instrument or anatomy terms are answered from the inverted index alone
+        documents = [document for document, _ in lexical_index.search(query, k=top_k, metadata_filter=metadata_filter)]
+        timings["lexical_ms"] = timings["total_ms"] = _elapsed_ms(start)
+        return documents, timings
+
+    fetch_k = top_k * 2
+    vector_future = _search_pool.submit(_timed_vector_search, query, fetch_k, metadata_filter, query_vector)
+
+    lexical_documents = []
+    if lexical_index is not None:
+        lexical_start = time.perf_counter()
+        lexical_documents = [document for document, _ in lexical_index.search(query, k=fetch_k, metadata_filter=metadata_filter)]
+        timings["lexical_ms"] = _elapsed_ms(lexical_start)
+
+    vector_documents, timings["vector_ms"] = vector_future.result()
+
+    fusion_start = time.perf_counter()
+    documents = reciprocal_rank_fusion([vector_documents, lexical_documents], top_k)
+    timings["fusion_ms"] = _elapsed_ms(fusion_start)
+    timings["total_ms"] = _elapsed_ms(start)
+    return documents, timings
+
+
+def format_timings(timings: dict) -> str:
+    """
+    Formats the per-stage retrieval latencies for logging.
+    """
+    return ", ".join(f"{stage[:-3]} {value:.2f} ms" for stage, value in timings.items())
+
+
+def search_passages(query: str, top_k: int = 5, surgery_name: str = None, query_vector=None):
+    """
+    Searches the surgery's partition of the knowledge base, falling back to the whole knowledge
+    base when the partition returns fewer than top_k passages.
+    Returns the deduplicated documents, the stage latencies and the filter used.
+    """
+    metadata_filter = retrieval_filter(surgery_name or active_surgery.get())
+    documents, timings = hybrid_search(query, top_k, metadata_filter, query_vector)
+
+    if metadata_filter and len(documents) < top_k:
+        global_documents, global_timings = hybrid_search(query, top_k, query_vector=query_vector)
+        documents = deduplicate_passages(documents + global_documents)[:top_k]
+        timings["fallback_ms"] = global_timings["total_ms"]
+
+    return deduplicate_passages(documents), timings, metadata_filter
+
+
+def retrieve_passages(query: str, top_k: int = 5, token_budget: int = 1500, surgery_name: str = None) -> str:
+    """
+    Retrieves the top-k passages for the query with hybrid lexical and vector search, so the
+    calling agent reasons over them itself instead of a nested LLM call. Queries already answered
+    in this crew run, e.g. by the kickoff prefetch, are served from the run's retrieval cache.
+    """
+    retrieval_cache = active_retrieval_cache.get()
+    if retrieval_cache is None:
+        documents, timings, metadata_filter = search_passages(query, top_k, surgery_name)
+        print(f"Retrieval latency ({metadata_filter or 'global'}): {format_timings(timings)}")
+        return format_passages(documents, token_budget)
+
+    query_vector = embeddings().embed_query(query)
+    documents = retrieval_cache.lookup(query, query_vector)
+    if documents is None:
+        documents, timings, metadata_filter = search_passages(query, top_k, surgery_name, query_vector)
+        retrieval_cache.add(query, query_vector, documents)
+        print(f"Retrieval latency ({metadata_filter or 'global'}): {format_timings(timings)}")
+    else:
+        print(f"Retrieval served from the run cache: {retrieval_cache.report()}")
+    return format_passages(documents, token_budget)
+
+
+def answer_with_qa_chain(query: str, llm_model) -> str:
+    """
+    Answers the query with a RetrievalQA chain, which runs a full LLM generation over the retrieved passages.
+    """
+    vector_store = pinecone_vector_store()
+    embedding = embeddings()
+
+    knowledge = vector_store.from_existing_index(index_name="surgical-assistant",
+                                                embedding=embedding)
+
+    qa = RetrievalQA.from_chain_type(llm=llm_model,
+                                    chain_type="stuff",
+                                    retriever=knowledge.as_retriever()
+                                )
+    return qa.invoke(query).get("result")
@@ -0,0 +1,105 @@
+import contextlib
+import contextvars
+import hashlib
+import os
+import threading
+
+from langchain_core.caches import BaseCache
+from langchain_core.load import dumps, loads
+
+from helper_functions.sqlite_cache import SQLiteCache, cache_path
+
+# "auto" caches the calls of models at temperature 0 and of those created with cacheable=True, "1" every
+# model's calls, "0" none
+LLM_CACHE = os.getenv("LLM_CACHE", "auto")
+
+# Set to 1 to answer every LLM call from the cache and fail on a miss, to replay a recorded crew run offline
+LLM_CACHE_REPLAY = os.getenv("LLM_CACHE_REPLAY", "0") == "1"
+
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+LLM_CACHE_TTL_SECONDS = float(os.getenv("LLM_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+# Set while a forced regeneration runs: lookups miss, but the fresh responses still replace the cached ones
+_bypass = contextvars.ContextVar("llm_cache_bypass", default=False)
+
+
+class LLMCacheMiss(Exception):
+    """
+    Raised in replay mode for a call that was never recorded.
+    """
+
+
+class PersistentLLMCache(BaseCache):
+    """
+    LangChain LLM cache stored on disk. LangChain keys each call by the model and its parameters
+    (llm_string) and the exact serialized messages (prompt).
+    """
+
+    def __init__(self, store: SQLiteCache, replay: bool = False):
+        self.store = store
+        self.replay = replay
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(prompt: str, llm_string: str) -> str:
+        return hashlib.sha256(f"{llm_string}\n{prompt}".encode("utf-8")).hexdigest()
+
+    def lookup(self, prompt: str, llm_string: str):
+        # A replay has no provider to fall back on, so it serves recorded responses even then
+        if _bypass.get() and not self.replay:
+            return None
+        value = self.store.get(self.key(prompt, llm_string))
+        if value is None:
+            self.misses += 1
+            if self.replay:
+                raise LLMCacheMiss("LLM call not recorded; run it once with LLM_CACHE=1 before replaying")
+            return None
+        self.hits += 1
+        return loads(value.decode("utf-8"))
+
+    def update(self, prompt: str, llm_string: str, return_val):
+        self.store.set(self.key(prompt, llm_string), dumps(return_val).encode("utf-8"))
+
+    def clear(self, **kwargs):
+        self.store.clear()
+
+
+def llm_cache() -> PersistentLLMCache:
+    """
+    Returns the process-wide LLM response cache.
+    """
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            store = SQLiteCache(cache_path("llm_responses.sqlite"), max_bytes=LLM_CACHE_MAX_BYTES,
+                                ttl_seconds=LLM_CACHE_TTL_SECONDS)
+            _shared_cache = PersistentLLMCache(store, replay=LLM_CACHE_REPLAY)
+    return _shared_cache
+
+
+def llm_cache_for(temperature, cacheable: bool = False) -> PersistentLLMCache:
+    """
+    The cache a model at this temperature should use, or None. Sampled outputs are only cached for models
+    that opt in with cacheable, since a rerun is otherwise expected to differ; replay serves every model
+    from the cache.
+    """
+    if LLM_CACHE_REPLAY or LLM_CACHE == "1" or (LLM_CACHE == "auto" and (temperature == 0 or cacheable)):
+        return llm_cache()
+    return None
+
+
+@contextlib.contextmanager
+def bypassing_llm_cache():
+    """
+    Makes the LLM calls inside the block, and in threads running a copy of its context, skip the cache
+    lookup while still storing their responses, so a forced regeneration gets new text.
+    """
+    token = _bypass.set(True)
+    try:
+        yield
+    finally:
+        _bypass.reset(token)
@@ -0,0 +1,124 @@
+import os
+from functools import partial
+
+import httpx
+from langchain_groq import ChatGroq
+from langchain_google_genai import ChatGoogleGenerativeAI
+
+from helper_functions.knowledge_packs import llm_model_name
+from helper_functions.llm_cache import llm_cache_for
+from helper_functions.rate_limiter import rate_limited_call, rate_limited_call_async, observe_rate_limit_headers
+
+# Chat model class and API key variable of each provider
+PROVIDERS = {
+    "groq": (ChatGroq, "GROQ_API_KEY"),
+    "googlegenerativeai": (ChatGoogleGenerativeAI, "GOOGLE_API_KEY"),
+}
+
+_rate_limited_classes = {}
+
+
+def llm_provider(llm) -> str:
+    """
+    Names the provider behind a LangChain chat model, e.g. "groq" for ChatGroq.
+    """
+    name = type(llm).__name__.lower()
+    return name[4:] if name.startswith("chat") else name
+
+
+def _max_tokens(llm, kwargs: dict):
+    return kwargs.get("max_tokens") or getattr(llm, "max_tokens", None) or getattr(llm, "max_output_tokens", None)
+
+
+def _started(stream):
+    # A stream sends its request when the first chunk is asked for, so a throttled request fails there
+    stream = iter(stream)
+    return next(stream, None), stream
+
+
+async def _started_async(stream):
+    return await anext(stream, None), stream
+
+
+def rate_limited_class(chat_class):
+    """
+    Subclass of a LangChain chat model class whose generations, sync, async or streamed, go through the rate
+    limiter bucket of its provider and model. It keeps the class name, so the provider is still recognized by it.
+    """
+    if chat_class not in _rate_limited_classes:
+
+        class RateLimitedChatModel(chat_class):
+
+            def _rate_limit_key(self):
+                return f"{llm_provider(self)}:{llm_model_name(self)}"
+
+            def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+                return rate_limited_call(
+                    self._rate_limit_key(), messages,
+                    lambda: super(RateLimitedChatModel, self)._generate(messages, stop=stop, run_manager=run_manager, **kwargs),
+                    _max_tokens(self, kwargs),
+                )
+
+            async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+                return await rate_limited_call_async(
+                    self._rate_limit_key(), messages,
+                    lambda: super(RateLimitedChatModel, self)._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs),
+                    _max_tokens(self, kwargs),
+                )
+
+            def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+                first, rest = rate_limited_call(
+                    self._rate_limit_key(), messages,
+                    lambda: _started(super(RateLimitedChatModel, self)._stream(messages, stop=stop, run_manager=run_manager, **kwargs)),
+                    _max_tokens(self, kwargs),
+                )
+                if first is not None:
+                    yield first
+                    yield from rest
+
+            async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+                first, rest = await rate_limited_call_async(
+                    self._rate_limit_key(), messages,
+                    lambda: _started_async(super(RateLimitedChatModel, self)._astream(messages, stop=stop, run_manager=run_manager, **kwargs)),
+                    _max_tokens(self, kwargs),
+                )
+                if first is not None:
+                    yield first
+                    async for chunk in rest:
+                        yield chunk
+
+        RateLimitedChatModel.__name__ = RateLimitedChatModel.__qualname__ = chat_class.__name__
+        _rate_limited_classes[chat_class] = RateLimitedChatModel
+    return _rate_limited_classes[chat_class]
+
+
+def _observe_response(key: str, response):
+    observe_rate_limit_headers(key, response.headers)
+
+
+async def _observe_response_async(key: str, response):
+    observe_rate_limit_headers(key, response.headers)
+
+
+def create_llm(provider: str, model: str, cacheable: bool = False, **kwargs):
+    """
+    Creates the chat model every crew uses, e.g. create_llm("groq", "llama3-70b-8192", temperature=0.5).
+    Its calls share one rate limiter per provider and model across the process, so throttled calls are
+    retried by the limiter instead of by each client on its own. Responses are served from the persistent
+    LLM cache when the model is deterministic or created with cacheable=True, or whenever LLM_CACHE=1;
+    cache hits skip the limiter.
+    """
+    chat_class, api_key_variable = PROVIDERS[provider]
+    kwargs.setdefault("api_key", os.getenv(api_key_variable))
+    cache = llm_cache_for(kwargs.get("temperature"), cacheable)
+    if cache is not None:
+        kwargs.setdefault("cache", cache)
+    # The limiter retries throttled calls; client retries would bypass its backoff
+    kwargs.setdefault("max_retries", 0)
+    if "http_client" in getattr(chat_class, "__fields__", {}):
+        # Clients built on httpx pass every response's rate limit headers to the limiter, not only a 429's
+        key = f"{provider}:{model}"
+        kwargs.setdefault("http_client", httpx.Client(event_hooks={"response": [partial(_observe_response, key)]}))
+        kwargs.setdefault("http_async_client",
+                          httpx.AsyncClient(event_hooks={"response": [partial(_observe_response_async, key)]}))
+    return rate_limited_class(chat_class)(model=model, **kwargs)
@@ -1,22 +1,127 @@
 # ocr_helper.py
 
 import easyocr
+from easyocr.utils import get_paragraph
 from PIL import Image
 import cv2
 import numpy as np
 import io
+import os
+import threading
+import time
+from dataclasses import dataclass
 
-def preprocess_image(image_bytes):
+from helper_functions.extraction_cache import cached_extraction, content_digest, extraction_key
+from helper_functions.extraction_cache import get_cached_extractions, store_extractions
+
+# Readers unused for this long are dropped to give their memory back
+OCR_READER_IDLE_SECONDS = float(os.getenv("OCR_READER_IDLE_SECONDS", "900"))
+
+# Images per EasyOCR batch, and the pixel step their sizes are rounded to for grouping
+OCR_BATCH_SIZE = int(os.getenv("OCR_BATCH_SIZE", "8"))
+OCR_SIZE_BUCKET_STEP = 64
+
+# Resolution text is processed at; phone photos are far above it
+OCR_TARGET_DPI = int(os.getenv("OCR_TARGET_DPI", "200"))
+# Page size assumed when neither the image nor its PDF page tells the resolution (A4/letter)
+PAGE_LONG_SIDE_INCHES = 11.7
+# Cameras write 72 or 96 DPI whatever they photograph; only scanner-like resolutions are trusted
+MIN_METADATA_DPI = 100
+# Long side of the thumbnail text regions are located on
+TEXT_DETECTION_LONG_SIDE = 512
+# Thumbnail blocks smaller than this are specks of noise, not text
+MIN_TEXT_BLOCK_PIXELS = 24
+# A text box covering more of the frame than this found background texture, not text
+MAX_TEXT_BOX_FRACTION = 0.9
+
+# One warm reader per (language set, gpu) in this process
+_reader_pool = {}
+_reader_pool_lock = threading.Lock()
+_evictor_thread = None
+
+def decode_grayscale(image_bytes):
+    """
+    Decodes the image bytes straight to a grayscale array, without an RGB copy.
+    """
+    gray = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_GRAYSCALE)
+    if gray is None:
+        # OpenCV can't decode some formats (e.g. GIF); PIL converts to grayscale while decoding
+        gray = np.array(Image.open(io.BytesIO(image_bytes)).convert('L'))
+    return gray
+
+def image_dpi(image_bytes):
+    """
+    Returns the resolution recorded in the image's metadata, or None if it has no trustworthy one.
+    """
+    try:
+        # Only the header is parsed; the pixels are not decoded
+        dpi = Image.open(io.BytesIO(image_bytes)).info.get("dpi")
+    except Exception:
+        return None
+    if not dpi or min(dpi) < MIN_METADATA_DPI:
+        return None
+    return float(max(dpi))
+
+def downsample_to_dpi(gray, target_dpi=OCR_TARGET_DPI, source_dpi=None, page_long_side_inches=None):
+    """
+    Shrinks the image to target_dpi. Its resolution is source_dpi when known, else derived from
+    the size of the page it shows, else guessed from an A4/letter page.
+    """
+    height, width = gray.shape[:2]
+    if source_dpi:
+        scale = target_dpi / source_dpi
+    else:
+        scale = target_dpi * (page_long_side_inches or PAGE_LONG_SIDE_INCHES) / max(height, width)
+    if scale >= 1:
+        return gray
+    return cv2.resize(gray, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+
+def crop_to_text(gray, margin=16):
+    """
+    Crops the image to the bounding box of its text regions, found on a small thumbnail.
+    """
+    height, width = gray.shape[:2]
+    scale = min(1.0, TEXT_DETECTION_LONG_SIDE / max(height, width))
+    thumbnail = cv2.resize(gray, (max(1, int(width * scale)), max(1, int(height * scale))), interpolation=cv2.INTER_AREA)
+
+    # Text strokes have strong local gradients; smear them into blocks and box the blocks
+    gradient = cv2.morphologyEx(thumbnail, cv2.MORPH_GRADIENT, np.ones((3, 3), np.uint8))
+    _, mask = cv2.threshold(gradient, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (9, 3)))
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    boxes = [cv2.boundingRect(contour) for contour in contours]
+    boxes = [box for box in boxes if box[2] * box[3] >= MIN_TEXT_BLOCK_PIXELS]
+    if not boxes:
+        return gray
+
+    x = min(box[0] for box in boxes)
+    y = min(box[1] for box in boxes)
+    box_width = max(box[0] + box[2] for box in boxes) - x
+    box_height = max(box[1] + box[3] for box in boxes) - y
+    if box_width * box_height > MAX_TEXT_BOX_FRACTION * thumbnail.shape[0] * thumbnail.shape[1]:
+        # Otsu split background texture rather than text; keep the whole frame
+        return gray
+    left = max(0, int(x / scale) - margin)
+    top = max(0, int(y / scale) - margin)
+    right = min(width, int((x + box_width) / scale) + margin)
+    bottom = min(height, int((y + box_height) / scale) + margin)
+    return gray[top:bottom, left:right]
+
+def preprocess_image(image_bytes, page_long_side_inches=None):
     """
-    Preprocesses the image to enhance OCR accuracy.
+    Preprocesses the image to enhance OCR accuracy. The image is decoded once to grayscale
+    and reduced to the text area at the target DPI before the expensive filters run.
+    page_long_side_inches is the size of the PDF page the image was taken from, if any.
     """
     try:
-        # Open the image using PIL
-        image = Image.open(io.BytesIO(image_bytes)).convert('RGB')
-        image_np = np.array(image)
+        gray = decode_grayscale(image_bytes)
+    except Exception as e:
+        print(f"Error decoding image: {e}")
+        return None  # Return None if the image can't be decoded at all
 
-        # Convert to grayscale
-        gray = cv2.cvtColor(image_np, cv2.COLOR_RGB2GRAY)
+    try:
+        gray = downsample_to_dpi(gray, source_dpi=image_dpi(image_bytes), page_long_side_inches=page_long_side_inches)
+        gray = crop_to_text(gray)
 
         # Apply Gaussian Blur to reduce noise
         blurred = cv2.GaussianBlur(gray, (5, 5), 0)
@@ -38,13 +143,8 @@ def preprocess_image(image_bytes):
 
     except Exception as e:
         print(f"Error during preprocessing: {e}")
-        # If preprocessing fails, return the original grayscale image
-        try:
-            gray = cv2.cvtColor(np.array(Image.open(io.BytesIO(image_bytes)).convert('RGB')), cv2.COLOR_RGB2GRAY)
-            return gray
-        except Exception as inner_e:
-            print(f"Error during fallback preprocessing: {inner_e}")
-            return None  # Return None if all preprocessing steps fail
+        # If preprocessing fails, return the grayscale image decoded above
+        return gray
 
 def initialize_reader(languages=['en'], use_gpu=False):
     """
@@ -57,9 +157,86 @@ def initialize_reader(languages=['en'], use_gpu=False):
         print(f"Error initializing EasyOCR Reader: {e}")
         raise e
 
+def reader_memory_bytes(reader):
+    """
+    Estimates the memory held by a reader's detection and recognition networks.
+    """
+    total = 0
+    for network in (getattr(reader, "detector", None), getattr(reader, "recognizer", None)):
+        if network is not None and hasattr(network, "parameters"):
+            total += sum(parameter.numel() * parameter.element_size() for parameter in network.parameters())
+    return total
+
+def evict_idle_readers(idle_seconds=OCR_READER_IDLE_SECONDS, keep=None):
+    """
+    Drops the readers that have not been used for idle_seconds, except the one keyed by keep.
+    """
+    now = time.monotonic()
+    with _reader_pool_lock:
+        for key in [key for key, entry in _reader_pool.items()
+                    if key != keep and now - entry["last_used"] > idle_seconds]:
+            print(f"Evicting idle EasyOCR reader {key}")
+            del _reader_pool[key]
+
+def _evict_idle_readers_periodically():
+    # Idle workers get no more calls, so their readers are dropped from here rather than from get_reader
+    while True:
+        time.sleep(max(1.0, OCR_READER_IDLE_SECONDS / 4))
+        evict_idle_readers()
+
+def start_reader_evictor():
+    """
+    Starts the background thread that drops idle readers, once per process.
+    """
+    global _evictor_thread
+    with _reader_pool_lock:
+        if _evictor_thread is None:
+            _evictor_thread = threading.Thread(target=_evict_idle_readers_periodically, name="ocr-reader-evictor",
+                                               daemon=True)
+            _evictor_thread.start()
+
+def get_reader(languages=['en'], use_gpu=False):
+    """
+    Returns the warm EasyOCR Reader for the language set, creating it on first use.
+    """
+    key = (tuple(sorted(languages)), use_gpu)
+    evict_idle_readers(keep=key)
+    start_reader_evictor()
+    with _reader_pool_lock:
+        entry = _reader_pool.get(key)
+        if entry is None:
+            reader = initialize_reader(list(key[0]), use_gpu)
+            entry = {"reader": reader, "bytes": reader_memory_bytes(reader)}
+            _reader_pool[key] = entry
+        entry["last_used"] = time.monotonic()
+        return entry["reader"]
+
+def reader_pool_stats():
+    """
+    Reports the readers held by this process, their estimated memory and idle time.
+    """
+    now = time.monotonic()
+    with _reader_pool_lock:
+        readers = {
+            f"{'+'.join(languages)}{' (gpu)' if use_gpu else ''}": {
+                "bytes": entry["bytes"],
+                "idle_seconds": now - entry["last_used"],
+            }
+            for (languages, use_gpu), entry in _reader_pool.items()
+        }
+    return {"readers": readers, "total_bytes": sum(reader["bytes"] for reader in readers.values())}
+
+def prewarm_readers(language_sets=(['en'],), use_gpu=False):
+    """
+    Loads the readers for the given language sets ahead of the first OCR call.
+    """
+    for languages in language_sets:
+        get_reader(languages, use_gpu)
+
 def perform_ocr(reader, image_array):
     """
     Performs OCR on the given image using the provided EasyOCR Reader.
+    Errors are raised, so a failed read is never cached as empty text.
     """
     try:
         results = reader.readtext(image_array, detail=0, paragraph=True)
@@ -67,36 +244,136 @@ def perform_ocr(reader, image_array):
         return extracted_text
     except Exception as e:
         print(f"Error during OCR: {e}")
-        return ""
+        raise
 
-def ocr_helper(uploaded_file, languages=['en'], preprocess=True, use_gpu=False):
+def load_ocr_image(image_bytes, preprocess=True, page_long_side_inches=None):
     """
-    Extracts text from the given image uploaded via Streamlit.
+    Decodes the image bytes into the array handed to EasyOCR, preprocessed if requested.
     """
-    try:
-        # Read the uploaded file as bytes
-        image_bytes = uploaded_file.read()
-
-        # Optionally preprocess the image
-        if preprocess:
-            processed_image = preprocess_image(image_bytes)
-            if processed_image is None:
-                print(f"Preprocessing failed for file: {uploaded_file.name}. Using original image.")
-                # Fallback: Convert image bytes to NumPy array without preprocessing
-                image = Image.open(io.BytesIO(image_bytes)).convert('RGB')
-                processed_image = np.array(image)
-        else:
-            # Convert image bytes to NumPy array without preprocessing
-            image = Image.open(io.BytesIO(image_bytes)).convert('RGB')
-            processed_image = np.array(image)
-
-        # Initialize the EasyOCR reader
-        reader = initialize_reader(languages, use_gpu)
+    # Optionally preprocess the image
+    if preprocess:
+        processed_image = preprocess_image(image_bytes, page_long_side_inches)
+        if processed_image is not None:
+            return processed_image
+        print("Preprocessing failed. Using original image.")
+    # Fallback: Convert image bytes to NumPy array without preprocessing
+    image = Image.open(io.BytesIO(image_bytes)).convert('RGB')
+    return np.array(image)
+
+def ocr_options(languages, preprocess, mode):
+    """
+    The OCR settings that change the extracted text, as part of the extraction cache key.
+    """
+    return {"languages": sorted(languages), "preprocess": preprocess, "target_dpi": OCR_TARGET_DPI, "mode": mode}
+
+def ocr_image_bytes(image_bytes, languages=['en'], preprocess=True, use_gpu=False):
+    """
+    Extracts text from the given image bytes.
+    """
+    def extract():
+        processed_image = load_ocr_image(image_bytes, preprocess)
+
+        # Reuse the warm EasyOCR reader of this process
+        reader = get_reader(languages, use_gpu)
 
         # Perform OCR
-        extracted_text = perform_ocr(reader, processed_image)
+        return {"text": perform_ocr(reader, processed_image)}
 
-        return extracted_text
+    # Images already read with the same options are served from the extraction cache
+    return cached_extraction("ocr", image_bytes, ocr_options(languages, preprocess, "paragraph"), extract)["text"]
+
+@dataclass
+class OcrResult:
+    """
+    Text read from one image, with the mean recognition confidence.
+    """
+    text: str = ""
+    confidence: float = 0.0
+    error: str = None
+
+def size_bucket(image_array, step=OCR_SIZE_BUCKET_STEP):
+    """
+    Rounds an image's size to the bucket it is batched in, as (width, height).
+    """
+    height, width = image_array.shape[:2]
+    return (max(step, round(width / step) * step), max(step, round(height / step) * step))
+
+def detections_to_result(detections):
+    """
+    Joins EasyOCR detections into text in reading order, with the length-weighted mean confidence.
+    """
+    if not detections:
+        return OcrResult()
+    # Boxes are merged into lines and paragraphs the way readtext(paragraph=True) does, so words on a
+    # slightly skewed line stay together instead of being ordered by their top-left corners
+    paragraphs = get_paragraph([list(detection) for detection in detections], x_ths=1, y_ths=0.5, mode="ltr")
+    text = "\n".join(paragraph[1] for paragraph in paragraphs)
+    weights = [max(1, len(detection[1])) for detection in detections]
+    confidence = sum(weight * float(detection[2]) for weight, detection in zip(weights, detections)) / sum(weights)
+    return OcrResult(text=text, confidence=confidence)
+
+def ocr_batch(images_bytes, languages=['en'], preprocess=True, use_gpu=False, batch_size=OCR_BATCH_SIZE,
+              page_sizes=None):
+    """
+    Extracts text from many images at once. Images of similar size are resized to a common
+    size and run through EasyOCR's batched detection and recognition together.
+    page_sizes optionally gives the long side in inches of the PDF page each image was taken from.
+    Returns one OcrResult per image, in input order.
+    """
+    results = [None] * len(images_bytes)
+    page_sizes = page_sizes or [None] * len(images_bytes)
+
+    # Serve images already read with the same options from the extraction cache
+    options = ocr_options(languages, preprocess, "batched")
+    keys = [extraction_key("ocr", content_digest(image_bytes),
+                           {**options, "page_long_side_inches": page_size} if page_size else options)
+            for image_bytes, page_size in zip(images_bytes, page_sizes)]
+    cached = get_cached_extractions(keys)
+
+    buckets = {}
+    for number, image_bytes in enumerate(images_bytes):
+        if keys[number] in cached:
+            results[number] = OcrResult(**cached[keys[number]])
+            continue
+        try:
+            image_array = load_ocr_image(image_bytes, preprocess, page_sizes[number])
+        except Exception as e:
+            results[number] = OcrResult(error=f"Could not decode image: {e}")
+            continue
+        buckets.setdefault(size_bucket(image_array), []).append((number, image_array))
+
+    # Only load the reader if some image actually needs OCR
+    reader = get_reader(languages, use_gpu) if buckets else None
+    for (width, height), members in buckets.items():
+        for start in range(0, len(members), batch_size):
+            batch = members[start:start + batch_size]
+            try:
+                batch_detections = reader.readtext_batched([image_array for _, image_array in batch],
+                                                           n_width=width, n_height=height,
+                                                           batch_size=batch_size, detail=1)
+            except Exception as e:
+                print(f"Error during batched OCR: {e}")
+                for number, _ in batch:
+                    results[number] = OcrResult(error=str(e))
+                continue
+            for (number, _), detections in zip(batch, batch_detections):
+                try:
+                    results[number] = detections_to_result(detections)
+                except Exception as e:
+                    results[number] = OcrResult(error=f"Could not read OCR detections: {e}")
+            # Only successful reads are cached; a failed one is retried next time
+            store_extractions({keys[number]: {"text": results[number].text, "confidence": results[number].confidence}
+                               for number, _ in batch if results[number].error is None})
+    return results
+
+def ocr_helper(uploaded_file, languages=['en'], preprocess=True, use_gpu=False):
+    """
+    Extracts text from the given image uploaded via Streamlit.
+    """
+    try:
+        # View the uploaded file's buffer instead of copying it out
+        image_bytes = uploaded_file.getbuffer() if hasattr(uploaded_file, "getbuffer") else uploaded_file.read()
+        return ocr_image_bytes(image_bytes, languages, preprocess, use_gpu)
 
     except Exception as e:
         print(f"Error in ocr_helper: {e}")
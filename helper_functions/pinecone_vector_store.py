@@ -3,15 +3,21 @@ import sys
 sys.modules['sqlite3'] = sys.modules.pop('pysqlite3')
 
 import os
+from functools import lru_cache
 from dotenv import load_dotenv
 
-from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_pinecone import PineconeVectorStore
 
 from pinecone import Pinecone
 
+from helper_functions.embedding_cache import CachedEmbeddings
+
 load_dotenv()
 
+EMBEDDING_MODEL_NAME = "sentence-transformers/all-mpnet-base-v2"
+
+
+@lru_cache(maxsize=None)
 def pinecone_vector_store():
     """
     Setting API key.
@@ -21,11 +27,14 @@ def pinecone_vector_store():
     index_name = "surgical-assistant"
     index = pc.Index(index_name)
 
-    embedding = HuggingFaceEmbeddings(model_name="sentence-transformers/all-mpnet-base-v2")
-    vector_store = PineconeVectorStore(index=index, embedding=embedding)
+    vector_store = PineconeVectorStore(index=index, embedding=embeddings())
 
     return vector_store
 
+
+@lru_cache(maxsize=None)
 def embeddings():
-    embedding = HuggingFaceEmbeddings(model_name="sentence-transformers/all-mpnet-base-v2")
-    return embedding
\ No newline at end of file
+    """
+    Returns the shared embedding model, with repeated texts served from the embedding cache.
+    """
+    return CachedEmbeddings(model_name=EMBEDDING_MODEL_NAME)
@@ -0,0 +1,79 @@
+import os
+import re
+
+# Keywords used to place a procedure under a surgical specialty
+SPECIALTY_KEYWORDS = {
+    "general surgery": ["appendectomy", "cholecystectomy", "hernia", "colectomy", "gastrectomy",
+                        "bowel", "laparotomy", "mastectomy", "thyroidectomy", "splenectomy"],
+    "orthopedics": ["knee", "hip", "arthroplasty", "arthroscopy", "fracture", "acl", "shoulder",
+                    "spinal fusion", "joint replacement"],
+    "cardiothoracic surgery": ["bypass", "cabg", "valve", "cardiac", "thoracotomy", "lobectomy",
+                               "pneumonectomy", "heart"],
+    "neurosurgery": ["craniotomy", "laminectomy", "discectomy", "brain", "shunt"],
+    "obstetrics and gynecology": ["cesarean", "caesarean", "c-section", "hysterectomy", "myomectomy",
+                                  "oophorectomy"],
+    "urology": ["prostatectomy", "nephrectomy", "cystoscopy", "lithotripsy", "ureteroscopy"],
+    "vascular surgery": ["endarterectomy", "aneurysm", "varicose", "arteriovenous"],
+    "ophthalmology": ["cataract", "vitrectomy", "glaucoma", "retina"],
+    "otolaryngology": ["tonsillectomy", "adenoidectomy", "septoplasty", "sinus", "tympanoplasty"],
+}
+
+
+def normalize_procedure_name(name: str) -> str:
+    """
+    Lowercases a procedure name and strips punctuation and extra whitespace.
+    """
+    name = re.sub(r"[^a-z0-9]+", " ", (name or "").lower())
+    return " ".join(name.split())
+
+
+def _contains_words(text: str, phrase: str) -> bool:
+    return f" {phrase} " in f" {text} "
+
+
+def specialty_for(procedure: str):
+    """
+    Returns the surgical specialty of a procedure, or None if no keyword matches.
+    """
+    normalized = normalize_procedure_name(procedure)
+    for specialty, keywords in SPECIALTY_KEYWORDS.items():
+        if any(_contains_words(normalized, normalize_procedure_name(keyword)) for keyword in keywords):
+            return specialty
+    return None
+
+
+def procedure_from_source(source: str) -> str:
+    """
+    Derives the procedure name from a knowledge base file name, e.g. "laparoscopic_appendectomy.pdf".
+    """
+    stem = os.path.splitext(os.path.basename(source or ""))[0]
+    return normalize_procedure_name(stem)
+
+
+def tag_chunks(text_chunks, procedure_map: dict = None):
+    """
+    Adds procedure and specialty metadata to each chunk. procedure_map maps file names to
+    procedure names; files not in it are named after the file itself.
+    """
+    procedure_map = {os.path.basename(key): value for key, value in (procedure_map or {}).items()}
+    for chunk in text_chunks:
+        source = chunk.metadata.get("source", "")
+        procedure = procedure_map.get(os.path.basename(source)) or procedure_from_source(source)
+        chunk.metadata["procedure"] = normalize_procedure_name(procedure)
+        chunk.metadata["specialty"] = specialty_for(procedure) or "general"
+    return text_chunks
+
+
+def match_procedure(surgery_name: str, known_procedures):
+    """
+    Finds the known procedure that the surgery name refers to, or None.
+    """
+    normalized = normalize_procedure_name(surgery_name)
+    if not normalized:
+        return None
+    if normalized in known_procedures:
+        return normalized
+    # Prefer the most specific known name contained in, or containing, the surgery name
+    candidates = [procedure for procedure in known_procedures
+                  if procedure and (_contains_words(normalized, procedure) or _contains_words(procedure, normalized))]
+    return max(candidates, key=len) if candidates else None
@@ -1,6 +1,12 @@
+import hashlib
+
 from langchain_community.document_loaders import PyPDFLoader, DirectoryLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_huggingface import HuggingFaceEmbeddings
+
+from helper_functions.embedding_cache import CachedEmbeddings
+from helper_functions.pinecone_vector_store import pinecone_vector_store
+from helper_functions.bm25_index import build_bm25_index
+from helper_functions.procedure_catalog import tag_chunks
 
 
 #Extract data from the PDF
@@ -32,7 +38,34 @@ def text_split(extracted_data):
 
 #download embedding model
 def download_hugging_face_embeddings():
-    embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
+    embeddings = CachedEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
     return embeddings
 
 
+
+
+#Give every chunk a stable id so vector and lexical hits can be matched up
+def assign_chunk_ids(text_chunks):
+    """
+    Function to add a content-based chunk id to each chunk's metadata.
+    """
+    for chunk in text_chunks:
+        fingerprint = f"{chunk.metadata.get('source')}|{chunk.metadata.get('page')}|{chunk.page_content}"
+        chunk.metadata["chunk_id"] = hashlib.sha256(fingerprint.encode("utf-8")).hexdigest()[:32]
+    return text_chunks
+
+
+
+#Load, split and index the knowledge base documents
+def ingest_documents(data, procedure_map=None):
+    """
+    Function to ingest the PDFs into the Pinecone index and the local BM25 index.
+    Chunks are tagged with procedure and specialty metadata; procedure_map maps file names to procedures.
+    """
+    text_chunks = tag_chunks(assign_chunk_ids(text_split(load_pdf(data))), procedure_map)
+
+    vector_store = pinecone_vector_store()
+    vector_store.add_documents(text_chunks, ids=[chunk.metadata["chunk_id"] for chunk in text_chunks])
+
+    build_bm25_index(text_chunks)
+    return text_chunks
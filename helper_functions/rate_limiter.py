@@ -0,0 +1,391 @@
+import asyncio
+import contextlib
+import contextvars
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+
+from helper_functions.async_crews import check_cancelled
+from helper_functions.sqlite_cache import cache_path
+from helper_functions.token_counter import count_tokens
+
+# Requests and tokens per minute by "provider" or "provider:model", e.g. "groq=30/6000,googlegenerativeai:gemini-1.5-flash=15/1000000".
+# Every model has its own bucket; a provider entry applies to each of its models without a more specific one
+LLM_RATE_LIMITS = os.getenv("LLM_RATE_LIMITS", "")
+
+# Set to 1 to share the buckets between processes (app workers, batch runs) through a local SQLite file
+LLM_RATE_LIMIT_SHARED = os.getenv("LLM_RATE_LIMIT_SHARED", "0") == "1"
+
+# Retries of a throttled call, after waiting as long as the provider asked
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+
+# Completion tokens reserved for a call that sets no max_tokens; corrected once the usage is known
+COMPLETION_TOKEN_ESTIMATE = int(os.getenv("COMPLETION_TOKEN_ESTIMATE", "512"))
+
+MAX_BACKOFF_SECONDS = 120
+THROTTLE_EVENTS_KEPT = 100
+
+_buckets = None
+_buckets_lock = threading.Lock()
+_metrics_lock = threading.Lock()
+_metrics = {}
+_throttle_events = deque(maxlen=THROTTLE_EVENTS_KEPT)
+
+# Set by count_llm_calls() to the counter of the code running under it
+_call_counter = contextvars.ContextVar("llm_call_counter", default=None)
+
+
+class RateLimitError(Exception):
+    """
+    Raised when a call is still throttled after LLM_MAX_RETRIES retries.
+    """
+
+
+def rate_limits(spec: str = None) -> dict:
+    """
+    Parses "key=requests/tokens" pairs separated by commas; either number may be left empty for no limit.
+    """
+    limits = {}
+    for pair in (LLM_RATE_LIMITS if spec is None else spec).split(","):
+        if "=" in pair:
+            key, values = pair.split("=", 1)
+            requests, _, tokens = values.partition("/")
+            limits[key.strip().lower()] = (float(requests) if requests.strip() else None,
+                                           float(tokens) if tokens.strip() else None)
+    return limits
+
+
+def limits_for(key: str, limits: dict = None):
+    """
+    The (requests, tokens) per minute of a "provider:model" bucket, from its own entry or its provider's.
+    """
+    limits = rate_limits() if limits is None else limits
+    return limits.get(key.lower()) or limits.get(key.split(":", 1)[0].lower()) or (None, None)
+
+
+def _refill(state: dict, limits, now: float) -> dict:
+    # Tokens accrue continuously up to one minute's worth
+    elapsed = now - state["updated_at"]
+    for name, per_minute in zip(("requests", "tokens"), limits):
+        if per_minute is not None:
+            state[name] = min(per_minute, state[name] + elapsed * per_minute / 60)
+    state["updated_at"] = now
+    return state
+
+
+def _take(state: dict, limits, requests: float, tokens: float, now: float) -> float:
+    """
+    Takes from the bucket if it holds enough and returns 0, or returns how long to wait before trying again.
+    """
+    if state["blocked_until"] > now:
+        return state["blocked_until"] - now
+    waits = []
+    for name, amount, per_minute in (("requests", requests, limits[0]), ("tokens", tokens, limits[1])):
+        if per_minute is not None:
+            # A call larger than a minute's allowance waits for a full bucket rather than forever
+            amount = min(amount, per_minute)
+            if state[name] < amount:
+                waits.append((amount - state[name]) * 60 / per_minute)
+    if waits:
+        return max(waits)
+    for name, amount, per_minute in (("requests", requests, limits[0]), ("tokens", tokens, limits[1])):
+        if per_minute is not None:
+            state[name] -= min(amount, per_minute)
+    return 0.0
+
+
+class MemoryBuckets:
+    """
+    Bucket states shared by the threads of this process.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._states = {}
+
+    def update(self, key: str, limits, function):
+        with self._lock:
+            now = time.time()
+            state = self._states.setdefault(key, {"requests": limits[0] or 0, "tokens": limits[1] or 0,
+                                                  "updated_at": now, "blocked_until": 0.0})
+            return function(_refill(state, limits, now), now)
+
+
+class SQLiteBuckets:
+    """
+    Bucket states shared by every process on the machine, updated inside an immediate SQLite transaction.
+    """
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, requests REAL, "
+                                 "tokens REAL, updated_at REAL, blocked_until REAL)")
+
+    def update(self, key: str, limits, function):
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                row = self._connection.execute("SELECT requests, tokens, updated_at, blocked_until FROM buckets "
+                                               "WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    row = (limits[0] or 0, limits[1] or 0, now, 0.0)
+                state = dict(zip(("requests", "tokens", "updated_at", "blocked_until"), row))
+                result = function(_refill(state, limits, now), now)
+                self._connection.execute("INSERT OR REPLACE INTO buckets VALUES (?, ?, ?, ?, ?)",
+                                         (key, state["requests"], state["tokens"], state["updated_at"],
+                                          state["blocked_until"]))
+                self._connection.execute("COMMIT")
+            except Exception:
+                self._connection.execute("ROLLBACK")
+                raise
+        return result
+
+
+def rate_limit_buckets():
+    """
+    Returns the bucket store: in memory, or in a SQLite file with LLM_RATE_LIMIT_SHARED=1.
+    """
+    global _buckets
+    with _buckets_lock:
+        if _buckets is None:
+            _buckets = SQLiteBuckets(cache_path("rate_limits.sqlite")) if LLM_RATE_LIMIT_SHARED else MemoryBuckets()
+    return _buckets
+
+
+def acquire(key: str, tokens: float) -> float:
+    """
+    Blocks until the bucket allows one request of the given tokens, or a backoff set by a throttled call
+    has passed. Returns the seconds waited.
+    """
+    limits = limits_for(key)
+    waited = 0.0
+    while True:
+        wait = rate_limit_buckets().update(key, limits, lambda state, now: _take(state, limits, 1, tokens, now))
+        if wait <= 0:
+            return waited
+        time.sleep(wait)
+        waited += wait
+
+
+async def acquire_async(key: str, tokens: float) -> float:
+    """
+    Like acquire, but waits without blocking the event loop.
+    """
+    limits = limits_for(key)
+    waited = 0.0
+    while True:
+        wait = rate_limit_buckets().update(key, limits, lambda state, now: _take(state, limits, 1, tokens, now))
+        if wait <= 0:
+            return waited
+        await asyncio.sleep(wait)
+        waited += wait
+
+
+def settle(key: str, reserved: float, used: float):
+    """
+    Corrects the bucket once a call's actual token usage is known.
+    """
+    limits = limits_for(key)
+    if limits[1] is None or used is None:
+        return
+
+    def correct(state, now):
+        state["tokens"] = min(limits[1], state["tokens"] + reserved - used)
+
+    rate_limit_buckets().update(key, limits, correct)
+
+
+def _parse_seconds(value) -> float:
+    # Headers give plain seconds ("7") or durations ("1m2.5s", "850ms")
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    total = 0.0
+    for amount, unit in re.findall(r"([\d.]+)(ms|h|m|s)", str(value)):
+        total += float(amount) * {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[unit]
+    return total or None
+
+
+def throttle_delay(error: Exception, attempt: int):
+    """
+    Whether an error is a provider throttling the call, and if so how long to back off: what its response
+    headers ask for, or an exponential backoff with jitter. Returns None for other errors.
+    """
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    name = type(error).__name__
+    if status != 429 and "RateLimit" not in name and "ResourceExhausted" not in name:
+        return None
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    for header in ("retry-after", "x-ratelimit-reset-requests", "x-ratelimit-reset-tokens"):
+        delay = _parse_seconds(headers.get(header))
+        if delay:
+            return min(delay, MAX_BACKOFF_SECONDS)
+    return min(MAX_BACKOFF_SECONDS, 2 ** attempt + random.random())
+
+
+def observe_rate_limit_headers(key: str, headers):
+    """
+    Brings the bucket in line with the x-ratelimit-remaining-* headers of any response, since the provider's
+    counts also include other clients of the account. Once a count is down to 0, every caller of the bucket
+    waits until its x-ratelimit-reset-* time.
+    """
+    remaining, resets = {}, {}
+    for name in ("requests", "tokens"):
+        try:
+            remaining[name] = float(headers.get(f"x-ratelimit-remaining-{name}"))
+        except (TypeError, ValueError):
+            continue
+        resets[name] = _parse_seconds(headers.get(f"x-ratelimit-reset-{name}"))
+    if not remaining:
+        return
+    limits = limits_for(key)
+
+    def correct(state, now):
+        for name, per_minute in zip(("requests", "tokens"), limits):
+            if name not in remaining:
+                continue
+            if per_minute is not None:
+                state[name] = min(state[name], remaining[name])
+            if remaining[name] <= 0 and resets[name]:
+                state["blocked_until"] = max(state["blocked_until"], now + min(resets[name], MAX_BACKOFF_SECONDS))
+
+    rate_limit_buckets().update(key, limits, correct)
+
+
+def back_off(key: str, delay: float):
+    """
+    Holds every caller of the bucket, in any process sharing it, until the delay has passed.
+    """
+    limits = limits_for(key)
+
+    def block(state, now):
+        state["blocked_until"] = max(state["blocked_until"], now + delay)
+
+    rate_limit_buckets().update(key, limits, block)
+
+
+def _record(key: str, waited: float = 0.0, throttled: bool = False, delay: float = None):
+    with _metrics_lock:
+        metrics = _metrics.setdefault(key, {"calls": 0, "waited_seconds": 0.0, "max_wait_seconds": 0.0, "throttled": 0})
+        if throttled:
+            metrics["throttled"] += 1
+            _throttle_events.append({"key": key, "at": time.time(), "backoff_seconds": delay})
+        else:
+            metrics["calls"] += 1
+            metrics["waited_seconds"] += waited
+            metrics["max_wait_seconds"] = max(metrics["max_wait_seconds"], waited)
+            counter = _call_counter.get()
+            if counter is not None:
+                counter["calls"] += 1
+
+
+@contextlib.contextmanager
+def count_llm_calls():
+    """
+    Counts the calls sent to a provider inside the block, including from threads running in a copy of
+    its context such as task graph tasks. Cache hits never reach the limiter and are not counted.
+    Yields a dict whose "calls" is the count so far.
+    """
+    counter = {"calls": 0}
+    token = _call_counter.set(counter)
+    try:
+        yield counter
+    finally:
+        _call_counter.reset(token)
+
+
+def estimate_tokens(messages, max_tokens: int = None) -> int:
+    """
+    Tokens a call is expected to take: its prompt and the completion it may write.
+    """
+    prompt = sum(count_tokens(str(getattr(message, "content", message))) for message in messages)
+    return prompt + (max_tokens or COMPLETION_TOKEN_ESTIMATE)
+
+
+def _throttled(key: str, error: Exception, attempt: int) -> bool:
+    """
+    Backs the bucket off if the error is the provider throttling the call, raising RateLimitError once the
+    retries are used up. Returns False for other errors.
+    """
+    delay = throttle_delay(error, attempt)
+    if delay is None:
+        return False
+    print(f"LLM call to {key} throttled, backing off {delay:.1f}s: {error}")
+    _record(key, throttled=True, delay=delay)
+    back_off(key, delay)
+    if attempt == LLM_MAX_RETRIES:
+        raise RateLimitError(f"{key} still throttled after {LLM_MAX_RETRIES} retries") from error
+    return True
+
+
+def rate_limited_call(key: str, messages, call, max_tokens: int = None):
+    """
+    Makes an LLM call through the bucket of its provider and model. Throttled calls are retried after the
+    backoff the provider asked for, which every other caller of the bucket waits out too.
+    """
+    reserved = estimate_tokens(messages, max_tokens)
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        # A cancelled crew run makes no further calls, retries included
+        check_cancelled()
+        _record(key, waited=acquire(key, reserved))
+        try:
+            result = call()
+        except Exception as e:
+            if not _throttled(key, e, attempt):
+                raise
+            continue
+        settle(key, reserved, used_tokens(result))
+        return result
+
+
+async def rate_limited_call_async(key: str, messages, call, max_tokens: int = None):
+    """
+    Like rate_limited_call for a call returning an awaitable; waiting for the bucket doesn't block the event loop.
+    """
+    reserved = estimate_tokens(messages, max_tokens)
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        check_cancelled()
+        _record(key, waited=await acquire_async(key, reserved))
+        try:
+            result = await call()
+        except Exception as e:
+            if not _throttled(key, e, attempt):
+                raise
+            continue
+        settle(key, reserved, used_tokens(result))
+        return result
+
+
+def used_tokens(result):
+    """
+    The total tokens a ChatResult reports using, if it does.
+    """
+    for generation in getattr(result, "generations", None) or []:
+        usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+        if usage:
+            return usage.get("total_tokens")
+    usage = (getattr(result, "llm_output", None) or {}).get("token_usage") or {}
+    return usage.get("total_tokens")
+
+
+def rate_limit_metrics() -> dict:
+    """
+    Per bucket in this process: calls, total and longest wait for a slot, and throttle events,
+    with the most recent throttle events across buckets.
+    """
+    with _metrics_lock:
+        buckets = {key: dict(metrics) for key, metrics in _metrics.items()}
+        events = list(_throttle_events)
+    for metrics in buckets.values():
+        metrics["mean_wait_seconds"] = metrics["waited_seconds"] / metrics["calls"] if metrics["calls"] else 0.0
+    return {"buckets": buckets, "throttle_events": events}
@@ -0,0 +1,62 @@
+import math
+import os
+import threading
+from contextvars import ContextVar
+
+from helper_functions.embedding_cache import normalize_text
+
+PREFETCH_SIMILARITY_THRESHOLD = float(os.getenv("PREFETCH_SIMILARITY_THRESHOLD", "0.85"))
+
+# Retrieval cache of the crew run in progress, seeded by the kickoff prefetch
+active_retrieval_cache = ContextVar("active_retrieval_cache", default=None)
+
+
+def cosine_similarity(first, second) -> float:
+    dot = sum(a * b for a, b in zip(first, second))
+    norm = math.sqrt(sum(a * a for a in first)) * math.sqrt(sum(b * b for b in second))
+    return dot / norm if norm else 0.0
+
+
+class RetrievalCache:
+    """
+    Per-run cache of retrieved passages. A tool query is served from it when it matches a stored
+    query exactly or its embedding is close enough to a stored query's embedding.
+    """
+
+    def __init__(self, similarity_threshold: float = PREFETCH_SIMILARITY_THRESHOLD):
+        self.similarity_threshold = similarity_threshold
+        self.entries = []  # (normalized query, query vector, documents)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def add(self, query: str, query_vector, documents):
+        with self._lock:
+            self.entries.append((normalize_text(query).lower(), query_vector, documents))
+
+    def lookup(self, query: str, query_vector=None):
+        """
+        Returns the cached documents for query, or None. query_vector is only needed for the
+        similarity match and is skipped if None.
+        """
+        normalized = normalize_text(query).lower()
+        with self._lock:
+            documents = next((docs for stored, _, docs in self.entries if stored == normalized), None)
+            if documents is None and query_vector is not None and self.entries:
+                score, best = max(((cosine_similarity(query_vector, vector), docs)
+                                   for _, vector, docs in self.entries), key=lambda item: item[0])
+                if score >= self.similarity_threshold:
+                    documents = best
+            if documents is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return documents
+
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def report(self) -> str:
+        return (f"{len(self.entries)} prefetched queries, {self.hits} hits, "
+                f"{self.misses} misses, hit rate {self.hit_rate():.0%}")
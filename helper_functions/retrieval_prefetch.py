@@ -0,0 +1,60 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from helper_functions.pinecone_vector_store import embeddings
+from helper_functions.knowledge_retrieval import search_passages
+from helper_functions.retrieval_cache import RetrievalCache, active_retrieval_cache
+
+# Lookups the pre-surgery risk, instruments, technique, step-by-step and chief surgeon agents make
+PREFETCH_QUERY_TEMPLATES = [
+    "surgical risks and complications of {surgery_name}",
+    "surgical instruments required for {surgery_name}",
+    "surgical technique for {surgery_name}",
+    "step by step procedure for {surgery_name}",
+    "pre-operative preparation and precautions for {surgery_name}",
+]
+
+
+def prefetch_retrieval(surgery_name: str, retrieval_cache: RetrievalCache, top_k: int = 5):
+    """
+    Embeds the expected queries for the surgery in one batch, runs their searches
+    concurrently and seeds the retrieval cache with the results.
+    """
+    start = time.perf_counter()
+    queries = [template.format(surgery_name=surgery_name) for template in PREFETCH_QUERY_TEMPLATES]
+    query_vectors = embeddings().embed_documents(queries)
+
+    with ThreadPoolExecutor(max_workers=len(queries)) as executor:
+        futures = [executor.submit(search_passages, query, top_k, surgery_name, vector)
+                   for query, vector in zip(queries, query_vectors)]
+        for query, vector, future in zip(queries, query_vectors, futures):
+            try:
+                documents, _, _ = future.result()
+            except Exception as e:
+                print(f"Prefetch failed for query '{query}': {e}")
+                continue
+            retrieval_cache.add(query, vector, documents)
+
+    print(f"Prefetched {len(retrieval_cache.entries)} retrieval queries in {time.perf_counter() - start:.2f}s")
+
+
+@contextmanager
+def prefetched_retrieval(surgery_name: str):
+    """
+    Serves the crew run inside the with-block from a retrieval cache seeded at kickoff,
+    and reports the cache hit rate when the run ends.
+    """
+    retrieval_cache = RetrievalCache()
+    try:
+        prefetch_retrieval(surgery_name, retrieval_cache)
+    except Exception as e:
+        # The crew still works without the prefetch, it just retrieves on demand
+        print(f"Retrieval prefetch failed: {e}")
+
+    token = active_retrieval_cache.set(retrieval_cache)
+    try:
+        yield retrieval_cache
+    finally:
+        active_retrieval_cache.reset(token)
+        print(f"Retrieval cache for this run: {retrieval_cache.report()}")
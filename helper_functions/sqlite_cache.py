@@ -0,0 +1,157 @@
+import os
+import sqlite3
+import threading
+import time
+
+CACHE_DIR = os.getenv("CACHE_DIR", ".cache")
+
+
+def cache_path(file_name: str) -> str:
+    """
+    Returns the path of a cache file inside the local cache directory.
+    """
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    return os.path.join(CACHE_DIR, file_name)
+
+
+class SQLiteCache:
+    """
+    Small key-value store on SQLite with LRU eviction by entry count and total size,
+    and optional expiry of entries older than ttl_seconds.
+    """
+
+    def __init__(self, path: str, max_entries: int = None, max_bytes: int = None, ttl_seconds: float = None):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, "
+            "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at)")
+        self._connection.commit()
+
+    def _expiry_cutoff(self):
+        if self.ttl_seconds is None:
+            return None
+        return time.time() - self.ttl_seconds
+
+    def get(self, key: str):
+        """
+        Returns the stored value for key, or None if it is missing or expired.
+        """
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys) -> dict:
+        """
+        Looks up many keys at once and returns a dict of the ones found.
+        """
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        if not keys:
+            return found
+        now = time.time()
+        cutoff = self._expiry_cutoff()
+        with self._lock:
+            # SQLite limits the number of bound parameters, so look up in slices
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._connection.execute(
+                    f"SELECT key, value, created_at FROM entries WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, value, created_at in rows:
+                    if cutoff is None or created_at >= cutoff:
+                        found[key] = value
+            if found:
+                self._connection.executemany(
+                    "UPDATE entries SET accessed_at = ? WHERE key = ?", [(now, key) for key in found]
+                )
+                self._connection.commit()
+        return found
+
+    def set(self, key: str, value: bytes):
+        """
+        Stores value under key.
+        """
+        self.set_many({key: value})
+
+    def set_many(self, items: dict):
+        """
+        Stores many values at once and evicts the least recently used entries if over the size cap.
+        """
+        if not items:
+            return
+        now = time.time()
+        with self._lock:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO entries (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                [(key, value, len(value), now, now) for key, value in items.items()]
+            )
+            self._evict()
+            self._connection.commit()
+
+    def delete(self, key: str):
+        """
+        Removes key from the cache.
+        """
+        with self._lock:
+            self._connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self._connection.commit()
+
+    def delete_prefix(self, prefix: str) -> int:
+        """
+        Removes every key starting with prefix and returns how many were removed.
+        """
+        escaped = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        with self._lock:
+            cursor = self._connection.execute("DELETE FROM entries WHERE key LIKE ? ESCAPE '\\'", (escaped + "%",))
+            self._connection.commit()
+        return cursor.rowcount
+
+    def clear(self):
+        """
+        Removes every entry.
+        """
+        with self._lock:
+            self._connection.execute("DELETE FROM entries")
+            self._connection.commit()
+
+    def stats(self) -> dict:
+        """
+        Returns the number of entries and their total size in bytes.
+        """
+        with self._lock:
+            entries, total_bytes = self._connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+            ).fetchone()
+        return {"entries": entries, "bytes": total_bytes}
+
+    def _evict(self):
+        cutoff = self._expiry_cutoff()
+        if cutoff is not None:
+            self._connection.execute("DELETE FROM entries WHERE created_at < ?", (cutoff,))
+
+        if self.max_entries is not None:
+            self._connection.execute(
+                "DELETE FROM entries WHERE key IN ("
+                "SELECT key FROM entries ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+
+        if self.max_bytes is not None:
+            total_bytes = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            if total_bytes > self.max_bytes:
+                rows = self._connection.execute("SELECT key, size FROM entries ORDER BY accessed_at ASC").fetchall()
+                evicted = []
+                for key, size in rows:
+                    if total_bytes <= self.max_bytes:
+                        break
+                    evicted.append((key,))
+                    total_bytes -= size
+                self._connection.executemany("DELETE FROM entries WHERE key = ?", evicted)
@@ -0,0 +1,205 @@
+import contextlib
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+# Tasks run at once by a task graph, and per LLM provider, e.g. "groq=2,googlegenerativeai=4"
+CREW_MAX_CONCURRENCY = int(os.getenv("CREW_MAX_CONCURRENCY", "4"))
+LLM_PROVIDER_CONCURRENCY = os.getenv("LLM_PROVIDER_CONCURRENCY", "")
+
+# Per-provider caps shared by every graph in the process, for when several crews run at once
+_shared_provider_slots = {}
+
+
+def provider_limits(spec: str = None) -> dict:
+    """
+    Parses "provider=limit" pairs separated by commas.
+    """
+    limits = {}
+    for pair in (LLM_PROVIDER_CONCURRENCY if spec is None else spec).split(","):
+        if "=" in pair:
+            provider, limit = pair.split("=", 1)
+            limits[provider.strip().lower()] = int(limit)
+    return limits
+
+
+def limit_providers_globally(limits: dict):
+    """
+    Caps the tasks running at once per provider across every task graph in this process.
+    Only task graph nodes take these slots; a crew kicked off sequentially is not limited by them.
+    """
+    for provider, limit in limits.items():
+        _shared_provider_slots[provider] = threading.BoundedSemaphore(limit)
+
+
+@dataclass
+class GraphNode:
+    """
+    A task in the graph, or an input supplied from outside while the graph runs.
+    """
+    name: str
+    function: callable = None
+    depends_on: tuple = ()
+    provider: str = None
+    ready: float = None
+    started: float = None
+    finished: float = None
+    result: object = None
+    dependents: list = field(default_factory=list)
+
+
+class TaskGraph:
+    """
+    Runs tasks in dependency order, each as soon as its dependencies are done, with at most
+    max_concurrency tasks at once and at most provider_limits[provider] per provider.
+    on_progress, if given, is called with a message each time a task finishes.
+    """
+
+    def __init__(self, max_concurrency: int = None, provider_limits: dict = None, on_progress=None):
+        self.max_concurrency = max_concurrency or CREW_MAX_CONCURRENCY
+        self.provider_limits = provider_limits or {}
+        self.on_progress = on_progress
+        self.nodes = {}
+        self._condition = threading.Condition()
+        self._running = {}
+        self._error = None
+        self._executor = None
+        self._context = None
+        self._start = None
+
+    def add_input(self, name: str):
+        """
+        Declares a value supplied with provide() while the graph runs, e.g. an extracted document.
+        """
+        self.nodes[name] = GraphNode(name=name)
+
+    def add_task(self, name: str, function, depends_on=(), provider: str = None):
+        """
+        Adds a task. function receives a dict of its dependencies' results and returns its own.
+        """
+        for dependency in depends_on:
+            if dependency not in self.nodes:
+                raise ValueError(f"Task {name} depends on unknown task or input {dependency}")
+        self.nodes[name] = GraphNode(name=name, function=function, depends_on=tuple(depends_on), provider=provider)
+
+    def provide(self, name: str, value):
+        """
+        Supplies an input's value and starts whatever was only waiting for it.
+        """
+        with self._condition:
+            node = self.nodes[name]
+            node.result = value
+            node.ready = node.started = node.finished = self._elapsed()
+            self._schedule()
+
+    def run(self, inputs=()) -> dict:
+        """
+        Runs the graph, providing each (name, value) from inputs as it arrives. Inputs still missing
+        when inputs is exhausted are an error. Returns every node's result by name.
+        """
+        self._start = time.perf_counter()
+        # Tasks run in copies of the caller's context, so context variables like the active surgery reach them
+        self._context = contextvars.copy_context()
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            self._executor = executor
+            with self._condition:
+                self._schedule()
+            for name, value in inputs:
+                self.provide(name, value)
+
+            with self._condition:
+                missing = [node.name for node in self.nodes.values() if node.function is None and node.finished is None]
+                if missing and self._error is None:
+                    self._error = ValueError(f"Inputs never provided: {', '.join(missing)}")
+                while self._error is None and any(node.finished is None for node in self.nodes.values()):
+                    self._condition.wait()
+                while self._running:
+                    self._condition.wait()
+        if self._error is not None:
+            raise self._error
+        return {name: node.result for name, node in self.nodes.items()}
+
+    def _elapsed(self):
+        return time.perf_counter() - self._start
+
+    def _schedule(self):
+        # Called with the condition held
+        if self._error is not None:
+            return
+        for node in self.nodes.values():
+            if node.function is None or node.started is not None:
+                continue
+            if any(self.nodes[dependency].finished is None for dependency in node.depends_on):
+                continue
+            if node.ready is None:
+                node.ready = self._elapsed()
+            if len(self._running) >= self.max_concurrency:
+                return
+            limit = self.provider_limits.get(node.provider)
+            if limit is not None and sum(provider == node.provider for provider in self._running.values()) >= limit:
+                continue
+            node.started = self._elapsed()
+            self._running[node.name] = node.provider
+            self._executor.submit(self._context.copy().run, self._run_node, node)
+
+    def _run_node(self, node: GraphNode):
+        upstream = {dependency: self.nodes[dependency].result for dependency in node.depends_on}
+        try:
+            with _shared_provider_slots.get(node.provider) or contextlib.nullcontext():
+                result = node.function(upstream)
+            error = None
+        except BaseException as e:
+            # Includes CrewCancelled, which run() raises like any failure
+            result, error = None, e
+        progress = None
+        with self._condition:
+            del self._running[node.name]
+            if error is None:
+                node.result = result
+                node.finished = self._elapsed()
+                tasks = [item for item in self.nodes.values() if item.function is not None]
+                progress = (f"{sum(item.finished is not None for item in tasks)} of {len(tasks)} agent tasks done "
+                            f"(last: {node.name})")
+                self._schedule()
+            elif self._error is None:
+                self._error = error
+            self._condition.notify_all()
+        # Reported outside the lock, so a slow callback doesn't hold up scheduling
+        if progress is not None and self.on_progress is not None:
+            self.on_progress(progress)
+
+    def critical_path(self, sink: str = None):
+        """
+        The chain of nodes that determined the finish time, walking back from sink (by default the
+        last task to finish) through whichever dependency finished last.
+        """
+        finished = [node for node in self.nodes.values() if node.finished is not None]
+        if not finished:
+            return []
+        node = self.nodes[sink] if sink else max(finished, key=lambda item: item.finished)
+        path = [node]
+        while node.depends_on:
+            node = max((self.nodes[dependency] for dependency in node.depends_on), key=lambda item: item.finished)
+            path.append(node)
+        return list(reversed(path))
+
+    def timing_report(self, sink: str = None) -> str:
+        """
+        Formats the critical path with each step's wait and run time, against the total task time.
+        """
+        path = self.critical_path(sink)
+        if not path:
+            return "Nothing ran"
+        tasks = [node for node in self.nodes.values() if node.function is not None and node.finished is not None]
+        lines = [f"Critical path {path[-1].finished:.1f}s "
+                 f"(tasks took {sum(node.finished - node.started for node in tasks):.1f}s in total):"]
+        for node in path:
+            if node.function is None:
+                lines.append(f"  {node.name}: provided at {node.finished:.1f}s")
+            else:
+                lines.append(f"  {node.name}: {node.started:.1f}s -> {node.finished:.1f}s "
+                             f"({node.finished - node.started:.1f}s, waited {node.started - node.ready:.1f}s for a slot)")
+        return "\n".join(lines)
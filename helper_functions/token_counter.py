@@ -0,0 +1,50 @@
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    # tiktoken is optional; fall back to the usual ~4 characters per token estimate
+    _encoding = None
+
+CHARS_PER_TOKEN = 4
+
+
+def count_tokens(text: str) -> int:
+    """
+    Counts the tokens in the given text, approximately if tiktoken is not installed.
+    """
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """
+    Truncates the given text so that it fits within max_tokens.
+    """
+    if max_tokens <= 0:
+        return ""
+    if _encoding is not None:
+        tokens = _encoding.encode(text, disallowed_special=())
+        if len(tokens) <= max_tokens:
+            return text
+        return _encoding.decode(tokens[:max_tokens])
+    return text[:max_tokens * CHARS_PER_TOKEN]
+
+
+def truncate_at_boundary(text: str, max_tokens: int) -> str:
+    """
+    Truncates the given text to fit within max_tokens, ending at the last line or sentence that fits
+    so that no value or dose is cut in half. Falls back to the last whole word.
+    """
+    truncated = truncate_to_tokens(text, max_tokens)
+    if len(truncated) >= len(text):
+        return text
+    for boundary in ("\n", ". ", "; "):
+        cut = truncated.rfind(boundary)
+        # A boundary near the start would throw most of the budget away
+        if cut >= len(truncated) // 2:
+            return truncated[:cut + 1].rstrip()
+    cut = truncated.rfind(" ")
+    return truncated[:cut].rstrip() if cut > 0 else truncated
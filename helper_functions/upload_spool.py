@@ -0,0 +1,141 @@
+import hashlib
+import mmap
+import os
+import tempfile
+from contextlib import contextmanager, ExitStack
+from dataclasses import dataclass
+
+# Uploads larger than this are spooled to a temp file instead of being copied in memory
+UPLOAD_SPOOL_THRESHOLD_BYTES = int(os.getenv("UPLOAD_SPOOL_THRESHOLD_BYTES", str(8 * 1024 * 1024)))
+
+# Directory spool files are written to; the system temp directory when unset
+UPLOAD_SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR") or None
+
+SPOOL_CHUNK_BYTES = 1024 * 1024
+
+
+@dataclass
+class SpooledUpload:
+    """
+    An uploaded file read exactly once. Small files keep their bytes, large ones live in a
+    spool file that is memory-mapped where it is decoded, so it can be sent to a worker by path.
+    """
+    name: str
+    size: int
+    digest: str
+    data: bytes = None
+    path: str = None
+
+    @contextmanager
+    def contents(self):
+        """
+        The contents without copying them: the bytes, or a read-only map of the spool file that is closed
+        when the block exits.
+        """
+        if self.path is None:
+            yield self.data
+            return
+        mapped = map_file(self.path)
+        try:
+            yield mapped
+        finally:
+            if isinstance(mapped, mmap.mmap):
+                try:
+                    mapped.close()
+                except BufferError:
+                    # A decoder still holds a view of the map; it is unmapped once that is released
+                    pass
+
+    def cleanup(self):
+        """
+        Deletes the spool file, if any.
+        """
+        if self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def map_file(path: str) -> mmap.mmap:
+    """
+    Memory-maps a file read-only. The map works as a buffer and as a seekable stream.
+    """
+    with open(path, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+@contextmanager
+def uploads_contents(uploads):
+    """
+    The contents of several spooled uploads, as with SpooledUpload.contents, all closed when the block exits.
+    """
+    with ExitStack() as stack:
+        yield [stack.enter_context(upload.contents()) for upload in uploads]
+
+
+def _chunks(uploaded_file):
+    # Streamlit uploads are in-memory buffers; getbuffer() views them without a copy
+    if hasattr(uploaded_file, "getbuffer"):
+        view = uploaded_file.getbuffer()
+        try:
+            for start in range(0, len(view), SPOOL_CHUNK_BYTES):
+                yield view[start:start + SPOOL_CHUNK_BYTES]
+        finally:
+            view.release()
+        return
+    uploaded_file.seek(0)
+    while chunk := uploaded_file.read(SPOOL_CHUNK_BYTES):
+        yield chunk
+
+
+def spool_upload(uploaded_file, threshold: int = None) -> SpooledUpload:
+    """
+    Reads an uploaded file once, hashing it on the way. Files above the threshold are written
+    to a spool file instead of being held in memory.
+    """
+    threshold = UPLOAD_SPOOL_THRESHOLD_BYTES if threshold is None else threshold
+    name = uploaded_file.name
+    size = getattr(uploaded_file, "size", None)
+    digest = hashlib.sha256()
+
+    if size is not None and size <= threshold:
+        # Copied once, straight into a buffer of the reported size
+        data = bytearray(size)
+        filled = 0
+        with memoryview(data) as view:
+            for chunk in _chunks(uploaded_file):
+                if filled + len(chunk) > size:
+                    raise ValueError(f"{name} is larger than its reported size of {size} bytes")
+                view[filled:filled + len(chunk)] = chunk
+                filled += len(chunk)
+        del data[filled:]
+        digest.update(data)
+        return SpooledUpload(name=name, size=filled, digest=digest.hexdigest(), data=data)
+
+    descriptor, path = tempfile.mkstemp(prefix="upload-", suffix=os.path.splitext(name)[1], dir=UPLOAD_SPOOL_DIR)
+    written = 0
+    try:
+        with os.fdopen(descriptor, "wb") as spool:
+            for chunk in _chunks(uploaded_file):
+                digest.update(chunk)
+                spool.write(chunk)
+                written += len(chunk)
+    except Exception:
+        os.remove(path)
+        raise
+    return SpooledUpload(name=name, size=written, digest=digest.hexdigest(), path=path)
+
+
+@contextmanager
+def spooled_uploads(uploads):
+    """
+    Spools a batch of (category, uploaded file) pairs and deletes the spool files on exit.
+    """
+    spooled = []
+    try:
+        for category, uploaded_file in uploads:
+            spooled.append((category, spool_upload(uploaded_file)))
+        yield spooled
+    finally:
+        for _, upload in spooled:
+            upload.cleanup()
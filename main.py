@@ -1,15 +1,17 @@
 import streamlit as st
 import os
+import time
 
-from crews.pre_surgery_crew import pre_surgery_report_crew
-from crews.post_surgery_checklist_crew import post_surgery_checklist_crew
-from crews.post_surgery_faqs_crew import surgery_post_faq_crew
-from crews.post_surgery_report_crew import operative_report_crew
+from crews.pre_surgery_crew import pre_surgery_report_crew, stream_pre_surgery_report
+from crews.post_surgery_pipeline import post_surgery_pipeline
 
-from helper_functions.ocr_helper import ocr_helper
 from helper_functions.display_files_in_rows import display_files_in_rows
 from helper_functions.convert_to_pdf import convert_to_pdf
 from helper_functions.PDF_text_extractor import extract_text_from_pdf
+from helper_functions.extraction_engine import extract_uploads, join_category_text, prewarm_extraction_pool
+from helper_functions.extraction_engine import start_category_texts
+from helper_functions.job_queue import register_job, submit_job, get_job, queue_metrics, report_progress
+from helper_functions.rate_limiter import rate_limit_metrics
 from helper_functions.active_listening import active_listening
 from helper_functions.display_files_in_rows import display_files_in_rows
 from helper_functions.convert_to_pdf import convert_to_pdf
@@ -20,6 +22,132 @@ st.set_page_config(
     page_icon="stethoscope",
 )
 
+# Start each pre-surgery specialist as soon as the documents it needs are extracted
+PRE_SURGERY_STREAMING = os.getenv("PRE_SURGERY_STREAMING", "1") == "1"
+
+# Crew input each upload category is extracted into
+CATEGORY_INPUTS = {"prescription": "prescription_text", "lab_report": "lab_report_text", "scan": "scans_text"}
+
+
+def show_extraction_results(results):
+    """
+    Reports failed extractions and how long fresh OCR took.
+    """
+    for result in results:
+        if result.error:
+            st.error(f"Failed to extract {result.name}. Error: {result.error}")
+        elif result.timings and result.timings.get("ocr_errors"):
+            st.warning(f"Could not OCR {len(result.timings['ocr_errors'])} scanned pages of {result.name}; "
+                       f"they are left out of its text. {'; '.join(result.timings['ocr_errors'])}")
+        elif result.method == "ocr" and not result.cached:
+            st.success(f"Performed OCR on image: {result.name} "
+                       f"({result.seconds:.1f}s, confidence {result.confidence:.0%})")
+        elif result.timings and result.timings.get("ocr_pages") and not result.cached:
+            timings = result.timings
+            st.success(f"Performed OCR on {timings['ocr_pages']} scanned pages of {result.name} "
+                       f"({timings['text_pages']} text pages in {timings['text_seconds']:.1f}s, "
+                       f"{timings['ocr_pages']} OCR pages in {timings['ocr_seconds']:.1f}s)")
+
+
+def pre_surgery_report_from_uploads(surgery_name, patient_age, uploads, force=False):
+    """
+    Generates the pre-surgery report while its uploads are extracted: extraction starts first, and each
+    specialist starts as soon as the documents it references are in. Runs as a job, which can't write to
+    the page, so the files that failed to extract are returned with the report.
+    """
+    category_texts = start_category_texts(uploads, use_gpu=False)
+    failed_extractions = []
+
+    def extracted_documents():
+        for category, text, category_results in category_texts:
+            failed_extractions.extend(f"{result.name}. Error: {result.error}" for result in category_results if result.error)
+            report_progress(f"Extracted the {category.replace('_', ' ')} files")
+            yield CATEGORY_INPUTS[category], text
+
+    report = stream_pre_surgery_report(surgery_name, patient_age, extracted_documents(), force=force)
+    return {"report": report, "failed_extractions": failed_extractions}
+
+
+# Crew runs go to the background job queue, so reruns and widget interactions don't throw the work away
+register_job("pre_surgery_report", pre_surgery_report_crew)
+register_job("pre_surgery_report_streaming", pre_surgery_report_from_uploads)
+register_job("post_surgery_documents", post_surgery_pipeline)
+
+# Seconds between reruns while a job shown on the page is still running
+JOB_POLL_SECONDS = 2
+
+
+def start_job(state_key, kind, force=False, **inputs):
+    """
+    Queues a crew run and remembers it, with its inputs, under state_key of the session.
+    An identical earlier run is reused unless force is set.
+    """
+    st.session_state[state_key] = {"id": submit_job(kind, force=force, **inputs), "kind": kind, "inputs": inputs}
+
+
+def show_job(state_key, render):
+    """
+    Shows the progress of the session's job under state_key, or renders its result once done with a button
+    to generate it again from the same inputs. Returns True while it is unfinished.
+    """
+    submitted = st.session_state[state_key]
+    job = get_job(submitted["id"])
+    if job is None:
+        st.warning("This result has expired, please generate it again.")
+        return False
+    if job["status"] == "done":
+        render(job["result"])
+        # A finished run is reused for the same inputs; regenerating asks the crew for a fresh one
+        if st.button("Regenerate", key=f"regenerate_{state_key}"):
+            start_job(state_key, submitted["kind"], force=True, **submitted["inputs"])
+            return True
+        return False
+    if job["status"] == "failed":
+        st.error(f"Generation failed. Error: {job['error']}")
+        return False
+    metrics = queue_metrics()
+    st.info(f"{job['status'].capitalize()}: {job['progress']} "
+            f"({metrics['queued']} jobs queued, {metrics['running']} running, "
+            f"average wait {metrics['mean_wait_seconds']:.0f}s)")
+    buckets = rate_limit_metrics()["buckets"].values()
+    throttled = sum(bucket["throttled"] for bucket in buckets)
+    waited = sum(bucket["waited_seconds"] for bucket in buckets)
+    if throttled or waited >= 1:
+        st.caption(f"LLM rate limits: {waited:.0f}s spent waiting for a slot, {throttled} calls throttled by the provider")
+    return True
+
+
+def render_document(text, label, file_name, key=None):
+    """
+    Shows a generated document with a button to download it as a PDF.
+    """
+    st.write(text)
+    st.download_button(
+        label=label,
+        data=convert_to_pdf(text),
+        file_name=file_name,
+        mime="application/pdf",
+        key=key,
+    )
+
+
+def render_pre_surgery_report(result):
+    """
+    Shows the pre-surgery report, and the files a streamed run failed to extract.
+    """
+    if isinstance(result, dict):
+        for failure in result["failed_extractions"]:
+            st.error(f"Failed to extract {failure}")
+        result = result["report"]
+    render_document(result, "Download Report", "pre_surgery_report.pdf")
+
+
+# Set when a job on the page is unfinished, to rerun the script and poll it
+polling = False
+
+# Start the extraction workers (and their OCR readers) once per server process, not on every rerun
+st.cache_resource(prewarm_extraction_pool)()
+
 # Sidebar for Navigation using buttons
 st.sidebar.title("SurgiAI")
 if "active_section" not in st.session_state:
@@ -81,49 +209,29 @@ if st.session_state.active_section == "Pre Surgery Report":
         elif not has_uploaded_files:
             st.error("At least one file must be uploaded in each: prescriptions, lab reports, and scans reports.")
         else:
-            IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.tiff', '.bmp', '.gif'}
-            prescription_text = ""
-            lab_report_text = ""
-            scan_text = ""
-            if prescription_files:
-                prescription_text = ""
-                for uploaded_file in prescription_files:
-                    filename = uploaded_file.name
-                    _, ext = os.path.splitext(filename)
-                    ext = ext.lower()
-                    if ext == '.pdf':
-                        try:
-                            text = extract_text_from_pdf(uploaded_file)
-                            prescription_text += text + "\n\n\n\n"
-                        except Exception as e:
-                            st.error(f"Failed to extract PDF: {filename}. Error: {e}")
-                    elif ext in {'.png', '.jpg', '.jpeg', '.tiff', '.bmp', '.gif'}:
-                        try:
-                            text = ocr_helper(uploaded_file, preprocess=True, use_gpu=False)
-                            prescription_text += text + "\n\n\n\n"
-                            st.success(f"Performed OCR on image: {filename}")
-                        except Exception as e:
-                            st.error(f"Failed to perform OCR on image: {filename}. Error: {e}")
-                    else:
-                        st.warning(f"Unsupported file type: {filename}")
-
-            for file in lab_report_files:
-                lab_report_text += extract_text_from_pdf(file) + "\n\n\n\n"
-
-            for file in scan_files:
-                scan_text += extract_text_from_pdf(file) + "\n\n\n\n"
-            pre_surgery_report= pre_surgery_report_crew(surgery_name, patient_age , prescription_text, lab_report_text,scan_text)
-            st.write(pre_surgery_report)
-            
-            output_type = pre_surgery_report
-            type_as_str = str(output_type)
-            report_pdf_conversion = convert_to_pdf(type_as_str)
-            st.download_button(
-                label="Download Report",
-                data=report_pdf_conversion,
-                file_name="pre_surgery_report.pdf",
-                mime="application/pdf"
-            )
+            uploads = ([("prescription", file) for file in prescription_files] +
+                       [("lab_report", file) for file in lab_report_files] +
+                       [("scan", file) for file in scan_files])
+            if PRE_SURGERY_STREAMING:
+                start_job("pre_surgery_job", "pre_surgery_report_streaming",
+                          surgery_name=surgery_name, patient_age=patient_age, uploads=uploads)
+            else:
+                extraction_results = extract_uploads(uploads, use_gpu=False)
+                show_extraction_results(extraction_results)
+                total_seconds = sum(result.seconds for result in extraction_results)
+                st.caption(f"Extracted {len(extraction_results)} files ({total_seconds:.1f}s of extraction work)")
+
+                start_job(
+                    "pre_surgery_job", "pre_surgery_report",
+                    surgery_name=surgery_name,
+                    patient_age=patient_age,
+                    prescription_text=join_category_text(extraction_results, "prescription"),
+                    lab_report_text=join_category_text(extraction_results, "lab_report"),
+                    scans_text=join_category_text(extraction_results, "scan"),
+                )
+
+    if "pre_surgery_job" in st.session_state:
+        polling |= show_job("pre_surgery_job", render_pre_surgery_report)
 
 elif st.session_state.active_section == "During Surgery Voice Chat":
     st.header("During Surgery Voice Chat")
@@ -147,116 +255,53 @@ elif st.session_state.active_section == "During Surgery Voice Chat":
 elif st.session_state.active_section == "Post Surgery Suggestions":
     st.header("🩺 Post Surgery Suggestions")
 
+    # The report, FAQs and checklist are generated in one run, sharing the analyses they have in common
+    # instead of each crew repeating them
+    st.subheader("Post-Surgery Documents")
+    st.write("<h6>Our crew of AI Agents will create the report, FAQs and checklist together</h6>", unsafe_allow_html=True)
 
-    tabs = st.tabs(["📄 Report", "❓ FAQs", "✅ Checklist"])
-        
-    # Post-Surgery Checklist
-    with tabs[0]:
-        st.subheader("Post-Surgery Checklist")
-        st.write("<h6>Our crew of AI Agents will create a post surgery report for speedy recovery</h6>", unsafe_allow_html=True)
-
-        
-        st.write("<h5></h5>", unsafe_allow_html=True)
-        surgery_details_file = st.file_uploader('Upload surgery detail report',
-                                type=["pdf"], 
-                                accept_multiple_files=False)
-        
-        st.write("<h5></h5>", unsafe_allow_html=True)
-        surgeon_conversation_file = st.file_uploader("Upload Surgeon Conversations during Surgery",
-                                                type=['pdf'],
-                                                accept_multiple_files=False)
-        
-        st.write("<h5></h5>", unsafe_allow_html=True)
-        patient_condition_file =  st.file_uploader("Upload patient condition report",
+    st.write("<h5></h5>", unsafe_allow_html=True)
+    surgery_details_file = st.file_uploader('Upload the surgery details',
+                            type=["pdf"], 
+                            accept_multiple_files=False)
+    
+    st.write("<h5></h5>", unsafe_allow_html=True)
+    surgeon_conversation_file = st.file_uploader("Upload the surgeon conversations",
                                             type=['pdf'],
                                             accept_multiple_files=False)
+    
+    st.write("<h5></h5>", unsafe_allow_html=True)
+    patient_condition_file =  st.file_uploader("Upload the patient condition report",
+                                        type=['pdf'],
+                                        accept_multiple_files=False)
+
+    btn = st.button('Generate All Documents')
+    if btn:
+        if surgery_details_file and surgeon_conversation_file and patient_condition_file:
+            extraction_results = extract_uploads([("surgery_details", surgery_details_file),
+                                                  ("surgeon_conversation", surgeon_conversation_file),
+                                                  ("patient_condition", patient_condition_file)])
+            show_extraction_results(extraction_results)
+            surgery_details, surgeon_conversation, patient_conditions = [result.text for result in extraction_results]
+            start_job(
+                "post_surgery_documents_job", "post_surgery_documents",
+                surgery_details=surgery_details,
+                surgeon_conversation=surgeon_conversation,
+                patient_condition=patient_conditions,
+            )
+        else:
+            st.error('Upload all files')
 
-        btn = st.button('Generate Report')
-
-        if btn: 
-            if surgery_details_file and surgeon_conversation_file and patient_condition_file:
-                surgery_details = extract_text_from_pdf(surgery_details_file)
-                surgeon_conversation = extract_text_from_pdf(surgeon_conversation_file)
-                patient_conditions = extract_text_from_pdf(patient_condition_file)
-                response = operative_report_crew(surgery_details, surgeon_conversation, patient_conditions)
-                st.write(response)
-                pdf_bytes = convert_to_pdf(response)
-                download = st.download_button(
-                    label="📥 Download PDF Report",
-                    data=pdf_bytes,
-                    file_name="post_surgery_report.pdf",
-                    mime="application/pdf",
-                )
-            else:
-                st.error('Upload all files')
-
-    # Post-Surgery FAQs
-    with tabs[1]:
-        st.subheader("Post Surgery FAQs")
-        st.write("<h6>Our crew of AI Agents will create FAQs that will help patient in recovery</h6>", unsafe_allow_html=True)
+    def render_all_documents(result):
+        documents, savings = result
+        st.caption(savings)
+        for document, label, file_name in [("report", "📥 Download PDF Report", "post_surgery_report.pdf"),
+                                           ("faqs", "📥 Download FAQs PDF", "post_surgery_faqs.pdf"),
+                                           ("checklist", "📥 Download Checklist PDF", "post_surgery_checklist.pdf")]:
+            render_document(documents[document], label, file_name, key=f"all_documents_{document}")
 
-        st.write("<h5></h5>", unsafe_allow_html=True)
-        surgery_details_file = st.file_uploader('Upload surgery detail file',
-                                type=["pdf"], 
-                                accept_multiple_files=False)
-        
-        st.write("<h5></h5>", unsafe_allow_html=True)
-        surgeon_conversation_file = st.file_uploader("Upload surgeon conversations",
-                                                type=['pdf'],
-                                                accept_multiple_files=False)
-        
-        btn = st.button('Generate FAQ')
-
-        if btn:
-            if surgery_details_file and surgeon_conversation_file: 
-                surgery_details = extract_text_from_pdf(surgery_details_file)
-                surgeon_conversation = extract_text_from_pdf(surgeon_conversation_file)
-                response = surgery_post_faq_crew(surgery_details, surgeon_conversation)
-                st.write(response)
-                pdf_bytes = convert_to_pdf(response)
-                faq_download = st.download_button(
-                                                    label="📥 Download FAQs PDF",
-                                                    data=pdf_bytes,
-                                                    file_name="post_surgery_faqs.pdf",
-                                                    mime="application/pdf",
-                                                )
-            else:
-                st.error('Upload all files')
-
-    # Post-Surgery Report
-    with tabs[2]:
-        st.write("<h5></h5>", unsafe_allow_html=True)
-        surgery_details_file = st.file_uploader('Upload surgery details',
-                                type=["pdf"], 
-                                accept_multiple_files=False)
-        
-        st.write("<h5></h5>", unsafe_allow_html=True)
-        surgeon_conversation_file = st.file_uploader("Upload Surgeon Conversations",
-                                                type=['pdf'],
-                                                accept_multiple_files=False)
-        
-        st.write("<h5></h5>", unsafe_allow_html=True)
-        patient_condition_file =  st.file_uploader("Patient condition report",
-                                            type=['pdf'],
-                                            accept_multiple_files=False)
-
-        btn = st.button('Generate Checklist')
-        if btn: 
-            if surgery_details_file and surgeon_conversation_file and patient_condition_file:
-                surgery_details = extract_text_from_pdf(surgery_details_file)
-                surgeon_conversation = extract_text_from_pdf(surgeon_conversation_file)
-                patient_conditions = extract_text_from_pdf(patient_condition_file)
-                response = post_surgery_checklist_crew(surgery_details, surgeon_conversation, patient_conditions)
-                st.write(response)
-                pdf_bytes = convert_to_pdf(response)
-                checklist_download = st.download_button(
-                    label="📥 Download Checklist PDF",
-                    data=pdf_bytes,
-                    file_name="post_surgery_checklist.pdf",
-                    mime="application/pdf",
-                )
-            else:
-                st.error('Upload all files')
+    if "post_surgery_documents_job" in st.session_state:
+        polling |= show_job("post_surgery_documents_job", render_all_documents)
 
     st.markdown("---")
     st.caption("If you have any further questions or need assistance, our support team is here to help.")
@@ -268,4 +313,9 @@ elif st.session_state.active_section == "About":
         intra-surgery communication, and post-surgery suggestions. It provides a seamless and efficient solution to 
         streamline surgical procedures and documentation.
     """)
-    st.write("<h6>Developed by GenAgents.</h6>", unsafe_allow_html=True)
\ No newline at end of file
+    st.write("<h6>Developed by GenAgents.</h6>", unsafe_allow_html=True)
+
+# Poll unfinished jobs by rerunning the page
+if polling:
+    time.sleep(JOB_POLL_SECONDS)
+    st.rerun()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The app runs from the repository root, which holds the crews and helper_functions packages
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
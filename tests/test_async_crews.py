@@ -0,0 +1,55 @@
+import asyncio
+import threading
+
+import pytest
+
+from helper_functions import rate_limiter
+from helper_functions.async_crews import CancelToken, CrewCancelled, run_crew_async
+from helper_functions.rate_limiter import MemoryBuckets
+
+
+@pytest.fixture(autouse=True)
+def buckets(monkeypatch):
+    monkeypatch.setattr(rate_limiter, "_buckets", MemoryBuckets())
+    monkeypatch.setattr(rate_limiter, "_metrics", {})
+
+
+def crew(calls, first_call_done, cancelled):
+    """Agent steps that each make an LLM call, retrying any error the way the agent executor does."""
+    for step in range(20):
+        try:
+            rate_limiter.rate_limited_call("groq:llama3", [], lambda: calls.append(step) or "Thought: continue")
+        except Exception:
+            continue
+        first_call_done.set()
+        cancelled.wait(timeout=5)
+
+
+def test_cancelling_mid_run_stops_further_llm_calls():
+    calls = []
+    first_call_done, cancelled = threading.Event(), threading.Event()
+    token = CancelToken()
+
+    async def main():
+        run = asyncio.create_task(run_crew_async(crew, calls, first_call_done, cancelled, cancel_token=token))
+        await asyncio.get_running_loop().run_in_executor(None, first_call_done.wait, 5)
+        token.cancel()
+        cancelled.set()
+        with pytest.raises(CrewCancelled):
+            await run
+
+    asyncio.run(main())
+    assert calls == [0]
+
+
+def test_cancelled_run_never_starts():
+    token = CancelToken()
+    token.cancel()
+    calls = []
+
+    async def main():
+        with pytest.raises(CrewCancelled):
+            await run_crew_async(calls.append, "started", cancel_token=token)
+
+    asyncio.run(main())
+    assert calls == []
@@ -0,0 +1,34 @@
+import json
+import os
+
+import pytest
+
+# The crews create their LLM clients and search tool on import; no call is made with these
+for variable in ("GROQ_API_KEY", "GOOGLE_API_KEY", "TAVILY_API_KEY"):
+    os.environ.setdefault(variable, "test")
+
+# Skipped where CrewAI or the extraction libraries are not installed
+batch = pytest.importorskip("batch")
+
+
+def write_manifest(tmp_path, cases):
+    manifest = tmp_path / "cases.json"
+    manifest.write_text(json.dumps(cases))
+    return str(manifest)
+
+
+def test_cases_get_ids_and_paths_relative_to_the_manifest(tmp_path):
+    cases = batch.load_cases(write_manifest(tmp_path, [
+        {"id": "bed-12", "kind": "pre_surgery", "prescriptions": ["rx.pdf"]},
+        {"kind": "post_surgery", "surgery_details": "details.pdf"},
+    ]))
+    assert [case["id"] for case in cases] == ["bed-12", "case-2"]
+    assert cases[0]["prescriptions"] == [str(tmp_path / "rx.pdf")]
+    assert cases[1]["surgery_details"] == str(tmp_path / "details.pdf")
+
+
+def test_repeated_ids_are_rejected(tmp_path):
+    manifest = write_manifest(tmp_path, [{"id": "bed-12", "kind": "pre_surgery"}, {"kind": "pre_surgery"},
+                                         {"id": "bed-12", "kind": "post_surgery"}, {"id": "case-2"}])
+    with pytest.raises(ValueError, match="bed-12, case-2"):
+        batch.load_cases(manifest)
@@ -0,0 +1,98 @@
+import os
+
+import pytest
+
+pytest.importorskip("langchain_core")
+
+from langchain_core.documents import Document
+
+from helper_functions import bm25_index
+from helper_functions.bm25_index import BM25Index, tokenize
+
+
+def chunk(text, **metadata):
+    return Document(page_content=text, metadata=metadata)
+
+
+@pytest.fixture
+def index():
+    index = BM25Index(partition_fields=("procedure", "specialty"))
+    index.add_documents([
+        chunk("Give cefazolin 2 g IV within 60 minutes before incision.",
+              procedure="appendectomy", specialty="general surgery"),
+        chunk("Laparoscopic appendectomy: place the patient supine and insert the umbilical port.",
+              procedure="appendectomy", specialty="general surgery"),
+        chunk("Hold warfarin five days before total knee arthroplasty and bridge if needed.",
+              procedure="knee arthroplasty", specialty="orthopedics"),
+    ])
+    return index
+
+
+def test_tokenize_keeps_hyphenated_names_whole():
+    assert tokenize("Start Piperacillin-Tazobactam 4.5 g") == ["start", "piperacillin-tazobactam", "4", "5", "g"]
+
+
+def test_search_ranks_exact_term_first(index):
+    results = index.search("warfarin bridging", k=2)
+    assert len(results) == 1
+    document, score = results[0]
+    assert "warfarin" in document.page_content
+    assert document.metadata["procedure"] == "knee arthroplasty"
+    assert score > 0
+
+
+def test_rarer_terms_weigh_more(index):
+    assert index.idf("warfarin") > index.idf("before")
+
+
+def test_search_within_partition(index):
+    assert index.known_values("procedure") == {"appendectomy", "knee arthroplasty"}
+    results = index.search("before", k=5, metadata_filter={"procedure": "appendectomy"})
+    assert [document.metadata["procedure"] for document, _ in results] == ["appendectomy"]
+    assert index.search("before", metadata_filter={"procedure": "cholecystectomy"}) == []
+
+
+def test_partitions_share_the_documents(index):
+    assert len(index.documents) == 3
+    assert index.partitions[("procedure", "appendectomy")] == {0, 1}
+    assert index.partitions[("specialty", "orthopedics")] == {2}
+
+
+def test_filter_on_several_fields(index):
+    results = index.search("before", metadata_filter={"procedure": "appendectomy", "specialty": "general surgery"})
+    assert [document.page_content.split()[0] for document, _ in results] == ["Give"]
+    assert index.search("before", metadata_filter={"procedure": "appendectomy", "specialty": "orthopedics"}) == []
+    with pytest.raises(ValueError, match="Cannot filter on source"):
+        index.search("before", metadata_filter={"source": "guidelines.pdf"})
+
+
+def test_save_and_load(index, tmp_path):
+    path = str(tmp_path / "bm25_index.json")
+    index.save(path)
+    loaded = BM25Index.load(path)
+    assert len(loaded) == len(index)
+    assert loaded.partitions == index.partitions
+    (loaded_document, loaded_score), = loaded.search("cefazolin")
+    (document, score), = index.search("cefazolin")
+    assert (loaded_document.page_content, loaded_document.metadata, loaded_score) == \
+        (document.page_content, document.metadata, score)
+
+
+def test_loaded_index_is_reread_when_the_file_changes(tmp_path, monkeypatch):
+    path = str(tmp_path / "bm25_index.json")
+    monkeypatch.setenv("BM25_INDEX_PATH", path)
+    monkeypatch.setattr(bm25_index, "_loaded_index", None)
+    assert bm25_index.load_bm25_index() is None
+
+    first = BM25Index()
+    first.add_documents([chunk("Give cefazolin before incision.")])
+    first.save(path)
+    os.utime(path, (1000, 1000))
+    assert bm25_index.load_bm25_index().contains("cefazolin")
+    assert bm25_index.load_bm25_index() is bm25_index.load_bm25_index()
+
+    second = BM25Index()
+    second.add_documents([chunk("Hold warfarin five days before surgery.")])
+    second.save(path)
+    os.utime(path, (2000, 2000))
+    assert bm25_index.load_bm25_index().contains("warfarin")
@@ -0,0 +1,127 @@
+from types import SimpleNamespace
+
+import pytest
+
+# Skipped where CrewAI is not installed
+crew_checkpoints = pytest.importorskip("helper_functions.crew_checkpoints")
+
+from helper_functions import llm_cache
+from helper_functions.sqlite_cache import SQLiteCache
+
+CrewCheckpoints = crew_checkpoints.CrewCheckpoints
+task_fingerprint = crew_checkpoints.task_fingerprint
+
+
+@pytest.fixture(autouse=True)
+def checkpoint_store(tmp_path, monkeypatch):
+    store = SQLiteCache(str(tmp_path / "crew_checkpoints.sqlite"))
+    monkeypatch.setattr(crew_checkpoints, "checkpoint_cache", lambda: store)
+    monkeypatch.setattr(crew_checkpoints, "CREW_CHECKPOINTS", True)
+    return store
+
+
+def run_steps(checkpoints, calls, fail_at=None):
+    outputs = []
+    for step in ("medications", "labs", "report"):
+        def run(step=step):
+            calls.append(step)
+            if step == fail_at:
+                raise RuntimeError("provider timed out")
+            return f"{step} output"
+        outputs.append(checkpoints.output(step, run))
+    return outputs
+
+
+def test_retry_resumes_from_the_failed_step():
+    inputs = {"surgery_name": "appendectomy", "patient_age": "42"}
+    calls = []
+    with pytest.raises(RuntimeError):
+        run_steps(CrewCheckpoints("pre_surgery", inputs), calls, fail_at="labs")
+    assert calls == ["medications", "labs"]
+
+    calls.clear()
+    checkpoints = CrewCheckpoints("pre_surgery", inputs)
+    assert run_steps(checkpoints, calls) == ["medications output", "labs output", "report output"]
+    assert calls == ["labs", "report"]
+    assert checkpoints.resumed == 1
+
+
+def test_other_inputs_do_not_resume():
+    calls = []
+    run_steps(CrewCheckpoints("pre_surgery", {"surgery_name": "appendectomy"}), calls)
+    calls.clear()
+    run_steps(CrewCheckpoints("pre_surgery", {"surgery_name": "cholecystectomy"}), calls)
+    assert calls == ["medications", "labs", "report"]
+
+
+def test_clear_drops_the_run_checkpoints():
+    inputs = {"surgery_name": "appendectomy"}
+    calls = []
+    checkpoints = CrewCheckpoints("pre_surgery", inputs)
+    run_steps(checkpoints, calls)
+    checkpoints.clear()
+    calls.clear()
+    run_steps(CrewCheckpoints("pre_surgery", inputs), calls)
+    assert calls == ["medications", "labs", "report"]
+
+
+def test_forced_run_calls_every_step_again_and_overwrites_its_checkpoint():
+    inputs = {"surgery_name": "appendectomy"}
+    run_steps(CrewCheckpoints("pre_surgery", inputs), [])
+
+    calls = []
+    forced = CrewCheckpoints("pre_surgery", inputs, force=True)
+    assert forced.output("labs", lambda: calls.append("labs") or "regenerated labs") == "regenerated labs"
+    assert calls == ["labs"]
+    assert forced.resumed == 0
+
+    # A later unforced run reuses the regenerated output
+    assert CrewCheckpoints("pre_surgery", inputs).output("labs", lambda: "stale labs") == "regenerated labs"
+
+
+def test_forced_step_bypasses_the_llm_cache():
+    forced = CrewCheckpoints("pre_surgery", {"surgery_name": "appendectomy"}, force=True)
+    assert forced.output("labs", lambda: llm_cache._bypass.get()) == "True"
+    assert CrewCheckpoints("pre_surgery", {"surgery_name": "hernia"}).output("labs", lambda: llm_cache._bypass.get()) == "False"
+
+
+def test_force_overrides_the_run_per_step():
+    inputs = {"surgery_name": "appendectomy"}
+    run_steps(CrewCheckpoints("pre_surgery", inputs), [])
+    calls = []
+    checkpoints = CrewCheckpoints("pre_surgery", inputs)
+    checkpoints.output("labs", lambda: calls.append("labs") or "labs output", force=True)
+    checkpoints.output("report", lambda: calls.append("report") or "report output")
+    assert calls == ["labs"]
+
+
+def fake_task(description, model="llama3-70b-8192"):
+    agent = SimpleNamespace(role="Lab Analyst", goal="Review the labs of a {patient_age} year old",
+                            backstory="Clinical pathologist", llm=SimpleNamespace(model_name=model))
+    return SimpleNamespace(description=description, expected_output="Abnormal values", agent=agent)
+
+
+def test_fingerprint_covers_only_referenced_inputs():
+    task = fake_task("Review {lab_report_text}")
+    inputs = {"lab_report_text": "Hb 9.1", "patient_age": "42", "scans_text": "CT normal"}
+    fingerprint = task_fingerprint(task, inputs, {"medications": "Metformin"})
+    assert fingerprint["inputs"] == {"lab_report_text": "Hb 9.1", "patient_age": "42"}
+    assert fingerprint["upstream"] == {"medications": "Metformin"}
+    assert fingerprint["model"] == "llama3-70b-8192"
+    # An unreferenced input changing leaves the fingerprint, and so the checkpoint, as it was
+    assert task_fingerprint(task, {**inputs, "scans_text": "CT: free fluid"}, {"medications": "Metformin"}) == fingerprint
+
+
+def test_fingerprint_changes_with_prompt_model_or_upstream():
+    inputs = {"lab_report_text": "Hb 9.1", "patient_age": "42"}
+    fingerprint = task_fingerprint(fake_task("Review {lab_report_text}"), inputs, {})
+    assert task_fingerprint(fake_task("Summarize {lab_report_text}"), inputs, {}) != fingerprint
+    assert task_fingerprint(fake_task("Review {lab_report_text}", model="gemini-1.5-flash"), inputs, {}) != fingerprint
+    assert task_fingerprint(fake_task("Review {lab_report_text}"), inputs, {"medications": "Aspirin"}) != fingerprint
+
+
+def test_step_inputs_key_the_checkpoint():
+    checkpoints = CrewCheckpoints("pre_surgery")
+    first = checkpoints.key("labs", {"lab_report_text": "Hb 9.1"})
+    assert checkpoints.key("labs", {"lab_report_text": "Hb 9.1"}) == first
+    assert checkpoints.key("labs", {"lab_report_text": "Hb 12.4"}) != first
@@ -0,0 +1,141 @@
+import io
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+# Skipped where the OCR stack (EasyOCR, OpenCV) is not installed
+extraction_engine = pytest.importorskip("helper_functions.extraction_engine")
+
+from helper_functions.upload_spool import spool_upload
+
+ExtractionResult = extraction_engine.ExtractionResult
+
+
+class Upload(io.BytesIO):
+    """
+    An in-memory file named and sized like a Streamlit upload.
+    """
+
+    def __init__(self, name, data):
+        super().__init__(data)
+        self.name = name
+        self.size = len(data)
+
+
+@pytest.fixture
+def workers(monkeypatch):
+    """
+    Runs the extraction jobs on threads, with fake extractors that record which files they were given.
+    Files named slow_* take longer, so they finish after the files uploaded behind them.
+    """
+    calls = []
+
+    def read(upload):
+        with upload.contents() as data:
+            return bytes(data).decode()
+
+    def extract(category, upload, use_gpu):
+        calls.append(upload.name)
+        if upload.name.startswith("slow"):
+            time.sleep(0.05)
+        if upload.name.startswith("broken"):
+            raise MemoryError("worker ran out of memory")
+        return ExtractionResult(category=category, name=upload.name, text=read(upload), method="pdf")
+
+    def ocr(items, use_gpu):
+        calls.append([upload.name for _, upload in items])
+        return [ExtractionResult(category=category, name=upload.name, text=read(upload),
+                                 method="ocr", confidence=0.9) for category, upload in items]
+
+    pool = ThreadPoolExecutor(max_workers=4)
+    monkeypatch.setattr(extraction_engine, "extraction_pool", lambda: pool)
+    monkeypatch.setattr(extraction_engine, "_extract_in_worker", extract)
+    monkeypatch.setattr(extraction_engine, "_ocr_batch_in_worker", ocr)
+    monkeypatch.setattr(extraction_engine, "get_cached_extractions", lambda keys: {})
+    yield calls
+    pool.shutdown()
+
+
+def test_results_keep_upload_order(workers):
+    uploads = [("prescription", Upload("slow_rx.pdf", b"rx")), ("lab_report", Upload("cbc.pdf", b"cbc")),
+               ("scan", Upload("ct.pdf", b"ct"))]
+    results = extraction_engine.extract_uploads(uploads)
+    assert [(result.category, result.name, result.text) for result in results] == [
+        ("prescription", "slow_rx.pdf", "rx"), ("lab_report", "cbc.pdf", "cbc"), ("scan", "ct.pdf", "ct")]
+
+
+def test_failed_job_becomes_an_error_result(workers):
+    results = extraction_engine.extract_uploads([("scan", Upload("broken.pdf", b"")), ("scan", Upload("ct.pdf", b"ct"))])
+    assert results[0].error == "worker ran out of memory"
+    assert results[1].text == "ct"
+
+
+def test_same_file_in_two_categories_is_extracted_once(workers):
+    uploads = [("lab_report", Upload("cbc.pdf", b"cbc")), ("scan", Upload("cbc_copy.pdf", b"cbc"))]
+    results = extraction_engine.extract_uploads(uploads)
+    assert workers == ["cbc.pdf"]
+    assert (results[1].category, results[1].name, results[1].text, results[1].cached) == \
+        ("scan", "cbc_copy.pdf", "cbc", True)
+
+
+def test_cached_files_skip_the_workers(workers, monkeypatch):
+    cached_key = extraction_engine._cache_key("cbc.pdf", spool_upload(Upload("cbc.pdf", b"cbc")).digest)
+    monkeypatch.setattr(extraction_engine, "get_cached_extractions",
+                        lambda keys: {cached_key: {"text": "cached cbc"}} if cached_key in keys else {})
+    results = extraction_engine.extract_uploads([("lab_report", Upload("cbc.pdf", b"cbc")),
+                                                 ("prescription", Upload("rx.pdf", b"rx"))])
+    assert workers == ["rx.pdf"]
+    assert (results[0].text, results[0].cached) == ("cached cbc", True)
+
+
+def test_results_are_yielded_as_they_finish(workers):
+    uploads = [("prescription", Upload("slow_rx.pdf", b"rx")), ("lab_report", Upload("cbc.pdf", b"cbc"))]
+    assert [position for position, _ in extraction_engine.iter_extractions(uploads)] == [1, 0]
+
+
+def test_categories_are_yielded_once_complete(workers):
+    uploads = [("lab_report", Upload("slow_cbc.pdf", b"cbc")), ("scan", Upload("ct.pdf", b"ct")),
+               ("lab_report", Upload("lft.pdf", b"lft"))]
+    categories = [(category, text) for category, text, _ in extraction_engine.iter_category_texts(uploads)]
+    assert categories == [("scan", "ct\n\n\n\n"), ("lab_report", "cbc\n\n\n\nlft\n\n\n\n")]
+
+
+def test_started_extraction_runs_before_it_is_iterated(workers):
+    uploads = [("lab_report", Upload("cbc.pdf", b"cbc")), ("scan", Upload("ct.pdf", b"ct"))]
+    category_texts = extraction_engine.start_category_texts(uploads)
+    deadline = time.time() + 5
+    while len(workers) < 2 and time.time() < deadline:
+        time.sleep(0.01)
+    assert sorted(workers) == ["cbc.pdf", "ct.pdf"]
+    assert sorted(category for category, _, _ in category_texts) == ["lab_report", "scan"]
+
+
+def test_images_are_ocred_in_batches(workers, monkeypatch):
+    monkeypatch.setattr(extraction_engine, "EXTRACTION_WORKERS", 1)
+    uploads = [("scan", Upload("ct.png", b"ct")), ("lab_report", Upload("cbc.pdf", b"cbc")),
+               ("scan", Upload("xray.jpg", b"xray"))]
+    results = extraction_engine.extract_uploads(uploads)
+    assert ["ct.png", "xray.jpg"] in workers
+    assert [(result.name, result.method) for result in results] == [("ct.png", "ocr"), ("cbc.pdf", "pdf"),
+                                                                     ("xray.jpg", "ocr")]
+
+
+def test_image_groups_give_every_worker_a_share(monkeypatch):
+    monkeypatch.setattr(extraction_engine, "EXTRACTION_WORKERS", 4)
+    monkeypatch.setattr(extraction_engine, "OCR_BATCH_SIZE", 8)
+    assert extraction_engine._image_groups(list(range(6))) == [[0, 1], [2, 3], [4, 5]]
+    assert [len(group) for group in extraction_engine._image_groups(list(range(40)))] == [8] * 5
+    assert extraction_engine._image_groups([]) == []
+
+
+def test_unsupported_file_type_is_rejected():
+    with pytest.raises(ValueError):
+        extraction_engine.extract_file_bytes("notes.docx", b"")
+
+
+def test_join_category_text_skips_failed_files():
+    results = [ExtractionResult(category="scan", name="a.png", text="a"),
+               ExtractionResult(category="scan", name="b.png", error="Could not decode image"),
+               ExtractionResult(category="lab_report", name="c.pdf", text="c")]
+    assert extraction_engine.join_category_text(results, "scan") == "a\n\n\n\n"
@@ -0,0 +1,93 @@
+import threading
+import types
+from functools import partial
+
+import pytest
+
+from helper_functions import input_condenser
+from helper_functions.input_condenser import condense_inputs, condense_text, split_into_chunks
+from helper_functions.token_counter import count_tokens
+
+LAB_LINES = [f"Day {day}: Hb {9 + day % 4}.{day % 10} g/dL (ref 12.0-16.0), flagged low; "
+             f"Creatinine 1.{day % 10} mg/dL (ref 0.6-1.2)" for day in range(400)]
+LAB_REPORT = "\n".join(LAB_LINES)
+SUMMARY_LINE = "- Hb 9.1 g/dL (ref 12.0-16.0), flagged low"
+
+
+class FakeLLM:
+    """
+    Answers every summary prompt with lines_per_answer summary lines, recording the excerpts it was given.
+    """
+
+    def __init__(self, lines_per_answer=2, error=None):
+        self.lines_per_answer = lines_per_answer
+        self.error = error
+        self.excerpts = []
+        self._lock = threading.Lock()
+
+    def invoke(self, prompt):
+        with self._lock:
+            self.excerpts.append(prompt.split("Excerpt:\n", 1)[1])
+        if self.error is not None:
+            raise self.error
+        return types.SimpleNamespace(content="\n".join([SUMMARY_LINE] * self.lines_per_answer))
+
+
+def test_one_reduce_round_summarizes_every_chunk():
+    llm = FakeLLM()
+    chunks = split_into_chunks(LAB_REPORT)
+    assert len(chunks) > 1
+
+    digest, chunk_count = condense_text(LAB_REPORT, "lab report", llm, token_budget=1500)
+    assert chunk_count == len(chunks)
+    assert sorted(llm.excerpts) == sorted(chunks)
+    assert digest.splitlines() == [SUMMARY_LINE] * (2 * len(chunks))
+
+
+def test_reduce_rounds_stop_at_the_limit_and_truncate(monkeypatch):
+    # Small chunks, so the joined summaries of the first round are still too long for the budget
+    monkeypatch.setattr(input_condenser, "split_into_chunks", partial(split_into_chunks, chunk_tokens=200))
+    monkeypatch.setattr(input_condenser, "MAX_REDUCE_ROUNDS", 1)
+    llm = FakeLLM(lines_per_answer=20)
+
+    digest, chunk_count = condense_text(LAB_REPORT, "lab report", llm, token_budget=100)
+    first_round = split_into_chunks(LAB_REPORT, chunk_tokens=200)
+    # No second round ran: only the original excerpts were summarized
+    assert chunk_count == len(llm.excerpts) == len(first_round)
+    assert count_tokens(digest) <= 100
+    # Cut at a line boundary, so every summary line is whole
+    assert set(digest.splitlines()) == {SUMMARY_LINE}
+
+
+def test_second_round_condenses_the_summaries(monkeypatch):
+    monkeypatch.setattr(input_condenser, "split_into_chunks", partial(split_into_chunks, chunk_tokens=200))
+    llm = FakeLLM(lines_per_answer=20)
+
+    digest, chunk_count = condense_text(LAB_REPORT, "lab report", llm, token_budget=100)
+    first_round = split_into_chunks(LAB_REPORT, chunk_tokens=200)
+    assert chunk_count == len(llm.excerpts) > len(first_round)
+    # The second round was given the first round's summaries, not the report
+    assert all(excerpt.startswith(SUMMARY_LINE) for excerpt in llm.excerpts[len(first_round):])
+    assert count_tokens(digest) <= 100
+
+
+def test_failed_condensation_truncates_at_a_line_boundary():
+    llm = FakeLLM(error=RuntimeError("provider timed out"))
+    condensed, report = condense_inputs({"lab_report": ("lab report", LAB_REPORT),
+                                         "prescription": ("prescription", "Metformin 500 mg twice daily")},
+                                        llm, token_budget=300)
+    digest = condensed["lab_report"]
+    assert count_tokens(digest) <= 300
+    assert LAB_REPORT.startswith(digest)
+    assert digest.splitlines()[-1] in LAB_LINES
+    assert report["lab_report"]["chunks"] == 0
+
+    assert condensed["prescription"] == "Metformin 500 mg twice daily"
+    assert report["prescription"]["digest_tokens"] == report["prescription"]["original_tokens"]
+
+
+@pytest.mark.parametrize("budget", [1500, 100])
+def test_summaries_are_cut_to_the_chunk_budget(budget):
+    summary = input_condenser.summarize_chunk(FakeLLM(lines_per_answer=200), "lab report", LAB_LINES[0], budget)
+    assert count_tokens(summary) <= budget
+    assert set(summary.splitlines()) == {SUMMARY_LINE}
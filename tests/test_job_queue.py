@@ -0,0 +1,95 @@
+import io
+
+import pytest
+
+from helper_functions import job_queue
+
+
+class InlineExecutor:
+    """Runs submitted jobs straight away, so their state is known when submit_job returns."""
+
+    def __init__(self):
+        self.held = []
+        self.hold = False
+
+    def submit(self, function, *args):
+        if self.hold:
+            self.held.append((function, args))
+        else:
+            function(*args)
+
+
+@pytest.fixture(autouse=True)
+def queue(tmp_path, monkeypatch):
+    executor = InlineExecutor()
+    monkeypatch.setattr(job_queue, "_store", job_queue.JobStore(str(tmp_path / "jobs.sqlite")))
+    monkeypatch.setattr(job_queue, "_executor", executor)
+    monkeypatch.setattr(job_queue, "_job_functions", {})
+    return executor
+
+
+def register_report(calls, fail_first=False):
+    def report(surgery_name, force=False):
+        calls.append((surgery_name, force))
+        if fail_first and len(calls) == 1:
+            raise RuntimeError("provider timed out")
+        return f"report for {surgery_name}"
+    job_queue.register_job("report", report)
+
+
+def test_same_inputs_reuse_the_finished_job():
+    calls = []
+    register_report(calls)
+    first = job_queue.submit_job("report", surgery_name="appendectomy")
+    assert job_queue.get_job(first)["status"] == job_queue.DONE
+    assert job_queue.get_job(first)["result"] == "report for appendectomy"
+
+    assert job_queue.submit_job("report", surgery_name="appendectomy") == first
+    assert job_queue.submit_job("report", surgery_name="cholecystectomy") != first
+    assert calls == [("appendectomy", False), ("cholecystectomy", False)]
+
+
+def test_queued_job_is_shared_by_input_hash(queue):
+    register_report([])
+    queue.hold = True
+    first = job_queue.submit_job("report", surgery_name="appendectomy")
+    assert job_queue.get_job(first)["status"] == job_queue.QUEUED
+    assert job_queue.submit_job("report", surgery_name="appendectomy") == first
+    assert len(queue.held) == 1
+    assert job_queue.input_hash("report", {"surgery_name": "appendectomy"}) == \
+        job_queue.get_job(first)["input_hash"]
+
+
+def test_forced_resubmission_runs_again_and_passes_force_to_the_crew():
+    calls = []
+    register_report(calls)
+    first = job_queue.submit_job("report", surgery_name="appendectomy")
+    forced = job_queue.submit_job("report", force=True, surgery_name="appendectomy")
+    assert forced != first
+    assert calls == [("appendectomy", False), ("appendectomy", True)]
+    # Later unforced submissions reuse the newest run
+    assert job_queue.submit_job("report", surgery_name="appendectomy") == forced
+
+
+def test_failed_job_is_retried_by_the_next_submission():
+    calls = []
+    register_report(calls, fail_first=True)
+    failed = job_queue.submit_job("report", surgery_name="appendectomy")
+    assert job_queue.get_job(failed)["status"] == job_queue.FAILED
+    assert job_queue.get_job(failed)["error"] == "provider timed out"
+
+    retried = job_queue.submit_job("report", surgery_name="appendectomy")
+    assert retried != failed
+    assert job_queue.get_job(retried)["status"] == job_queue.DONE
+    assert len(calls) == 2
+
+
+def test_uploads_are_hashed_by_name_and_content():
+    def upload(name, data):
+        file = io.BytesIO(data)
+        file.name = name
+        return file
+
+    digest = job_queue.input_hash("report", {"uploads": [("scan", upload("ct.pdf", b"CT: normal"))]})
+    assert job_queue.input_hash("report", {"uploads": [("scan", upload("ct.pdf", b"CT: normal"))]}) == digest
+    assert job_queue.input_hash("report", {"uploads": [("scan", upload("ct.pdf", b"CT: free fluid"))]}) != digest
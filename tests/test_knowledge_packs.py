@@ -0,0 +1,96 @@
+import os
+import sys
+import types
+from functools import partial
+
+import pytest
+
+from helper_functions import knowledge_packs, sqlite_cache
+from helper_functions.knowledge_packs import get_knowledge_pack, store_knowledge_pack
+from helper_functions.sqlite_cache import SQLiteCache
+
+MODEL = "llama3-70b-8192"
+SECTIONS = {"Surgical Instruments Advisor": "Laparoscope, trocars, graspers"}
+
+
+@pytest.fixture
+def clock(tmp_path, monkeypatch):
+    now = {"time": 1000.0}
+    monkeypatch.setattr(sqlite_cache, "time", types.SimpleNamespace(time=lambda: now["time"]))
+    monkeypatch.setattr(knowledge_packs, "_shared_cache",
+                        SQLiteCache(str(tmp_path / "knowledge_packs.sqlite"), ttl_seconds=3600))
+    return now
+
+
+def test_pack_is_shared_by_spellings_of_the_procedure(clock):
+    store_knowledge_pack("Laparoscopic Appendectomy", MODEL, SECTIONS)
+    assert get_knowledge_pack("laparoscopic  appendectomy", MODEL) == SECTIONS
+    assert get_knowledge_pack("Laparoscopic Appendectomy", "gemini-1.5-flash") == {}
+
+
+def test_pack_expires_after_the_ttl(clock):
+    store_knowledge_pack("Laparoscopic Appendectomy", MODEL, SECTIONS)
+    clock["time"] += 3000
+    assert get_knowledge_pack("Laparoscopic Appendectomy", MODEL) == SECTIONS
+    clock["time"] += 601
+    assert get_knowledge_pack("Laparoscopic Appendectomy", MODEL) == {}
+
+
+def test_version_bump_stops_serving_older_packs(clock, monkeypatch):
+    store_knowledge_pack("Laparoscopic Appendectomy", MODEL, SECTIONS)
+    monkeypatch.setattr(knowledge_packs, "KNOWLEDGE_PACK_VERSION", knowledge_packs.KNOWLEDGE_PACK_VERSION + "-next")
+    assert get_knowledge_pack("Laparoscopic Appendectomy", MODEL) == {}
+
+
+def run_cli(monkeypatch, *arguments):
+    monkeypatch.setattr(sys, "argv", ["knowledge_packs", *arguments])
+    knowledge_packs.main()
+
+
+def test_cli_invalidates_one_procedure_or_every_pack(clock, monkeypatch, capsys):
+    for model in (MODEL, "gemini-1.5-flash"):
+        store_knowledge_pack("Laparoscopic Appendectomy", model, SECTIONS)
+    store_knowledge_pack("Cholecystectomy", MODEL, SECTIONS)
+
+    run_cli(monkeypatch, "--invalidate", "laparoscopic appendectomy", "--model", MODEL)
+    assert "Removed 1 knowledge packs" in capsys.readouterr().out
+    assert get_knowledge_pack("Laparoscopic Appendectomy", "gemini-1.5-flash") == SECTIONS
+
+    run_cli(monkeypatch, "--invalidate", "Laparoscopic Appendectomy")
+    assert "Removed 1 knowledge packs" in capsys.readouterr().out
+    assert get_knowledge_pack("Cholecystectomy", MODEL) == SECTIONS
+
+    run_cli(monkeypatch, "--invalidate-all")
+    assert "Removed 1 knowledge packs" in capsys.readouterr().out
+    assert get_knowledge_pack("Cholecystectomy", MODEL) == {}
+
+
+def test_only_procedure_level_sections_come_from_the_pack(monkeypatch):
+    # The crew creates its LLM clients and search tool on import; no call is made with these
+    for variable in ("GROQ_API_KEY", "GOOGLE_API_KEY", "TAVILY_API_KEY"):
+        monkeypatch.setenv(variable, os.environ.get(variable, "test"))
+    # Skipped where CrewAI or the LangChain providers are not installed
+    crew_module = pytest.importorskip("crews.pre_surgery_crew")
+
+    task_inputs = {}
+
+    def run_single_task(task, inputs, upstream, checkpoints=None):
+        task_inputs[task.agent.role] = {**inputs, **upstream}
+        return f"{task.agent.role} section"
+
+    monkeypatch.setattr(crew_module, "run_single_task", run_single_task)
+    monkeypatch.setattr(crew_module, "condense_document",
+                        lambda name, checkpoints, upstream: upstream[crew_module.extracted_input(name)])
+    graph = crew_module.pre_surgery_task_graph(crew_module.build_pre_surgery_crew(),
+                                               {"surgery_name": "Appendectomy", "patient_age": "82"}, SECTIONS)
+    results = graph.run(crew_module.extracted_documents([("prescription_text", "Warfarin 5 mg daily")]))
+
+    assert results["Surgical Instruments Advisor"] == SECTIONS["Surgical Instruments Advisor"]
+    # A pack section missing from the pack is written for a generic patient, to be stored for the next one
+    assert task_inputs["Surgical Technique Consultant"]["patient_age"] == \
+        crew_module.GENERIC_PATIENT_INPUTS["patient_age"]
+    # The risk analysis and the step-by-step plan depend on the patient, so they see the patient's documents
+    for role in ("Licensed Surgical Risk Mitigation Expert", "Surgical Procedure Planner"):
+        assert role not in crew_module.KNOWLEDGE_PACK_ROLES
+        assert task_inputs[role]["patient_age"] == "82"
+    assert task_inputs["Licensed Surgical Risk Mitigation Expert"]["prescription_text"] == "Warfarin 5 mg daily"
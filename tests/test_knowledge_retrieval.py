@@ -0,0 +1,31 @@
+import pytest
+
+# Skipped where the retrieval stack (LangChain, Pinecone) is not installed
+knowledge_retrieval = pytest.importorskip("helper_functions.knowledge_retrieval")
+
+from langchain_core.documents import Document
+
+deduplicate_passages = knowledge_retrieval.deduplicate_passages
+reciprocal_rank_fusion = knowledge_retrieval.reciprocal_rank_fusion
+
+
+def passage(chunk_id, text=None):
+    return Document(page_content=text or f"passage {chunk_id}", metadata={"chunk_id": chunk_id})
+
+
+def test_rrf_prefers_passages_ranked_by_both_searches():
+    vector = [passage("a"), passage("b"), passage("c")]
+    lexical = [passage("c"), passage("d"), passage("b")]
+    fused = reciprocal_rank_fusion([vector, lexical], top_k=4)
+    # b and c are in both lists: c scores 1/63 + 1/61, b 1/62 + 1/63
+    assert [document.metadata["chunk_id"] for document in fused] == ["c", "b", "a", "d"]
+
+
+def test_rrf_keeps_top_k():
+    fused = reciprocal_rank_fusion([[passage("a"), passage("b")], [passage("c")]], top_k=2)
+    assert len(fused) == 2
+
+
+def test_deduplicate_passages_ignores_case_and_whitespace():
+    documents = [passage("a", "Hold  aspirin\n7 days"), passage("b", "hold aspirin 7 days"), passage("c", "Other")]
+    assert [document.metadata["chunk_id"] for document in deduplicate_passages(documents)] == ["a", "c"]
@@ -0,0 +1,75 @@
+import types
+
+import pytest
+
+# Skipped where LangChain is not installed
+llm_cache = pytest.importorskip("helper_functions.llm_cache")
+
+from helper_functions import sqlite_cache
+from helper_functions.sqlite_cache import SQLiteCache
+
+PersistentLLMCache = llm_cache.PersistentLLMCache
+
+PROMPT = '[{"type": "human", "content": "List the medications"}]'
+LLM_STRING = "groq llama3-70b-8192 temperature=0.5"
+
+
+@pytest.fixture
+def store(tmp_path):
+    return SQLiteCache(str(tmp_path / "llm_responses.sqlite"))
+
+
+def test_key_covers_prompt_and_model(store):
+    cache = PersistentLLMCache(store)
+    cache.update(PROMPT, LLM_STRING, ["Metformin 500mg"])
+    assert cache.lookup(PROMPT, LLM_STRING) == ["Metformin 500mg"]
+    assert cache.lookup(PROMPT + " ", LLM_STRING) is None
+    assert cache.lookup(PROMPT, LLM_STRING.replace("0.5", "0")) is None
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_responses_expire(tmp_path, monkeypatch):
+    now = {"time": 1000.0}
+    monkeypatch.setattr(sqlite_cache, "time", types.SimpleNamespace(time=lambda: now["time"]))
+    cache = PersistentLLMCache(SQLiteCache(str(tmp_path / "llm_responses.sqlite"), ttl_seconds=60))
+    cache.update(PROMPT, LLM_STRING, ["Metformin 500mg"])
+    now["time"] += 30
+    assert cache.lookup(PROMPT, LLM_STRING) == ["Metformin 500mg"]
+    now["time"] += 31
+    assert cache.lookup(PROMPT, LLM_STRING) is None
+
+
+def test_size_limit_evicts_old_responses(tmp_path):
+    cache = PersistentLLMCache(SQLiteCache(str(tmp_path / "llm_responses.sqlite"), max_bytes=300))
+    for number in range(5):
+        cache.update(f"prompt {number}", LLM_STRING, ["x" * 100])
+    assert cache.lookup("prompt 0", LLM_STRING) is None
+    assert cache.lookup("prompt 4", LLM_STRING) == ["x" * 100]
+
+
+def test_replay_serves_recorded_calls_and_fails_on_others(store):
+    PersistentLLMCache(store).update(PROMPT, LLM_STRING, ["Metformin 500mg"])
+    replay = PersistentLLMCache(store, replay=True)
+    assert replay.lookup(PROMPT, LLM_STRING) == ["Metformin 500mg"]
+    with pytest.raises(llm_cache.LLMCacheMiss):
+        replay.lookup("an unrecorded prompt", LLM_STRING)
+
+
+def test_bypass_skips_the_lookup_but_stores_the_new_response(store):
+    cache = PersistentLLMCache(store)
+    cache.update(PROMPT, LLM_STRING, ["old draft"])
+    with llm_cache.bypassing_llm_cache():
+        assert cache.lookup(PROMPT, LLM_STRING) is None
+        cache.update(PROMPT, LLM_STRING, ["new draft"])
+    assert cache.lookup(PROMPT, LLM_STRING) == ["new draft"]
+
+
+def test_sampled_models_are_cached_only_when_they_opt_in(monkeypatch):
+    monkeypatch.setattr(llm_cache, "LLM_CACHE", "auto")
+    monkeypatch.setattr(llm_cache, "LLM_CACHE_REPLAY", False)
+    monkeypatch.setattr(llm_cache, "llm_cache", lambda: "cache")
+    assert llm_cache.llm_cache_for(0) == "cache"
+    assert llm_cache.llm_cache_for(0.5) is None
+    assert llm_cache.llm_cache_for(0.5, cacheable=True) == "cache"
+    monkeypatch.setattr(llm_cache, "LLM_CACHE", "0")
+    assert llm_cache.llm_cache_for(0, cacheable=True) is None
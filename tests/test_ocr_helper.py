@@ -0,0 +1,68 @@
+import io
+
+import pytest
+
+# Skipped where EasyOCR or OpenCV are not installed
+ocr_helper = pytest.importorskip("helper_functions.ocr_helper")
+
+import cv2
+import numpy as np
+from PIL import Image
+
+
+def page(width=1700, height=2200, specks=True):
+    """
+    A white letter page scanned at 200 DPI, with a block of text lines and a few specks of dust.
+    """
+    gray = np.full((height, width), 255, np.uint8)
+    for line in range(8):
+        cv2.putText(gray, "Cefazolin 2 g IV before incision", (400, 700 + 60 * line),
+                    cv2.FONT_HERSHEY_SIMPLEX, 1.2, 0, 3)
+    if specks:
+        for x, y in ((60, 80), (1600, 150), (90, 2100)):
+            gray[y:y + 6, x:x + 6] = 0
+    return gray
+
+
+def encode(gray, dpi=None):
+    buffer = io.BytesIO()
+    Image.fromarray(gray).save(buffer, format="PNG", **({"dpi": (dpi, dpi)} if dpi else {}))
+    return buffer.getvalue()
+
+
+def test_crop_keeps_the_text_block_and_drops_the_specks():
+    ys, xs = np.nonzero(page(specks=False) == 0)
+    text_width, text_height = xs.max() - xs.min() + 1, ys.max() - ys.min() + 1
+    cropped = ocr_helper.crop_to_text(page(), margin=16)
+    height, width = cropped.shape
+    # The text block plus the margin, give or take a few pixels of the 4x smaller thumbnail; the specks are ignored
+    assert text_width + 32 <= width <= text_width + 32 + 24
+    assert text_height + 32 <= height <= text_height + 32 + 24
+    assert (cropped == 0).sum() == (page(specks=False) == 0).sum()
+
+
+def test_textured_background_keeps_the_whole_frame():
+    noise = np.random.default_rng(0).integers(0, 256, (800, 600), dtype=np.uint8)
+    assert ocr_helper.crop_to_text(noise).shape == (800, 600)
+
+
+def test_blank_page_is_not_cropped():
+    blank = np.full((400, 300), 255, np.uint8)
+    assert ocr_helper.crop_to_text(blank).shape == (400, 300)
+
+
+def test_downsampling_uses_the_recorded_resolution():
+    gray = page(1200, 1500)
+    assert ocr_helper.image_dpi(encode(gray, dpi=600)) == pytest.approx(600, abs=0.1)
+    assert ocr_helper.downsample_to_dpi(gray, 200, source_dpi=600).shape == (500, 400)
+    # A camera's nominal 72 DPI says nothing about the page
+    assert ocr_helper.image_dpi(encode(gray, dpi=72)) is None
+    assert ocr_helper.image_dpi(encode(gray)) is None
+
+
+def test_downsampling_falls_back_to_the_page_size():
+    gray = page(1200, 1500)
+    # A 5 inch receipt at 300 DPI is brought down to 200 DPI
+    assert ocr_helper.downsample_to_dpi(gray, 200, page_long_side_inches=5).shape == (1000, 800)
+    # Without a page size an A4/letter page is assumed, which this image is already below
+    assert ocr_helper.downsample_to_dpi(gray, 200).shape == (1500, 1200)
@@ -0,0 +1,59 @@
+import os
+
+import pytest
+
+# The crews create their LLM clients and search tool on import; no call is made with these
+for variable in ("GROQ_API_KEY", "GOOGLE_API_KEY", "TAVILY_API_KEY"):
+    os.environ.setdefault(variable, "test")
+
+# Skipped where CrewAI or the LangChain providers are not installed
+pipeline = pytest.importorskip("crews.post_surgery_pipeline")
+
+
+@pytest.fixture
+def graph(monkeypatch):
+    """
+    The pipeline's task graph, with each task answering with its name instead of calling an LLM.
+    """
+    ran = {}
+
+    def run_pipeline_task(task, inputs, checkpoints, name, upstream):
+        ran[name] = sorted(upstream)
+        return f"{name} output"
+
+    monkeypatch.setattr(pipeline, "run_pipeline_task", run_pipeline_task)
+    graph, compilers, task_counts = pipeline.post_surgery_task_graph({}, checkpoints=None)
+    return graph, compilers, task_counts, ran
+
+
+def test_shared_analyses_replace_the_repeated_ones(graph):
+    graph, compilers, task_counts, ran = graph
+    assert task_counts == {"separate": 23, "shared": 3, "replaced_by_shared": 7, "coordinators": 3}
+    assert len(graph.nodes) == 23 - 7 - 3 + 3
+    for role in list(pipeline.SHARED_ANALYSIS_ROLES) + list(pipeline.COORDINATOR_ROLES):
+        assert not any(name.endswith(f": {role}") for name in graph.nodes)
+
+    graph.run()
+    assert len(ran) == len(graph.nodes)
+    assert ran[compilers["report"]] == ["medications", "patient_condition", "report: Postoperative Diagnosis Analyst"]
+    assert {"complications", "medications", "patient_condition"} <= set(ran[compilers["faqs"]])
+    assert {"complications", "medications"} <= set(ran[compilers["checklist"]])
+    assert "patient_condition" not in ran[compilers["checklist"]]
+
+
+def test_compilers_get_the_shared_analyses_as_context(graph):
+    graph, compilers, task_counts, ran = graph
+    shared_tasks = {name: graph.nodes[name].function.args[0] for name in ("medications", "patient_condition", "complications")}
+    report_compiler = graph.nodes[compilers["report"]].function.args[0]
+    assert shared_tasks["medications"] in report_compiler.context
+    assert shared_tasks["patient_condition"] in report_compiler.context
+    assert shared_tasks["complications"] not in report_compiler.context
+
+
+def test_savings_are_estimated_from_the_measured_calls():
+    task_counts = {"separate": 23, "shared": 3, "replaced_by_shared": 7, "coordinators": 3}
+    savings = pipeline.llm_call_savings(16, 48, task_counts)
+    assert savings.startswith("Made 48 LLM calls for 16 agent tasks")
+    # 4 repeated analyses and 3 coordinators skipped, at 3 calls per task
+    assert savings.endswith("about 21 LLM calls saved at the 3.0 calls per task measured.")
+    assert "no calls were measured" in pipeline.llm_call_savings(0, 0, task_counts)
@@ -0,0 +1,186 @@
+import asyncio
+import contextvars
+import threading
+import types
+
+import pytest
+
+from helper_functions import rate_limiter
+from helper_functions.rate_limiter import MemoryBuckets, RateLimitError, SQLiteBuckets
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    A fake clock for the limiter: sleeping advances it instead of waiting.
+    """
+    now = {"time": 1000.0, "slept": []}
+
+    def sleep(seconds):
+        now["slept"].append(seconds)
+        now["time"] += seconds
+
+    monkeypatch.setattr(rate_limiter, "time", types.SimpleNamespace(time=lambda: now["time"], sleep=sleep))
+    return now
+
+
+@pytest.fixture
+def limits(monkeypatch):
+    """
+    Sets LLM_RATE_LIMITS for the test, on fresh in-memory buckets.
+    """
+    def set_limits(spec):
+        monkeypatch.setattr(rate_limiter, "LLM_RATE_LIMITS", spec)
+    monkeypatch.setattr(rate_limiter, "_buckets", MemoryBuckets())
+    monkeypatch.setattr(rate_limiter, "_metrics", {})
+    return set_limits
+
+
+class Throttled(Exception):
+    status_code = 429
+
+    def __init__(self, retry_after=None):
+        super().__init__("rate limited")
+        self.response = types.SimpleNamespace(status_code=429, headers={"retry-after": retry_after} if retry_after else {})
+
+
+def test_rate_limits_parsing():
+    assert rate_limiter.rate_limits("groq=30/6000, Groq:llama3-8b=/1000,bad") == {
+        "groq": (30.0, 6000.0), "groq:llama3-8b": (None, 1000.0)}
+
+
+def test_model_entry_overrides_its_provider():
+    limits = rate_limiter.rate_limits("groq=30/6000,groq:llama3-8b=10/")
+    assert rate_limiter.limits_for("groq:llama3-8b", limits) == (10.0, None)
+    assert rate_limiter.limits_for("groq:llama3-70b", limits) == (30.0, 6000.0)
+    assert rate_limiter.limits_for("googlegenerativeai:gemini", limits) == (None, None)
+
+
+def test_requests_wait_for_the_bucket_to_refill(clock, limits):
+    limits("groq=2/")
+    assert rate_limiter.acquire("groq:llama3", 10) == 0
+    assert rate_limiter.acquire("groq:llama3", 10) == 0
+    # Two requests a minute refill one every 30 seconds
+    assert rate_limiter.acquire("groq:llama3", 10) == pytest.approx(30)
+
+
+def test_tokens_larger_than_the_bucket_wait_for_a_full_bucket(clock, limits):
+    limits("groq=/1000")
+    assert rate_limiter.acquire("groq:llama3", 600) == 0
+    # The second call asks for more than a minute's worth, so it waits for the bucket to fill up again
+    assert rate_limiter.acquire("groq:llama3", 5000) == pytest.approx(36)
+
+
+def test_settle_returns_unused_tokens(clock, limits):
+    limits("groq=/1000")
+    rate_limiter.acquire("groq:llama3", 900)
+    rate_limiter.settle("groq:llama3", reserved=900, used=300)
+    assert rate_limiter.acquire("groq:llama3", 700) == 0
+
+
+def test_throttle_delay_uses_the_provider_headers():
+    assert rate_limiter.throttle_delay(Throttled(retry_after="7"), attempt=0) == 7
+    assert rate_limiter.throttle_delay(Throttled(), attempt=2) == pytest.approx(4.5, abs=0.5)
+    assert rate_limiter.throttle_delay(ValueError("bad request"), attempt=0) is None
+    assert rate_limiter._parse_seconds("1m2.5s") == pytest.approx(62.5)
+    assert rate_limiter._parse_seconds("850ms") == pytest.approx(0.85)
+
+
+def test_throttled_call_is_retried_after_the_backoff(clock, limits):
+    limits("")
+    responses = [Throttled(retry_after="5"), "ok"]
+
+    def call():
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    assert rate_limiter.rate_limited_call("groq:llama3", ["hello"], call) == "ok"
+    assert clock["slept"] == [pytest.approx(5)]
+    metrics = rate_limiter.rate_limit_metrics()["buckets"]["groq:llama3"]
+    assert (metrics["calls"], metrics["throttled"]) == (2, 1)
+
+
+def test_async_call_is_retried_without_blocking_the_loop(clock, limits, monkeypatch):
+    limits("")
+    responses = [Throttled(retry_after="5"), "ok"]
+
+    async def sleep(seconds):
+        clock["slept"].append(seconds)
+        clock["time"] += seconds
+
+    async def call():
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    monkeypatch.setattr(rate_limiter, "asyncio", types.SimpleNamespace(sleep=sleep))
+    assert asyncio.run(rate_limiter.rate_limited_call_async("groq:llama3", ["hello"], call)) == "ok"
+    assert clock["slept"] == [pytest.approx(5)]
+
+
+def test_success_headers_correct_the_bucket(clock, limits):
+    limits("groq=30/6000")
+    rate_limiter.observe_rate_limit_headers("groq:llama3", {"x-ratelimit-remaining-requests": "29",
+                                                            "x-ratelimit-remaining-tokens": "100"})
+    # Other clients of the account used most of the tokens, so a large call waits for the refill
+    assert rate_limiter.acquire("groq:llama3", 400) == pytest.approx(3)
+
+
+def test_exhausted_headers_block_until_the_reset(clock, limits):
+    limits("")
+    rate_limiter.observe_rate_limit_headers("groq:llama3", {"x-ratelimit-remaining-requests": "0",
+                                                            "x-ratelimit-reset-requests": "2m59.5s"})
+    # The 179.5s reset is capped like any backoff
+    assert rate_limiter.acquire("groq:llama3", 10) == pytest.approx(rate_limiter.MAX_BACKOFF_SECONDS)
+    rate_limiter.observe_rate_limit_headers("groq:llama3", {"content-type": "application/json"})
+    assert rate_limiter.acquire("groq:llama3", 10) == 0
+
+
+def test_call_still_throttled_after_retries_fails(clock, limits, monkeypatch):
+    limits("")
+    monkeypatch.setattr(rate_limiter, "LLM_MAX_RETRIES", 1)
+
+    def call():
+        raise Throttled(retry_after="1")
+
+    with pytest.raises(RateLimitError):
+        rate_limiter.rate_limited_call("groq:llama3", ["hello"], call)
+
+
+def test_other_errors_are_not_retried(clock, limits):
+    limits("")
+    calls = []
+
+    def call():
+        calls.append(1)
+        raise ValueError("bad request")
+
+    with pytest.raises(ValueError):
+        rate_limiter.rate_limited_call("groq:llama3", ["hello"], call)
+    assert calls == [1]
+
+
+def test_calls_are_counted_in_the_block_and_its_threads(clock, limits):
+    limits("")
+    rate_limiter.rate_limited_call("groq:llama3", ["hello"], lambda: "before")
+    with rate_limiter.count_llm_calls() as counter:
+        rate_limiter.rate_limited_call("groq:llama3", ["hello"], lambda: "answer")
+        context = contextvars.copy_context()
+        thread = threading.Thread(target=context.run, args=(rate_limiter.rate_limited_call, "groq:llama3", ["hi"], lambda: "answer"))
+        thread.start()
+        thread.join()
+    rate_limiter.rate_limited_call("groq:llama3", ["hello"], lambda: "after")
+    assert counter["calls"] == 2
+
+
+def test_sqlite_buckets_are_shared_between_stores(tmp_path, clock):
+    path = str(tmp_path / "rate_limits.sqlite")
+    first, second = SQLiteBuckets(path), SQLiteBuckets(path)
+    limits = (1.0, None)
+    take = lambda state, now: rate_limiter._take(state, limits, 1, 0, now)
+    assert first.update("groq", limits, take) == 0
+    # The other process sees the request already taken
+    assert second.update("groq", limits, take) == pytest.approx(60)
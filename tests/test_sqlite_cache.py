@@ -0,0 +1,68 @@
+import types
+
+import pytest
+
+from helper_functions import sqlite_cache
+from helper_functions.sqlite_cache import SQLiteCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    Replaces the cache's clock with one the test advances by hand.
+    """
+    now = {"time": 1000.0}
+    monkeypatch.setattr(sqlite_cache, "time", types.SimpleNamespace(time=lambda: now["time"]))
+
+    def advance(seconds):
+        now["time"] += seconds
+
+    return advance
+
+
+def test_set_and_get(tmp_path):
+    cache = SQLiteCache(str(tmp_path / "cache.sqlite"))
+    cache.set("a", b"1")
+    assert cache.get("a") == b"1"
+    assert cache.get("missing") is None
+    assert cache.get_many(["a", "missing", "a"]) == {"a": b"1"}
+
+
+def test_evicts_least_recently_used_entry(tmp_path, clock):
+    cache = SQLiteCache(str(tmp_path / "cache.sqlite"), max_entries=2)
+    cache.set("a", b"1")
+    clock(1)
+    cache.set("b", b"2")
+    clock(1)
+    # Reading a makes b the least recently used
+    assert cache.get("a") == b"1"
+    clock(1)
+    cache.set("c", b"3")
+    assert cache.get("b") is None
+    assert cache.get_many(["a", "c"]) == {"a": b"1", "c": b"3"}
+
+
+def test_evicts_down_to_max_bytes(tmp_path, clock):
+    cache = SQLiteCache(str(tmp_path / "cache.sqlite"), max_bytes=10)
+    for key in ("a", "b", "c"):
+        cache.set(key, b"x" * 4)
+        clock(1)
+    assert cache.stats() == {"entries": 2, "bytes": 8}
+    assert cache.get("a") is None
+
+
+def test_expires_entries_after_ttl(tmp_path, clock):
+    cache = SQLiteCache(str(tmp_path / "cache.sqlite"), ttl_seconds=60)
+    cache.set("a", b"1")
+    clock(59)
+    assert cache.get("a") == b"1"
+    clock(2)
+    # Reading does not extend an entry's life
+    assert cache.get("a") is None
+
+
+def test_delete_prefix_escapes_wildcards(tmp_path):
+    cache = SQLiteCache(str(tmp_path / "cache.sqlite"))
+    cache.set_many({"pack_1:a": b"1", "pack_1:b": b"2", "packX1:c": b"3"})
+    assert cache.delete_prefix("pack_1:") == 2
+    assert cache.get_many(["pack_1:a", "pack_1:b", "packX1:c"]) == {"packX1:c": b"3"}
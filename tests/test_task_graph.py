@@ -0,0 +1,116 @@
+import threading
+import time
+
+import pytest
+
+from helper_functions.task_graph import TaskGraph, provider_limits
+
+
+def recorder(log, name, result=None, seconds=0.0):
+    def run(upstream):
+        log.append(("start", name))
+        time.sleep(seconds)
+        log.append(("end", name))
+        return result if result is not None else {**upstream, name: True}
+    return run
+
+
+def test_tasks_run_after_their_dependencies():
+    log = []
+    graph = TaskGraph(max_concurrency=4)
+    graph.add_task("medications", recorder(log, "medications"))
+    graph.add_task("labs", recorder(log, "labs"))
+    graph.add_task("risks", recorder(log, "risks"), depends_on=["medications", "labs"])
+    graph.add_task("report", recorder(log, "report"), depends_on=["risks"])
+    results = graph.run()
+
+    order = [name for event, name in log if event == "start"]
+    assert order.index("risks") > max(order.index("medications"), order.index("labs"))
+    assert order[-1] == "report"
+    assert log.index(("start", "risks")) > log.index(("end", "medications"))
+    assert results["risks"] == {"medications": {"medications": True}, "labs": {"labs": True}, "risks": True}
+
+
+def test_independent_tasks_run_concurrently():
+    barrier = threading.Barrier(2, timeout=5)
+    graph = TaskGraph(max_concurrency=2)
+    # Each waits for the other, so this only finishes if both run at once
+    graph.add_task("a", lambda upstream: barrier.wait())
+    graph.add_task("b", lambda upstream: barrier.wait())
+    graph.run()
+
+
+def test_provider_limit_serializes_its_tasks():
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    def task(upstream):
+        with lock:
+            running.append(1)
+            peak.append(len(running))
+        time.sleep(0.02)
+        with lock:
+            running.pop()
+
+    graph = TaskGraph(max_concurrency=4, provider_limits={"groq": 1})
+    for name in ("a", "b", "c"):
+        graph.add_task(name, task, provider="groq")
+    graph.run()
+    assert max(peak) == 1
+
+
+def test_inputs_are_provided_while_running():
+    graph = TaskGraph()
+    graph.add_input("lab_report")
+    graph.add_task("labs", lambda upstream: upstream["lab_report"].upper(), depends_on=["lab_report"])
+    assert graph.run([("lab_report", "hb 9.1")])["labs"] == "HB 9.1"
+
+
+def test_missing_input_is_an_error():
+    graph = TaskGraph()
+    graph.add_input("scan")
+    graph.add_task("scans", lambda upstream: upstream["scan"], depends_on=["scan"])
+    with pytest.raises(ValueError, match="scan"):
+        graph.run()
+
+
+def test_unknown_dependency_is_rejected():
+    graph = TaskGraph()
+    with pytest.raises(ValueError):
+        graph.add_task("report", lambda upstream: None, depends_on=["risks"])
+
+
+def test_failed_task_stops_the_graph():
+    ran = []
+    graph = TaskGraph()
+    graph.add_task("a", lambda upstream: 1 / 0)
+    graph.add_task("b", lambda upstream: ran.append("b"), depends_on=["a"])
+    with pytest.raises(ZeroDivisionError):
+        graph.run()
+    assert ran == []
+
+
+def test_progress_is_reported_to_the_callback():
+    messages = []
+    graph = TaskGraph(max_concurrency=1, on_progress=messages.append)
+    graph.add_input("lab_report")
+    graph.add_task("labs", lambda upstream: "anemia", depends_on=["lab_report"])
+    graph.add_task("report", lambda upstream: "report", depends_on=["labs"])
+    graph.run([("lab_report", "hb 9.1")])
+    assert messages == ["1 of 2 agent tasks done (last: labs)", "2 of 2 agent tasks done (last: report)"]
+
+
+def test_critical_path_follows_the_slowest_dependency():
+    log = []
+    graph = TaskGraph()
+    graph.add_task("fast", recorder(log, "fast"))
+    graph.add_task("slow", recorder(log, "slow", seconds=0.05))
+    graph.add_task("report", recorder(log, "report"), depends_on=["fast", "slow"])
+    graph.run()
+    assert [node.name for node in graph.critical_path()] == ["slow", "report"]
+
+
+def test_provider_limits_parsing():
+    assert provider_limits("Groq=2, googlegenerativeai=4") == {"groq": 2, "googlegenerativeai": 4}
+    assert provider_limits("") == {}
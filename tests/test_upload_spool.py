@@ -0,0 +1,77 @@
+import hashlib
+import io
+import mmap
+import os
+
+from helper_functions import upload_spool
+from helper_functions.upload_spool import spool_upload, spooled_uploads, uploads_contents
+
+
+class Upload(io.BytesIO):
+    """
+    An in-memory file named and sized like a Streamlit upload.
+    """
+
+    def __init__(self, name, data):
+        super().__init__(data)
+        self.name = name
+        self.size = len(data)
+
+
+class Stream:
+    """
+    A readable file without getbuffer(), read in chunks.
+    """
+
+    def __init__(self, name, data):
+        self.name = name
+        self.size = len(data)
+        self._file = io.BytesIO(data)
+
+    def seek(self, position):
+        self._file.seek(position)
+
+    def read(self, size):
+        return self._file.read(size)
+
+
+def test_small_upload_stays_in_memory():
+    data = b"%PDF-1.4 cefazolin 2 g" * 100
+    upload = spool_upload(Upload("rx.pdf", data), threshold=len(data))
+    assert upload.path is None
+    assert (upload.size, upload.digest) == (len(data), hashlib.sha256(data).hexdigest())
+    with upload.contents() as contents:
+        assert contents == data
+
+
+def test_small_stream_is_read_in_chunks(monkeypatch):
+    monkeypatch.setattr(upload_spool, "SPOOL_CHUNK_BYTES", 7)
+    data = b"lab report: Hb 9.1 g/dL"
+    upload = spool_upload(Stream("cbc.pdf", data), threshold=1024)
+    assert upload.data == data
+    assert upload.digest == hashlib.sha256(data).hexdigest()
+
+
+def test_large_upload_is_spooled_and_mapped(tmp_path, monkeypatch):
+    monkeypatch.setattr(upload_spool, "UPLOAD_SPOOL_DIR", str(tmp_path))
+    data = os.urandom(4096)
+    upload = spool_upload(Upload("ct.jpg", data), threshold=1024)
+    assert upload.data is None and os.path.dirname(upload.path) == str(tmp_path)
+    assert upload.digest == hashlib.sha256(data).hexdigest()
+    with upload.contents() as contents:
+        assert isinstance(contents, mmap.mmap)
+        assert contents[:] == data
+    assert contents.closed
+    upload.cleanup()
+    assert not os.path.exists(upload.path)
+
+
+def test_batch_contents_are_closed_and_spool_files_deleted(tmp_path, monkeypatch):
+    monkeypatch.setattr(upload_spool, "UPLOAD_SPOOL_DIR", str(tmp_path))
+    monkeypatch.setattr(upload_spool, "UPLOAD_SPOOL_THRESHOLD_BYTES", 8)
+    uploads = [("scan", Upload("ct.jpg", b"a large scan")), ("prescription", Upload("rx.jpg", b"small"))]
+    with spooled_uploads(uploads) as items:
+        with uploads_contents([upload for _, upload in items]) as contents:
+            assert [bytes(data) for data in contents] == [b"a large scan", b"small"]
+        assert contents[0].closed
+    assert os.listdir(tmp_path) == []